@@ -5,21 +5,30 @@ import re
 import os
 import io
 import sys
-import json
+import asyncio
 import pandas as pd
 import numpy as np
-from openai import OpenAI
 import traceback
-from glob import glob
 from datetime import datetime, timedelta
 import pytz
 import textwrap
 from logging_config import setup_logger
-from utils import is_query_valid
+from utils import client, is_query_valid, log_token_usage
+from ingest import COLUMN_VARIANTS, METRIC_COLUMNS, room_label
+from alerts import ALERT_RULES, describe_rule
+from data_store import load_range
+from query_cache import code_cache, normalize_query
+from results import dataframe_output
+from tracing import span
+from code_analysis import SAFE_BUILTINS, CodeRejected, compile_code, review_code
 
 logger = setup_logger(__name__)
 
 DATA_DIR = "./data/"
+# Bump when the prompt changes in a way that makes previously cached code stale
+PROMPT_VERSION = 5
+# Start code generation while the validator is still deciding
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "true").lower() == "true"
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
 if OPENAI_API_KEY:
@@ -27,69 +36,39 @@ if OPENAI_API_KEY:
 else:
     logger.error("OPENAI_API_KEY not found")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Whole words only, so an already readable 'Temperature' is left alone
+DISPLAY_REPLACEMENTS = {
+    'Co2': 'CO2',
+    'Avg': 'Average',
+    'Min': 'Minimum',
+    'Max': 'Maximum',
+    'Temp': 'Temperature',
+    'Rh': 'Humidity'
+}
+_DISPLAY_WORDS = re.compile(r"\b(" + "|".join(DISPLAY_REPLACEMENTS) + r")\b")
 
 def format_display_name(name):
     """Convert underscore names to readable format"""
-    # Handle special cases and common patterns
-    name = str(name)
-    
-    # Replace underscores with spaces
-    formatted = name.replace('_', ' ')
-    
-    # Title case each word
-    formatted = formatted.title()
-    
+    # Replace underscores with spaces and title case each word
+    formatted = str(name).replace('_', ' ').title()
+
     # Handle special cases for better readability
-    replacements = {
-        'Co2': 'CO2',
-        'Avg': 'Average',
-        'Min': 'Minimum',
-        'Max': 'Maximum',
-        'Temp': 'Temperature',
-        'Rh': 'Humidity'
+    return _DISPLAY_WORDS.sub(lambda m: DISPLAY_REPLACEMENTS[m.group(1)], formatted)
+
+def load_data_files(snapshot, start=None, end=None):
+    """Each room's readings in [start, end): the snapshot's rows in memory, and older days from the day partitions it overlaps"""
+    rows = load_range(snapshot.readings, snapshot.hot_start, start, end)
+    labels = {room_label(room): room for room in snapshot.rollups}
+    return {
+        labels[label]: frame.drop(columns='room').reset_index()
+        for label, frame in rows.groupby('room', observed=True)
+        if label in labels
     }
-    
-    for old, new in replacements.items():
-        formatted = formatted.replace(old, new)
-    
-    return formatted
-
-def load_data_files():
-    """Load all .ndjson files from the data directory"""
-    all_files = glob(os.path.join(DATA_DIR, "*.ndjson"))
-    datasets = {}
-
-    for file_path in all_files:
-        room_name = os.path.basename(file_path).split('.')[0]
-        rows = []
-        try:
-            with open(file_path, 'r') as f:
-                for line in f:
-                    try:
-                        rows.append(json.loads(line.strip()))
-                    except json.JSONDecodeError:
-                        continue
-            if rows:
-                df = pd.DataFrame(rows)
-                df = normalize_columns(df)
-                datasets[room_name] = df
-        except Exception as e:
-            logger.error(f"Error loading data file: {e}")
-
-    return datasets
 
 def normalize_columns(df):
     """Normalize column names to standard format"""
-    mapping = {
-        'co2': ['co2', 'CO2', 'CO2 (ppm)', 'CO2 (PPM)', 'co2_ppm', 'carbon_dioxide'],
-        'humidity': ['rh', 'RH', 'Relative Humidity (%)', 'humidity', 'Humidity', 'relative_humidity'],
-        'temperature': ['temp', 'Temp', 'Temperature (°C)', 'Temperature (\u00b0C)', 'temperature', 'Temperature'],
-        'timestamp': ['timestamp', 'time', 'datetime', 'date_time']
-    }
-
     col_map = {}
-    for standard_name, variants in mapping.items():
+    for standard_name, variants in COLUMN_VARIANTS.items():
         for variant in variants:
             for col in df.columns:
                 if variant.lower() == col.lower():
@@ -106,141 +85,160 @@ def normalize_columns(df):
     logger.info("Column normalization completed")
     return df
 
-def create_prompt(datasets, user_query):
-    """Create a comprehensive prompt for the LLM"""
-    
-    data_description = "You have air quality data from these rooms:\n"
-    for room, df in datasets.items():
-        sample_data = df.head(2).to_string(index=False) if not df.empty else "No data"
-        data_description += f"- {room}: {len(df)} records, columns: {', '.join(df.columns)}\n"
-        data_description += f"  Sample data:\n{sample_data}\n\n"
-
-    prompt_template = f"""
-{data_description}
+# Everything that does not depend on the data or the question. It is sent
+# first and byte-for-byte identical on every request so the provider's
+# prompt-prefix cache can reuse it.
+SYSTEM_PROMPT = """You are a helpful assistant who writes Python code to analyze air quality data. Always ensure your code handles timezone-aware timestamps properly and works directly on the shared `readings` DataFrame without copying it. Use clean, readable column names without underscores.
 
 You are an AI assistant that analyzes air quality data. Write Python code to answer the user's question.
 
 IMPORTANT GUIDELINES:
-1. The DataFrames are available as variables named exactly like the room names (e.g., 'Room_1', 'Room_2', etc.)
-2. All DataFrames have standardized columns: 'timestamp', 'co2', 'temperature', 'humidity'
-3. Always work with copies of DataFrames to avoid pandas warnings: df = df.copy()
-4. Always convert timestamps properly: df['timestamp'] = pd.to_datetime(df['timestamp'])
-5. **CRITICAL**: When comparing timestamps, ensure timezone consistency:
-   - Use pd.Timestamp with timezone: pd.Timestamp('2025-07-19', tz='UTC')
-   - Or make timestamps timezone-naive: df['timestamp'].dt.tz_localize(None)
-   - Or use datetime with timezone: datetime(2025, 7, 19, tzinfo=pytz.UTC)
-6. For time-based analysis, use pandas datetime operations
-7. Your final output should be either:
+1. `readings` is indexed by 'timestamp', a sorted, timezone-aware UTC DatetimeIndex
+2. Its columns are 'room' (categorical, values like 'Room 1'), 'co2', 'temperature' and 'humidity' (float32)
+3. `readings` is shared and read-only. Do not copy it, build per-room copies, concat pieces of it, or re-parse
+   or re-localize its timestamps:
+   - Select a time range with readings.loc[start:end] (a binary search on the sorted index)
+   - Select rooms with readings[readings['room'] == 'Room 1']
+   - Aggregate per room with readings.groupby('room', observed=True)
+4. `readings` may hold only the most recent days (the data summary says where it starts). For older
+   readings call load_range(start=None, end=None, rooms=None), which returns the same layout for [start, end)
+   and reads only the days that range covers; never call it without a start
+5. **PREFER ROLLUPS**: For mean/min/max/std/count/median/percentiles of co2, temperature or humidity
+   per room over a time range, use the pre-aggregated `rollups` helper instead of scanning `readings`:
+   - rollups.summary(metric, start=None, end=None, rooms=None, stats=("mean", "min", "max"))
+     returns one row per room with columns 'Room' plus one column per statistic
+     ('Count', 'Sum', 'Mean', 'Std', 'Min', 'Max', 'Median', 'P95', ...)
+   - rollups.series(metric, freq="hour", start=None, end=None, rooms=None, stats=("mean",))
+     returns one row per room and bucket with columns 'Room', 'Time' and one column per statistic;
+     freq is "minute", "hour" or "day"
+   - metric is 'co2', 'temperature' or 'humidity'; rooms is e.g. "Room 1" or a list; the range is [start, end)
+   - Rollups cover the whole history, including days before `readings` starts
+   - Percentiles are approximate; use `readings` when an exact value per reading is needed
+6. **ALERTS**: `alerts` holds the alerts fired so far (the data summary lists the rules). For questions about
+   alerts, anomalies or a metric crossing a rule's limit, look them up there instead of scanning `readings`:
+   - It is indexed by 'start', a sorted UTC DatetimeIndex, so alerts.loc[start:end] selects by start time
+   - Columns: 'room', 'rule', 'metric', 'kind' ('threshold', 'rate' or 'zscore'), 'end' (last reading
+     that broke the rule), 'peak' (the most extreme value, rate per hour or |z|), 'limit', 'readings'
+     (how many readings broke it) and 'active' (still going)
+   - An alert that started before a range but ended inside it has 'end' >= the range start
+7. **CRITICAL**: Compare timestamps only with timezone-aware values:
+   - pd.Timestamp('2025-07-19', tz='UTC') or pd.Timestamp.now(tz='UTC')
+   - or datetime(2025, 7, 19, tzinfo=pytz.UTC)
+8. Your final output should be either:
    - A pandas DataFrame (assign to variable 'result')
    - A descriptive string (assign to variable 'result')
-8. Round numeric values to 2 decimal places for readability
-9. Handle missing or unavailable data gracefully, do not retun null.
-10. Use .loc[] for setting values to avoid pandas warnings
-11. **FORMATTING**: Use clean, readable column names without underscores. Use spaces and proper capitalization.
+9. Round numeric values to 2 decimal places for readability
+10. Handle missing or unavailable data gracefully, do not retun null.
+11. Use .loc[] for setting values on DataFrames you create
+12. **FORMATTING**: Use clean, readable column names without underscores. Use spaces and proper capitalization.
     - Good: 'Room Name', 'Average Temperature', 'Morning Average'
     - Bad: 'room_name', 'avg_temp', 'morning_avg'
 
 EXAMPLES:
 
-Example 1 - Last week analysis (timezone-aware):
+Example 1 - Last week's readings:
 ```python
-# Get current time in UTC
 now = pd.Timestamp.now(tz='UTC')
-one_week_ago = now - pd.Timedelta(days=7)
-
-# Combine all room data
-all_rooms = []
-room_names = [name for name in locals().keys() if 'Room' in name]
+last_week = readings.loc[now - pd.Timedelta(days=7):]
 
-for room_name in room_names:
-    if room_name in locals():
-        df = locals()[room_name].copy()
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        # Ensure timezone consistency
-        if df['timestamp'].dt.tz is None:
-            df['timestamp'] = df['timestamp'].dt.tz_localize('UTC')
-        
-        # Filter for last week
-        last_week_data = df[df['timestamp'] >= one_week_ago]
-        if not last_week_data.empty:
-            last_week_data.loc[:, 'Room Name'] = room_name.replace('_', ' ')
-            all_rooms.append(last_week_data)
-
-if all_rooms:
-    combined = pd.concat(all_rooms, ignore_index=True)
-    # Your analysis here
-    result = combined
+if not last_week.empty:
+    result = last_week.reset_index().rename(columns={
+        'timestamp': 'Time', 'room': 'Room Name', 'co2': 'CO2', 'temperature': 'Temperature', 'humidity': 'Humidity'
+    })
 else:
     result = "No data available for the last week"
 ```
 
-Example 2 - Room comparison with clean formatting:
+Example 2 - Room comparison using rollups:
 ```python
-room_stats = []
-room_names = [name for name in locals().keys() if 'Room' in name]
-
-for room_name in room_names:
-    if room_name in locals():
-        df = locals()[room_name].copy()
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        # Handle timezone
-        if df['timestamp'].dt.tz is None:
-            df['timestamp'] = df['timestamp'].dt.tz_localize('UTC')
-        
-        avg_temp = df['temperature'].mean()
-        if not pd.isna(avg_temp):
-            room_stats.append({{'Room Name': room_name.replace('_', ' '), 'Average Temperature': round(avg_temp, 2)}})
+now = pd.Timestamp.now(tz='UTC').floor('D')
+stats = rollups.summary('temperature', start=now - pd.Timedelta(days=7), end=now, stats=['mean', 'max'])
 
-if room_stats:
-    result = pd.DataFrame(room_stats)
+if not stats.empty and stats['Mean'].notna().any():
+    stats = stats.rename(columns={'Room': 'Room Name', 'Mean': 'Average Temperature', 'Max': 'Maximum Temperature'})
+    result = stats.round(2)
 else:
-    result = "No room data available"
+    result = "No room data available for the last week"
 ```
+"""
 
-User Question: "{user_query}"
+_data_summary = (None, None)
+
+def describe_data(snapshot):
+    """Schema and per-room coverage of the readings, computed once per data version"""
+    global _data_summary
+    version, summary = _data_summary
+    if version == snapshot.version:
+        return summary
+
+    readings = snapshot.readings
+    summary = "You have air quality data from these rooms, all in one DataFrame named `readings`:\n"
+    summary += "Columns: " + ", ".join(f"{name} ({dtype})" for name, dtype in readings.dtypes.items())
+    summary += f"; index: timestamp ({readings.index.dtype})\n"
+    for room, rows in readings.groupby('room', observed=True):
+        ranges = ", ".join(f"{metric} {rows[metric].min():.2f}-{rows[metric].max():.2f}" for metric in METRIC_COLUMNS)
+        summary += f"- {room}: {len(rows)} records from {rows.index[0]:%Y-%m-%d %H:%M} to {rows.index[-1]:%Y-%m-%d %H:%M} UTC; {ranges}\n"
+    if snapshot.hot_start is not None:
+        first_days = [rollups.levels["day"].keys[0] for rollups in snapshot.rollups.values() if len(rollups.levels["day"].keys)]
+        if first_days and min(first_days) < snapshot.hot_start:
+            summary += (
+                f"`readings` starts at {pd.Timestamp(snapshot.hot_start, tz='UTC'):%Y-%m-%d}. Older readings back to "
+                f"{pd.Timestamp(min(first_days), tz='UTC'):%Y-%m-%d} are available through load_range() and rollups.\n"
+            )
+    if snapshot.alerts is not None:
+        summary += f"\nAlert rules ({len(snapshot.alerts)} alerts in `alerts`):\n"
+        for rule in ALERT_RULES:
+            summary += f"- {rule.name} ({rule.kind}): {describe_rule(rule)}\n"
+
+    _data_summary = (snapshot.version, summary)
+    return summary
+
+def create_prompt(snapshot, user_query):
+    """Create the chat messages for the LLM: static instructions, data summary, then the question"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": describe_data(snapshot)},
+        {"role": "user", "content": f"""User Question: "{user_query}"
 
 Write Python code to answer this question. Remember to:
-- Handle timezone-aware timestamps properly
+- Filter `readings` by time with .loc on its index instead of copying or concatenating
 - Use clean, readable column names with spaces instead of underscores
-- Format room names nicely (e.g., "Room 1" instead of "Room_1")
-"""
-    return prompt_template
-
-def run_openai_code_agent(datasets, user_query):
-    """Generate Python code using OpenAI to answer the user query"""
-
-    if not is_query_valid(user_query):
-        return {
-            "success": False,
-            "type": "text",
-            "data": "Sorry, I couldn't understand your question. Please try rephrasing it."
-        }
-
-    prompt = create_prompt(datasets, user_query)
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant who writes Python code to analyze air quality data. Always ensure your code handles timezone-aware timestamps properly and avoids pandas warnings by using .copy() and .loc[] appropriately. Use clean, readable column names without underscores."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.4
-        )
-        code = response.choices[0].message.content
-
-        # Extract the code block if returned as markdown
-        if "```python" in code:
-            code = code.split("```python")[1].split("```")[0].strip()
-        elif "```" in code:
-            code = code.split("```")[1]
-            if code.startswith("python"):
-                code = code[len("python"):].strip()
-            code = code.strip()
-
-        # Add necessary imports with timezone utilities
-        safe_boilerplate = """
+"""},
+    ]
+
+async def _stream_completion(messages, on_token):
+    """Content of a streamed completion, passing each token to on_token as it arrives"""
+    stream = await client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=messages,
+        temperature=0.4,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+    parts = []
+    async for chunk in stream:
+        if chunk.usage is not None:
+            log_token_usage("generation", chunk)
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            on_token(chunk.choices[0].delta.content)
+    return "".join(parts)
+
+def extract_code(content):
+    """The script in an LLM reply, with the imports it may rely on prepended"""
+    code = content
+
+    # Extract the code block if returned as markdown
+    if "```python" in code:
+        code = code.split("```python")[1].split("```")[0].strip()
+    elif "```" in code:
+        code = code.split("```")[1]
+        if code.startswith("python"):
+            code = code[len("python"):].strip()
+        code = code.strip()
+
+    # Add necessary imports with timezone utilities
+    safe_boilerplate = """
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
@@ -252,10 +250,46 @@ warnings.filterwarnings('ignore', category=pd.errors.SettingWithCopyWarning)
 utc = pytz.UTC
 """
 
-        final_code = safe_boilerplate + "\n\n" + code
-        final_code = textwrap.dedent(final_code)
+    final_code = safe_boilerplate + "\n\n" + code
+    return textwrap.dedent(final_code)
+
+def rejection_feedback(problems):
+    """Follow-up message asking the LLM to rewrite a script code_analysis rejected"""
+    issues = "\n".join(f"- {problem}" for problem in problems)
+    return f"""That code cannot be run:
+{issues}
+
+Rewrite it to answer the same question without these problems. Return only the corrected Python code."""
+
+async def generate_code(snapshot, user_query, on_token=None, rejected=None):
+    """Ask the LLM for a script answering the query, or an error dict.
+
+    With on_token the completion is streamed and each token is passed to it.
+    rejected is an earlier (script, problems) attempt to be rewritten.
+    """
+    with span("prompt"):
+        messages = create_prompt(snapshot, user_query)
+        if rejected is not None:
+            script, problems = rejected
+            messages += [
+                {"role": "assistant", "content": f"```python\n{script}\n```"},
+                {"role": "user", "content": rejection_feedback(problems)},
+            ]
+    try:
+        with span("generation"):
+            if on_token is not None:
+                content = await _stream_completion(messages, on_token)
+            else:
+                response = await client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=messages,
+                    temperature=0.4
+                )
+                log_token_usage("generation", response)
+                content = response.choices[0].message.content
 
-        return final_code
+        with span("extraction"):
+            return extract_code(content)
 
     except Exception as e:
         logger.error(f"OpenAI API Error: {str(e)}")
@@ -265,25 +299,132 @@ utc = pytz.UTC
             "data": "Sorry, I'm having trouble connecting to the AI service."
         }
 
+INVALID_QUERY = {
+    "success": False,
+    "type": "text",
+    "data": "Sorry, I couldn't understand your question. Please try rephrasing it."
+}
+
+REJECTED_CODE = {
+    "success": False,
+    "type": "text",
+    "data": "Sorry, I couldn't write a safe and efficient analysis for that question. Please try rephrasing it."
+}
+
+async def _relay_tokens(generation, tokens):
+    """Yield token events from the queue until the generation task finishes"""
+    # Tokens that arrived while validating are queued and come out first
+    while not generation.done():
+        next_token = asyncio.ensure_future(tokens.get())
+        await asyncio.wait({next_token, generation}, return_when=asyncio.FIRST_COMPLETED)
+        if next_token.done():
+            yield "token", {"text": next_token.result()}
+        else:
+            next_token.cancel()
+    while not tokens.empty():
+        yield "token", {"text": tokens.get_nowait()}
+
+async def _reviewed(generation):
+    """The generated script after code_analysis, with any problems that block running it"""
+    code = await generation
+    if not isinstance(code, str):
+        return code, []
+    with span("analysis"):
+        return review_code(code)
+
+async def code_agent_events(snapshot, user_query, stream_tokens=False):
+    """Generate code for the query, yielding (event, data) pairs as work progresses.
+
+    Events are "validation" with the validator's verdict, "token" with a piece
+    of the generated code when stream_tokens is set, "rejected" when the
+    script failed code_analysis and is being regenerated once, and finally
+    "code" with the script or an error dict.
+    """
+    cache_key = f"v{PROMPT_VERSION}:{normalize_query(user_query)}"
+    cached_code = code_cache.get(cache_key)
+    if cached_code is not None:
+        logger.info("Generated code cache hit")
+        yield "validation", {"valid": True, "cached": True}
+        yield "code", cached_code
+        return
+
+    tokens = asyncio.Queue()
+    on_token = tokens.put_nowait if stream_tokens else None
+    generation = None
+    if SPECULATIVE_GENERATION:
+        generation = asyncio.create_task(generate_code(snapshot, user_query, on_token))
+
+    valid = await is_query_valid(user_query)
+    yield "validation", {"valid": valid}
+    if not valid:
+        if generation is not None:
+            generation.cancel()
+        yield "code", INVALID_QUERY
+        return
+
+    if generation is None:
+        generation = asyncio.create_task(generate_code(snapshot, user_query, on_token))
+    if stream_tokens:
+        async for event in _relay_tokens(generation, tokens):
+            yield event
+
+    code, problems = await _reviewed(generation)
+    if problems:
+        # Ask for a rewrite once rather than running something slow or unsafe
+        logger.warning(f"Generated code rejected: {'; '.join(problems)}")
+        yield "rejected", {"problems": problems}
+        generation = asyncio.create_task(generate_code(snapshot, user_query, on_token, rejected=(code, problems)))
+        if stream_tokens:
+            async for event in _relay_tokens(generation, tokens):
+                yield event
+        code, problems = await _reviewed(generation)
+        if problems:
+            logger.warning(f"Regenerated code rejected: {'; '.join(problems)}")
+            yield "code", REJECTED_CODE
+            return
+
+    if isinstance(code, str):
+        code_cache.set(cache_key, code)
+    yield "code", code
+
+async def run_openai_code_agent(snapshot, user_query):
+    """Generate Python code using OpenAI to answer the user query"""
+    async for event, data in code_agent_events(snapshot, user_query):
+        if event == "code":
+            return data
+
+def forget_generated_code(user_query):
+    """Drop a cached script, e.g. after it failed to execute"""
+    code_cache.pop(f"v{PROMPT_VERSION}:{normalize_query(user_query)}")
+
+def _format_values(column):
+    """format_display_name over a column, computed once per distinct value"""
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = [format_display_name(value) for value in column.cat.categories]
+        if len(set(categories)) == len(categories):
+            return column.cat.rename_categories(categories)
+        column = column.astype(object)
+    codes, uniques = pd.factorize(column)
+    formatted = np.array([format_display_name(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(formatted[codes], index=column.index, name=column.name)
+
 def format_dataframe_for_display(df):
     """Format DataFrame columns and content for display"""
     if not isinstance(df, pd.DataFrame):
         return df
-    
-    display_df = df.copy()
-    
-    # Format column names
-    new_columns = {}
-    for col in display_df.columns:
-        new_columns[col] = format_display_name(col)
-    
-    display_df = display_df.rename(columns=new_columns)
-    
+
+    display_df = df.rename(columns=format_display_name)
+
     # Format room names in data if there's a room-related column
-    for col in display_df.columns:
+    for position, col in enumerate(display_df.columns):
         if 'room' in col.lower():
-            display_df[col] = display_df[col].apply(lambda x: format_display_name(x) if pd.notna(x) else x)
-    
+            display_df.isetitem(position, _format_values(display_df.iloc[:, position]))
+
+    # float32 readings would otherwise serialize as e.g. 701.239990234375;
+    # going through their shortest repr keeps 701.24
+    for position in np.flatnonzero(display_df.dtypes == np.float32):
+        display_df.isetitem(position, display_df.iloc[:, position].astype(str).astype(np.float64))
+
     return display_df
 
 def clean_variable_name(name: str) -> str:
@@ -293,14 +434,17 @@ def clean_variable_name(name: str) -> str:
         var_name = var_name[len("sensor_data_"):]
     return var_name
 
-def execute_user_code(code: str, datasets: dict):
-    """Execute the generated code safely with the datasets"""
+def execute_user_code(code: str, datasets: dict, helpers: dict = None):
+    """Execute the generated code safely with the datasets and helper objects"""
 
-    # Prepare the local environment with datasets as variables
+    # Prepare the local environment with datasets as variables. Sandbox
+    # workers run with pandas copy-on-write, where a shallow copy is enough
+    # to keep this script's edits off the shared frames.
+    deep_copy = not pd.get_option("mode.copy_on_write")
     local_env = {}
     for room, df in datasets.items():
         var_name = clean_variable_name(room)
-        local_env[var_name] = df.copy()
+        local_env[var_name] = df.copy(deep=deep_copy)
 
     # Add timezone and pandas/numpy utilities
     local_env['utc'] = pytz.UTC
@@ -309,6 +453,7 @@ def execute_user_code(code: str, datasets: dict):
     local_env['datetime'] = datetime
     local_env['timedelta'] = timedelta
     local_env['pytz'] = pytz
+    local_env.update(helpers or {})
 
     stdout = io.StringIO()
     sys_stdout = sys.stdout
@@ -329,18 +474,18 @@ def execute_user_code(code: str, datasets: dict):
             logger.error(f"Generated code is not a string, got {type(code)}")
             return {"success": False, "data": f"Please try again"}
 
-        # SECURITY WARNING: This executes arbitrary Python code and is UNSAFE for production
-        # - Allows full filesystem access (read/write/delete)
-        # - Permits system command execution
-        # - Enables network access
-        # - No sandboxing or memory limits
-        # ONLY use in controlled development environments
-        # For production, implement:
-        # 1. Proper sandboxing (Docker, gVisor, nsjail)
-        # 2. Timeout enforcement
-        # 3. Restricted builtins
-        # 4. Input validation
-        exec(code, {"__builtins__": __builtins__}, local_env)
+        # SECURITY WARNING: review_code() and the restricted builtins only make
+        # escaping harder; this still runs generated Python in-process.
+        # For production, run the sandbox workers under OS-level isolation
+        # (Docker, gVisor, nsjail)
+        try:
+            compiled = compile_code(code)
+        except CodeRejected as e:
+            logger.warning(f"Refusing to run generated code: {e}")
+            return REJECTED_CODE
+
+        with span("exec"):
+            exec(compiled, {"__builtins__": SAFE_BUILTINS}, local_env)
 
         if 'result' in local_env:
             result = local_env['result']
@@ -359,13 +504,9 @@ def execute_user_code(code: str, datasets: dict):
         return {"success": False, "data": "Sorry I have encountered an error while processing your request. Please try again"}
     
     if isinstance(result, pd.DataFrame):
-        formatted_df = format_dataframe_for_display(result)
-        return {
-            "success": True,
-            "type": "dataframe",
-            "data": formatted_df.to_dict(orient="records"),
-            "columns": list(formatted_df.columns)
-        }
+        # Long frames come back with their first page; see results.store_frame
+        with span("format", rows=len(result)):
+            return dataframe_output(format_dataframe_for_display(result))
 
     elif isinstance(result, (str, int, float)):
         formatted_result = str(result)
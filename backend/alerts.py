@@ -0,0 +1,272 @@
+import os
+import json
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from logging_config import setup_logger
+from ingest import METRIC_COLUMNS, room_label
+
+logger = setup_logger(__name__)
+
+# JSON file with a list of rules replacing DEFAULT_RULES, e.g.
+# [{"name": "co2_above_1200", "kind": "threshold", "metric": "co2", "op": "above", "limit": 1200}]
+ALERT_RULES_FILE = os.getenv("ALERT_RULES_FILE", "")
+
+# An alert rule on one metric. kind is
+#   "threshold": the reading itself is compared with limit
+#   "rate":      the change since the room's previous reading, in units per
+#                hour; with a window, of readings exponentially smoothed over
+#                about `window` readings, so sensor noise doesn't fire it
+#   "zscore":    how many standard deviations the reading is from an
+#                exponentially weighted mean over about `window` readings;
+#                it only fires once `window` readings have been seen
+# op is "above", "below" or "either" (the magnitude is above limit).
+Rule = namedtuple("Rule", ["name", "kind", "metric", "op", "limit", "window"], defaults=(None,))
+
+KINDS = ("threshold", "rate", "zscore")
+OPS = ("above", "below", "either")
+
+DEFAULT_RULES = (
+    Rule("co2_above_1000", "threshold", "co2", "above", 1000),
+    Rule("temperature_above_27", "threshold", "temperature", "above", 27),
+    Rule("temperature_below_18", "threshold", "temperature", "below", 18),
+    Rule("humidity_above_60", "threshold", "humidity", "above", 60),
+    Rule("humidity_below_30", "threshold", "humidity", "below", 30),
+    Rule("co2_rising_fast", "rate", "co2", "above", 2000, 10),
+    Rule("co2_anomaly", "zscore", "co2", "either", 4, 96),
+    Rule("temperature_anomaly", "zscore", "temperature", "either", 4, 96),
+    Rule("humidity_anomaly", "zscore", "humidity", "either", 4, 96),
+)
+
+HOUR_NS = 3600 * 10**9
+_NAT = np.iinfo(np.int64).min
+
+
+def load_rules(path=ALERT_RULES_FILE):
+    """The rules in path, or DEFAULT_RULES when no file is configured"""
+    if not path:
+        return DEFAULT_RULES
+    with open(path) as f:
+        rules = tuple(Rule(**rule) for rule in json.load(f))
+    for rule in rules:
+        if rule.kind not in KINDS or rule.op not in OPS or rule.metric not in METRIC_COLUMNS:
+            raise ValueError(f"Invalid alert rule {rule.name}: kind, op or metric not recognised")
+        if rule.kind == "zscore" and not rule.window:
+            raise ValueError(f"Invalid alert rule {rule.name}: zscore rules need a window")
+    if len({rule.name for rule in rules}) != len(rules):
+        raise ValueError("Alert rule names must be unique")
+    logger.info(f"Loaded {len(rules)} alert rules from {path}")
+    return rules
+
+
+ALERT_RULES = load_rules()
+
+
+def describe_rule(rule):
+    """A rule in words, e.g. 'co2 above 1000'"""
+    if rule.kind == "threshold":
+        return f"{rule.metric} {rule.op} {rule.limit:g}"
+    if rule.kind == "rate":
+        direction = {"above": "rising", "below": "falling", "either": "changing"}[rule.op]
+        smoothed = f" (smoothed over about {rule.window} readings)" if rule.window else ""
+        return f"{rule.metric} {direction} faster than {rule.limit:g} per hour{smoothed}"
+    side = {"above": "above", "below": "below", "either": "away from"}[rule.op]
+    return f"{rule.metric} more than {rule.limit:g} standard deviations {side} its mean over about {rule.window} readings"
+
+
+def empty_events(labels=(), rules=ALERT_RULES):
+    return _event_frame(_no_events(), np.empty(0, dtype=np.int16), np.empty(0, dtype=bool), labels, rules)
+
+
+def _no_events():
+    """(rule, start, end, peak, readings) columns of no events"""
+    return (np.empty(0, dtype=np.int16), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+            np.empty(0, dtype=np.float64), np.empty(0, dtype=np.int64))
+
+
+def _event_frame(events, rooms, active, labels, rules):
+    """The event table: one row per excursion, indexed by its start and sorted by it, then room and rule"""
+    rule, start, end, peak, readings = events
+    # Rule is part of the key so the order does not depend on how the rows were batched
+    order = np.lexsort((rule, rooms, start))
+    rule = rule[order]
+    metrics = np.array([METRIC_COLUMNS.index(r.metric) for r in rules], dtype=np.int16)
+    kinds = np.array([KINDS.index(r.kind) for r in rules], dtype=np.int16)
+    limits = np.array([r.limit for r in rules], dtype=np.float64)
+    return pd.DataFrame(
+        {
+            "room": pd.Categorical.from_codes(rooms[order], categories=labels),
+            "rule": pd.Categorical.from_codes(rule, categories=[r.name for r in rules]),
+            "metric": pd.Categorical.from_codes(metrics[rule], categories=METRIC_COLUMNS),
+            "kind": pd.Categorical.from_codes(kinds[rule], categories=KINDS),
+            "end": pd.to_datetime(end[order], utc=True),
+            "peak": peak[order],
+            "limit": limits[rule],
+            "readings": readings[order],
+            "active": active[order],
+        },
+        index=pd.DatetimeIndex(pd.to_datetime(start[order], utc=True), name="start"),
+    )
+
+
+def _smooth(values, window, state, key, initial=None):
+    """values exponentially smoothed over about window readings, continuing from state[key].
+
+    The result leads with that starting value (initial, or the first of
+    values, when there is no state yet).
+    """
+    alpha = 2 / (window + 1)
+    # With adjust=False, ewm is the recursion s[i+1] = (1 - alpha) s[i] + alpha x[i],
+    # so leading with the saved value continues where the last batch stopped
+    smoothed = pd.Series(np.r_[state.get(key, values[0] if initial is None else initial), values]).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    state[key] = smoothed[-1]
+    return smoothed
+
+
+def _rate(times, values, window, state):
+    """Change per hour since the previous reading; NaN where time did not move forward"""
+    if window:
+        values = _smooth(values, window, state, "level")[1:]
+    times = times.astype(np.float64)
+    previous_times = np.r_[state.get("time", np.nan), times[:-1]]
+    previous_values = np.r_[state.get("value", np.nan), values[:-1]]
+    hours = (times - previous_times) / HOUR_NS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(hours > 0, (values - previous_values) / hours, np.nan)
+    state.update(time=times[-1], value=values[-1])
+    return rate
+
+
+def _zscore(values, window, state):
+    """Each reading's z-score against the exponentially weighted mean and variance of the readings before it"""
+    count = state.get("count", 0)
+    means = _smooth(values, window, state, "mean")
+    deviation = values - means[:-1]
+    alpha = 2 / (window + 1)
+    # The exponentially weighted variance follows v[i+1] = (1 - alpha) (v[i] + alpha d[i]^2)
+    variances = _smooth((1 - alpha) * deviation ** 2, window, state, "variance", initial=0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = deviation / np.sqrt(variances[:-1])
+    z[(count + np.arange(len(values)) < window) | (variances[:-1] == 0)] = np.nan
+    state["count"] = count + len(values)
+    return z
+
+
+def _excursions(rule, times, signal, open_event):
+    """Runs of readings breaking the rule, as (start, end, peak, readings) columns.
+
+    open_event is the run still going at the end of the previous batch, if
+    any. Readings without a signal neither extend nor end a run. Returns the
+    finished runs and the run still going, if any.
+    """
+    valid = ~np.isnan(signal)
+    times, signal = times[valid], signal[valid]
+    if not len(times):
+        return None, open_event
+
+    sign = -1.0 if rule.op == "below" else 1.0
+    severity = np.abs(signal) if rule.op == "either" else sign * signal
+    hit = severity > sign * rule.limit
+    starts = np.flatnonzero(hit & ~np.r_[False, hit[:-1]])
+    ends = np.flatnonzero(hit & ~np.r_[hit[1:], False])
+    # Readings between runs never break the rule, so they can't be a run's maximum
+    peaks = sign * np.maximum.reduceat(severity, starts) if len(starts) else np.empty(0)
+    runs = [times[starts], times[ends], peaks, ends - starts + 1]
+
+    if open_event is not None:
+        if len(starts) and starts[0] == 0:
+            runs[0][0] = open_event[0]
+            runs[2][0] = sign * max(sign * runs[2][0], sign * open_event[2])
+            runs[3][0] += open_event[3]
+        else:
+            runs = [np.r_[value, column] for value, column in zip(open_event, runs)]
+    if hit[-1]:
+        return [column[:-1] for column in runs], tuple(column[-1] for column in runs)
+    return runs, None
+
+
+class AlertEngine:
+    """Alert rules evaluated on each room's readings as they are loaded.
+
+    Every rule keeps constant state per room: the previous reading for rate
+    rules, an exponentially weighted mean and variance for z-score rules, and
+    the excursion in progress. Appended readings are therefore checked
+    without looking at older ones. Finished excursions are kept as events.
+    """
+
+    def __init__(self, rules=None):
+        self.rules = ALERT_RULES if rules is None else tuple(rules)
+        self._rooms = {}
+
+    def evaluate(self, room_name, df, reset=False):
+        """Run the rules over a room's new rows, or over its whole file again with reset"""
+        room = self._rooms.get(room_name)
+        if room is None or reset:
+            room = self._rooms[room_name] = {"signals": {}, "open": {}, "events": []}
+        if df is None or not len(df) or not self.rules:
+            return
+
+        times = df['timestamp'].to_numpy('datetime64[ns]').view('int64')
+        order = np.flatnonzero(times != _NAT)
+        if np.any(np.diff(times[order]) < 0):
+            order = order[np.argsort(times[order], kind="stable")]
+
+        fired = 0
+        for metric in dict.fromkeys(rule.metric for rule in self.rules):
+            if metric not in df.columns:
+                continue
+            values = df[metric].to_numpy(np.float64)[order]
+            present = ~np.isnan(values)
+            metric_times, values = times[order][present], values[present]
+            if not len(values):
+                continue
+
+            signals = {}
+            for index, rule in enumerate(self.rules):
+                if rule.metric != metric:
+                    continue
+                key = (rule.kind, rule.window if rule.kind != "threshold" else None)
+                if key not in signals:
+                    state = room["signals"].setdefault((metric, *key), {})
+                    if rule.kind == "threshold":
+                        signals[key] = values
+                    elif rule.kind == "rate":
+                        signals[key] = _rate(metric_times, values, rule.window, state)
+                    else:
+                        signals[key] = _zscore(values, rule.window, state)
+                finished, room["open"][rule.name] = _excursions(rule, metric_times, signals[key], room["open"].get(rule.name))
+                if finished is not None and len(finished[0]):
+                    room["events"].append((np.full(len(finished[0]), index, dtype=np.int16), *finished))
+                    fired += len(finished[0])
+        if fired:
+            logger.debug(f"{room_name}: {fired} alert(s) finished")
+
+    def remove(self, room_name):
+        self._rooms.pop(room_name, None)
+
+    def events(self, labels=()):
+        """Every event so far, still-running ones with active set, as a table indexed by start"""
+        labels = list(labels)
+        labels += sorted(room_label(name) for name in self._rooms if room_label(name) not in labels)
+        by_name = {rule.name: index for index, rule in enumerate(self.rules)}
+
+        chunks, rooms, active = [], [], []
+        for room_name, room in self._rooms.items():
+            if len(room["events"]) > 1:
+                # Keep one chunk per room so this stays a handful of concatenations
+                room["events"] = [tuple(np.concatenate(column) for column in zip(*room["events"]))]
+            running = [(by_name[name], *event) for name, event in room["open"].items() if event is not None]
+            if running:
+                chunks.append(tuple(np.array(column) for column in zip(*running)))
+                active.append(np.ones(len(running), dtype=bool))
+            chunks.extend(room["events"])
+            active.extend(np.zeros(len(chunk[0]), dtype=bool) for chunk in room["events"])
+            count = len(running) + sum(len(chunk[0]) for chunk in room["events"])
+            rooms.append(np.full(count, labels.index(room_label(room_name)), dtype=np.int16))
+
+        if not chunks:
+            return empty_events(labels, self.rules)
+        events = tuple(np.concatenate(column).astype(dtype) for column, dtype in zip(
+            zip(*chunks), (np.int16, np.int64, np.int64, np.float64, np.int64)
+        ))
+        return _event_frame(events, np.concatenate(rooms), np.concatenate(active), labels, self.rules)
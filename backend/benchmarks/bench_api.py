@@ -0,0 +1,279 @@
+"""Benchmark the backend end to end against a local stub LLM.
+
+Runs main.app in-process (through httpx's ASGI transport) on synthetic room
+data, with benchmarks/stub_llm.py standing in for OpenAI, so no API key or
+network is needed. Workloads:
+
+    startup     cold (NDJSON parse) and warm (columnar cache) data loading, app startup
+    functions   load_data_files, create_prompt and execute_user_code on their own
+    single      one query at a time, with cold and then warm caches (the cold
+                pass also pays for the sandbox workers' first tasks)
+    concurrent  many clients at once: throughput, latency and 429s
+    batch       one /query/batch report of --batch-size questions, cold caches
+
+Reports print as a table and can be saved with --json; pass an earlier
+report as --baseline to print the change for every number.
+
+Usage, from the backend directory:
+    python benchmarks/bench_api.py                          # bundled-size rooms, all workloads
+    python benchmarks/bench_api.py --rows 1000000 --workload startup,functions
+    python benchmarks/bench_api.py --concurrency 32 --requests 500 --json after.json --baseline before.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from stub_llm import start_stub, add_latency_arguments, CANNED_CODE
+from synthetic import BUNDLED_ROWS, write_rooms
+
+WORKLOADS = ("startup", "functions", "single", "concurrent", "batch")
+
+# A mix of questions the local router answers and ones that need generated code
+QUERIES = [
+    "average temperature in Room 3 yesterday",
+    "Which room had the highest CO2 this week?",
+    "hourly average co2 in room 1 today",
+    "Compare the air quality in each room",
+    "Show me the temperature trend over the last few days",
+    "How many times did CO2 exceed 800 ppm in each room?",
+    "Is the air in the office getting better or worse?",
+    "show me all of the readings we have",
+]
+
+
+def percentiles(samples, prefix=""):
+    if not samples:
+        return {}
+    p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+    return {f"{prefix}p50_ms": p50, f"{prefix}p95_ms": p95, f"{prefix}p99_ms": p99}
+
+
+def timed(function, *args, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_startup(modules, data_dir, app):
+    from data_store import DataStore
+    shutil.rmtree(modules["data_cache"].CACHE_DIR, ignore_errors=True)
+    cold = timed(lambda: DataStore(data_dir).refresh())[0]
+    warm = min(timed(lambda: DataStore(data_dir).refresh(), repeat=3))
+
+    start = time.perf_counter()
+    asyncio.run(app.router.startup())
+    app_startup = time.perf_counter() - start
+    return {"cold_load_ms": cold * 1000, "warm_load_ms": warm * 1000, "app_startup_ms": app_startup * 1000}
+
+
+def bench_functions(modules, snapshot, repeat):
+    agent_utils = modules["agent_utils"]
+    from rollups import RollupIndex
+    results = {}
+    results.update(percentiles(timed(agent_utils.load_data_files, snapshot, repeat=max(1, repeat // 5)), "load_data_files_"))
+
+    def cold_prompt():
+        agent_utils._data_summary = (None, None)
+        agent_utils.create_prompt(snapshot, QUERIES[0])
+    results.update(percentiles(timed(cold_prompt, repeat=repeat), "create_prompt_cold_"))
+    results.update(percentiles(timed(agent_utils.create_prompt, snapshot, QUERIES[0], repeat=repeat), "create_prompt_warm_"))
+
+    helpers = {"rollups": RollupIndex(snapshot.rollups)}
+    samples = []
+    for _, reply in CANNED_CODE:
+        code = agent_utils.extract_code(reply)
+        samples.extend(timed(agent_utils.execute_user_code, code, {"readings": snapshot.readings}, helpers, repeat=repeat))
+    results.update(percentiles(samples, "execute_user_code_"))
+    return results
+
+
+def clear_caches(modules):
+    modules["query_cache"].code_cache.clear()
+    modules["query_cache"].result_cache.clear()
+
+
+async def post_query(client, query):
+    start = time.perf_counter()
+    response = await client.post("/query", json={"query": query})
+    elapsed = time.perf_counter() - start
+    ok = response.status_code == 200 and response.json()["output"].get("success")
+    return elapsed, response.status_code, ok
+
+
+async def bench_single(modules, client):
+    results = {}
+    for label in ("cold", "warm"):
+        if label == "cold":
+            clear_caches(modules)
+        samples = []
+        failures = 0
+        for query in QUERIES:
+            elapsed, _, ok = await post_query(client, query)
+            samples.append(elapsed)
+            failures += not ok
+        results.update(percentiles(samples, f"{label}_"))
+        results[f"{label}_failures"] = failures
+    return results
+
+
+async def bench_concurrent(modules, client, concurrency, requests):
+    clear_caches(modules)
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with gate:
+            return await post_query(client, QUERIES[i % len(QUERIES)])
+
+    start = time.perf_counter()
+    outcomes = await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+    answered = [elapsed for elapsed, status, _ in outcomes if status == 200]
+    return {
+        "throughput_rps": len(answered) / wall,
+        **percentiles(answered),
+        "rejected_429": sum(status == 429 for _, status, _ in outcomes),
+        "failures": sum(status == 200 and not ok for _, status, ok in outcomes),
+    }
+
+
+async def bench_batch(modules, client, size):
+    clear_caches(modules)
+    # Distinct wordings, so every question needs its own LLM calls
+    queries = [f"{QUERIES[i % len(QUERIES)]} ({i})" for i in range(size)]
+    start = time.perf_counter()
+    response = await client.post("/query/batch", json={"queries": queries})
+    wall = time.perf_counter() - start
+    outputs = [item["output"] for item in response.json()["results"]] if response.status_code == 200 else []
+    return {
+        "wall_ms": wall * 1000,
+        "questions_per_s": len(outputs) / wall,
+        "failures": sum(not output.get("success") for output in outputs) + (size - len(outputs)),
+    }
+
+
+async def bench_http(modules, app, workloads, args):
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        if "single" in workloads:
+            results["single"] = await bench_single(modules, client)
+        if "concurrent" in workloads:
+            results["concurrent"] = await bench_concurrent(modules, client, args.concurrency, args.requests)
+        if "batch" in workloads:
+            results["batch"] = await bench_batch(modules, client, args.batch_size)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_report(report, baseline=None):
+    config = report["config"]
+    print("config: " + ", ".join(f"{key}={value}" for key, value in config.items()))
+    for workload, metrics in report["results"].items():
+        print(f"[{workload}]")
+        for name, value in metrics.items():
+            line = f"  {name:<32} {value:>12.2f}"
+            old = (baseline or {}).get("results", {}).get(workload, {}).get(name)
+            if old:
+                line += f"   (was {old:.2f}, {(value - old) / old:+.1%})"
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=BUNDLED_ROWS, help="synthetic rows per room")
+    parser.add_argument("--rooms", type=int, default=4, help="synthetic rooms")
+    parser.add_argument("--workload", default=",".join(WORKLOADS), help=f"comma-separated subset of {WORKLOADS}")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per function benchmark")
+    parser.add_argument("--concurrency", type=int, default=16, help="clients in the concurrent workload")
+    parser.add_argument("--requests", type=int, default=200, help="requests in the concurrent workload")
+    parser.add_argument("--batch-size", type=int, default=50, help="questions in the batch workload")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare against")
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    workloads = [name.strip() for name in args.workload.split(",") if name.strip()]
+
+    workdir = tempfile.mkdtemp(prefix="aq-bench-")
+    stub, base_url = start_stub(0, args.validate_latency, args.generate_latency, args.token_delay)
+    # The backend reads these at import time
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "stub",
+        "DATA_CACHE_DIR": os.path.join(workdir, ".cache"),
+        "CODE_CACHE_FILE": os.path.join(workdir, ".cache", "generated_code.json"),
+        "DATA_WATCH_INTERVAL": "0",
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    try:
+        data_dir = os.path.join(workdir, "data")
+        os.makedirs(data_dir)
+        write_rooms(data_dir, args.rows, rooms=args.rooms)
+
+        import main as server
+        import agent_utils
+        import data_cache
+        import query_cache
+        modules = {"agent_utils": agent_utils, "data_cache": data_cache, "query_cache": query_cache}
+        agent_utils.DATA_DIR = data_dir
+        server.store = type(server.store)(data_dir)
+
+        report = {
+            "config": {
+                "revision": git_revision(),
+                "rows_per_room": args.rows,
+                "rooms": args.rooms,
+                "validate_latency": args.validate_latency,
+                "generate_latency": args.generate_latency,
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "batch_size": args.batch_size,
+            },
+            "results": {},
+        }
+        if "startup" in workloads:
+            report["results"]["startup"] = bench_startup(modules, data_dir, server.app)
+        else:
+            asyncio.run(server.app.router.startup())
+        try:
+            if "functions" in workloads:
+                report["results"]["functions"] = bench_functions(modules, server.store.snapshot(), args.repeat)
+            report["results"].update(asyncio.run(bench_http(modules, server.app, workloads, args)))
+        finally:
+            asyncio.run(server.app.router.shutdown())
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        print_report(report, baseline)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(report, f, indent=2)
+    finally:
+        stub.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
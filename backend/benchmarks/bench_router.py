@@ -0,0 +1,116 @@
+"""Measure how much of a question corpus the local query router answers, and how fast.
+
+Reports the match rate and p50/p99 latency of routed answers. With --llm
+(needs a real OPENAI_API_KEY) every question is also answered through the
+LLM path, code generation plus in-process execution, for comparison.
+
+Usage, from the backend directory:
+    python benchmarks/bench_router.py                  # bundled data/ files
+    python benchmarks/bench_router.py --rows 500000    # synthetic rooms of N rows
+    python benchmarks/bench_router.py --llm
+"""
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+# The backend reads its cache and partition directories at import time, so
+# they point into the scratch directory before anything is imported
+WORKDIR = tempfile.mkdtemp(prefix="aq-bench-")
+os.environ["DATA_CACHE_DIR"] = os.path.join(WORKDIR, ".cache")
+os.environ["PARTITION_DIR"] = os.path.join(WORKDIR, ".cache", "partitions")
+os.environ["CODE_CACHE_FILE"] = os.path.join(WORKDIR, ".cache", "generated_code.json")
+
+import numpy as np
+import agent_utils
+import router
+from data_store import DataStore
+from rollups import RollupIndex
+from synthetic import write_rooms
+
+CORPUS = os.path.join(os.path.dirname(__file__), "router_corpus.txt")
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def percentiles(samples):
+    if not samples:
+        return "n/a"
+    p50, p99 = np.percentile(np.array(samples) * 1000, [50, 99])
+    return f"p50 {p50:.2f} ms, p99 {p99:.2f} ms"
+
+
+def time_router(queries, snapshot, now, repeat):
+    matched, missed, samples = [], [], []
+    for query in queries:
+        intent = router.match_query(query)
+        if intent is None:
+            missed.append(query)
+            continue
+        matched.append(query)
+        for _ in range(repeat):
+            # Parsing is cached like in the server, so this times the plan itself
+            start = time.perf_counter()
+            router.run_intent(router.match_query(query), snapshot, now)
+            samples.append(time.perf_counter() - start)
+    return matched, missed, samples
+
+
+async def time_llm(queries, snapshot):
+    samples = []
+    for query in queries:
+        start = time.perf_counter()
+        code = await agent_utils.run_openai_code_agent(snapshot, query)
+        if isinstance(code, str):
+            agent_utils.execute_user_code(code, {"readings": snapshot.readings, "alerts": snapshot.alerts},
+                                          {"rollups": RollupIndex(snapshot.rollups)})
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=0, help="synthetic rows per room (0 = use data/)")
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs per matched question")
+    parser.add_argument("--corpus", default=CORPUS, help="file with one question per line")
+    parser.add_argument("--llm", action="store_true", help="also time the LLM path (calls the API)")
+    args = parser.parse_args()
+
+    try:
+        data_dir = agent_utils.DATA_DIR
+        if args.rows:
+            data_dir = os.path.join(WORKDIR, "data")
+            os.makedirs(data_dir)
+            write_rooms(data_dir, args.rows)
+
+        store = DataStore(data_dir)
+        store.refresh()
+        snapshot = store.snapshot()
+        # Relative windows ("yesterday") are anchored at the newest reading
+        now = snapshot.readings.index[-1]
+        queries = load_corpus(args.corpus)
+
+        matched, missed, samples = time_router(queries, snapshot, now, args.repeat)
+        print(f"rows: {len(snapshot.readings)}, questions: {len(queries)}")
+        print(f"router matched {len(matched)}/{len(queries)} ({len(matched) / len(queries):.0%})")
+        print(f"router latency: {percentiles(samples)}")
+        for query in missed:
+            print(f"  left to the LLM: {query}")
+
+        if args.llm:
+            print(f"LLM path latency: {percentiles(asyncio.run(time_llm(queries, snapshot)))}")
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
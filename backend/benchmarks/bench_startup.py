@@ -0,0 +1,106 @@
+"""Compare cold (NDJSON parse) and warm (columnar cache) dataset startup.
+
+Also compares the streaming chunked parser against the previous per-line
+json.loads loop on the same files, with peak traced memory for each.
+
+Usage, from the backend directory:
+    python benchmarks/bench_startup.py                 # bundled data/ files
+    python benchmarks/bench_startup.py --rows 500000   # synthetic rooms of N rows
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from glob import glob
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+# The backend reads its cache and partition directories at import time, so
+# they point into the scratch directory before anything is imported
+WORKDIR = tempfile.mkdtemp(prefix="aq-bench-")
+os.environ["DATA_CACHE_DIR"] = os.path.join(WORKDIR, ".cache")
+os.environ["PARTITION_DIR"] = os.path.join(WORKDIR, ".cache", "partitions")
+
+import pandas as pd
+import agent_utils
+import ingest
+from data_store import DataStore
+from synthetic import write_rooms
+
+
+def timed_load(data_dir):
+    start = time.perf_counter()
+    store = DataStore(data_dir)
+    store.refresh()
+    elapsed = time.perf_counter() - start
+    datasets = agent_utils.load_data_files(store.snapshot())
+    return elapsed, sum(len(df) for df in datasets.values())
+
+
+def legacy_parse(file_path):
+    """The per-line loader this repo used before ingest.read_ndjson"""
+    rows = []
+    with open(file_path, 'r') as f:
+        for line in f:
+            try:
+                rows.append(json.loads(line.strip()))
+            except json.JSONDecodeError:
+                continue
+    return agent_utils.normalize_columns(pd.DataFrame(rows))
+
+
+def streaming_parse(file_path):
+    return ingest.read_ndjson(file_path)[0]
+
+
+def profile_parser(parse, files):
+    start = time.perf_counter()
+    for file_path in files:
+        parse(file_path)
+    elapsed = time.perf_counter() - start
+
+    # Measured in a separate pass because tracing slows parsing down a lot
+    tracemalloc.start()
+    for file_path in files:
+        parse(file_path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=0, help="synthetic rows per room (0 = use data/)")
+    parser.add_argument("--repeat", type=int, default=3, help="warm runs to average")
+    args = parser.parse_args()
+
+    try:
+        data_dir = agent_utils.DATA_DIR
+        if args.rows:
+            data_dir = os.path.join(WORKDIR, "data")
+            os.makedirs(data_dir)
+            write_rooms(data_dir, args.rows)
+
+        files = glob(os.path.join(data_dir, "*.ndjson"))
+        for label, parse in (("per-line json.loads", legacy_parse), ("streaming chunked", streaming_parse)):
+            elapsed, peak = profile_parser(parse, files)
+            print(f"{label} parse: {elapsed * 1000:.1f} ms, peak {peak / 2**20:.1f} MiB")
+
+        cold, total_rows = timed_load(data_dir)
+        warm = min(timed_load(data_dir)[0] for _ in range(args.repeat))
+
+        print(f"rows loaded: {total_rows}")
+        print(f"cold start (parse + cache write): {cold * 1000:.1f} ms")
+        print(f"warm start (memory-mapped cache): {warm * 1000:.1f} ms")
+        print(f"speedup: {cold / warm:.1f}x")
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
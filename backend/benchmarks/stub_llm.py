@@ -0,0 +1,167 @@
+"""A local stand-in for the OpenAI chat completions API.
+
+Validator calls get "Yes" (or "No" for obviously off-topic questions) and
+generation calls get canned pandas code picked by keywords in the question,
+each after a configurable delay. Streaming requests are answered as
+server-sent events in the same chunk format as the real API.
+
+Standalone, from the backend directory:
+    python benchmarks/stub_llm.py --port 8011
+    OPENAI_BASE_URL=http://127.0.0.1:8011/v1 OPENAI_API_KEY=stub uvicorn main:app
+"""
+import re
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OFF_TOPIC = re.compile(r"\b(stock|weather forecast|recipe|football)\b", re.IGNORECASE)
+
+# (question pattern, reply); the first match wins and the last entry is the default
+CANNED_CODE = [
+    (r"\b(all|every|raw)\b.*\breadings\b", """```python
+result = readings.reset_index()
+```"""),
+    (r"\b(trend|hourly|over time)\b", """```python
+series = rollups.series('temperature', freq='hour', stats=['mean', 'max'])
+result = series.rename(columns={'Mean': 'Average Temperature', 'Max': 'Maximum Temperature'}).round(2)
+```"""),
+    (r"\b(compare|comparison|each room|per room)\b", """```python
+stats = rollups.summary('co2', stats=['mean', 'p95', 'max'])
+result = stats.rename(columns={'Mean': 'Average CO2', 'P95': 'CO2 P95', 'Max': 'Maximum CO2'}).round(2)
+```"""),
+    (r"\b(above|exceed|over)\b", """```python
+high = readings[readings['co2'] > 800]
+counts = high.groupby('room', observed=True).size()
+result = counts.rename('Readings Above 800 ppm').rename_axis('Room Name').reset_index()
+```"""),
+    (r"", """```python
+now = pd.Timestamp.now(tz='UTC')
+recent = readings.loc[now - pd.Timedelta(days=7):]
+means = recent.groupby('room', observed=True)[['co2', 'temperature', 'humidity']].mean()
+result = means.rename(columns={'co2': 'Average CO2', 'temperature': 'Average Temperature',
+                               'humidity': 'Average Humidity'}).rename_axis('Room Name').reset_index().round(2)
+```"""),
+]
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _question(messages):
+    text = messages[-1]["content"] if messages else ""
+    match = re.search(r'User Question: "(.*)"', text) or re.search(r"Query: (.*)", text)
+    return match.group(1) if match else text
+
+
+def reply_for(messages):
+    """The canned reply and whether it came from the validator branch"""
+    system = messages[0]["content"] if messages and messages[0]["role"] == "system" else ""
+    question = _question(messages)
+    if system.startswith("You are a validator"):
+        return ("No" if OFF_TOPIC.search(question) else "Yes"), True
+    for pattern, code in CANNED_CODE:
+        if re.search(pattern, question, re.IGNORECASE):
+            return code, False
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        messages = request.get("messages", [])
+        content, validating = reply_for(messages)
+        config = self.server.config
+        time.sleep(config["validate_latency"] if validating else config["generate_latency"])
+
+        prompt_tokens = sum(_tokens(message["content"]) for message in messages)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": _tokens(content),
+            "total_tokens": prompt_tokens + _tokens(content),
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": request.get("model", "stub")}
+
+        if not request.get("stream"):
+            self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": None}
+                  for piece in re.findall(r"\s*\S+", content)]
+        chunks.append({"index": 0, "delta": {}, "finish_reason": "stop"})
+        for choice in chunks:
+            self._write_chunk(f"data: {json.dumps({**base, 'object': 'chat.completion.chunk', 'choices': [choice]})}\n\n".encode())
+            if config["token_delay"]:
+                time.sleep(config["token_delay"])
+        if (request.get("stream_options") or {}).get("include_usage"):
+            final = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            self._write_chunk(f"data: {json.dumps(final)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+
+def start_stub(port=0, validate_latency=0.2, generate_latency=1.0, token_delay=0.0):
+    """Serve the stub from a background thread; returns the server and its OpenAI base URL"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.config = {
+        "validate_latency": validate_latency,
+        "generate_latency": generate_latency,
+        "token_delay": token_delay,
+    }
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def add_latency_arguments(parser):
+    parser.add_argument("--validate-latency", type=float, default=0.2, help="seconds before a validator reply")
+    parser.add_argument("--generate-latency", type=float, default=1.0, help="seconds before generated code starts")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8011)
+    add_latency_arguments(parser)
+    args = parser.parse_args()
+    server, base_url = start_stub(args.port, args.validate_latency, args.generate_latency, args.token_delay)
+    print(f"Stub LLM listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
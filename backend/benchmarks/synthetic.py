@@ -0,0 +1,48 @@
+"""Synthetic room data in the same NDJSON layout as the sensor files in data/.
+
+Rows are generated and serialized with NumPy/pandas a chunk at a time, so
+writing tens of millions of rows per room takes seconds per million rather
+than minutes.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+# The bundled files hold about this many readings per room
+BUNDLED_ROWS = 1345
+
+CHUNK_ROWS = 1_000_000
+
+
+def _chunk(rng, timestamps):
+    n = len(timestamps)
+    hour = (timestamps.hour + timestamps.minute / 60).to_numpy()
+    # Warmer and stuffier during office hours, with sensor noise on top
+    occupied = ((hour > 8) & (hour < 18)).astype(np.float64)
+    daily = np.sin((hour - 9) / 24 * 2 * np.pi)
+    # Formatting the strings up front is several times faster than letting
+    # to_json format tz-aware timestamps
+    iso = np.datetime_as_string(timestamps.tz_localize(None).to_numpy(), unit="s")
+    return pd.DataFrame({
+        "timestamp": np.char.add(iso, "+00:00"),
+        "CO2 (ppm)": 450 + 400 * occupied + rng.normal(0, 60, n),
+        "Relative Humidity (%)": 45 + 8 * daily + rng.normal(0, 3, n),
+        "Temperature (°C)": 22 + 2 * daily + rng.normal(0, 0.5, n),
+    })
+
+
+def write_rooms(data_dir, rows=BUNDLED_ROWS, rooms=4, interval_seconds=60, end=None, seed=0):
+    """Write rooms sensor_data_Room N.ndjson files of rows readings each, ending at end (default now)"""
+    rng = np.random.default_rng(seed)
+    end = pd.Timestamp.now(tz="UTC").floor("min") if end is None else pd.Timestamp(end)
+    start = end - pd.Timedelta(seconds=interval_seconds * (rows - 1))
+    paths = []
+    for room in range(1, rooms + 1):
+        path = os.path.join(data_dir, f"sensor_data_Room {room}.ndjson")
+        with open(path, "w") as f:
+            for lo in range(0, rows, CHUNK_ROWS):
+                offsets = np.arange(lo, min(rows, lo + CHUNK_ROWS), dtype=np.int64) * interval_seconds
+                timestamps = start + pd.to_timedelta(offsets, unit="s")
+                f.write(_chunk(rng, timestamps).to_json(orient="records", lines=True, double_precision=2))
+        paths.append(path)
+    return paths
@@ -0,0 +1,281 @@
+import os
+import ast
+import types
+import builtins
+from logging_config import setup_logger
+from ingest import METRIC_COLUMNS
+from query_cache import LRUCache, code_hash
+
+logger = setup_logger(__name__)
+
+COMPILED_CODE_CACHE_SIZE = int(os.getenv("COMPILED_CODE_CACHE_SIZE", "256"))
+
+ALLOWED_IMPORTS = {
+    "pandas", "numpy", "datetime", "pytz", "warnings", "math", "statistics", "re",
+    "collections", "itertools", "functools", "calendar", "zoneinfo",
+}
+# Submodules of ALLOWED_IMPORTS that may be imported by name; others, such as
+# pandas.io.common, hold references to os and the filesystem
+ALLOWED_SUBMODULES = {
+    "pandas.api.types", "pandas.tseries.offsets", "numpy.linalg", "numpy.random", "collections.abc",
+}
+FORBIDDEN_CALLS = {
+    "eval", "exec", "compile", "open", "__import__", "input", "breakpoint", "exit", "quit",
+    "globals", "locals", "vars", "getattr", "setattr", "delattr",
+}
+# Attributes that lead from an allowed module or object to the interpreter or
+# the filesystem, e.g. pd.io.common.os or a generator's gi_frame.f_globals
+FORBIDDEN_ATTRIBUTES = {
+    "os", "sys", "subprocess", "shutil", "socket", "builtins", "importlib",
+    "gi_frame", "cr_frame", "ag_frame", "tb_frame", "f_back", "f_globals", "f_locals", "f_builtins",
+}
+# pandas and numpy functions that read or write files
+FILE_FUNCTIONS = {
+    "to_pickle", "to_parquet", "to_excel", "to_feather", "to_hdf", "to_sql", "to_stata", "to_orc", "to_clipboard",
+    "load", "save", "savez", "savez_compressed", "savetxt", "loadtxt", "genfromtxt", "fromfile", "tofile", "memmap",
+}
+# Writers that return text when given no path
+TEXT_WRITERS = {"to_csv", "to_json", "to_html", "to_string", "to_markdown", "to_latex", "to_xml"}
+# Receivers whose .apply() runs once per group or window rather than per reading
+GROUPED_METHODS = {"groupby", "resample", "rolling", "expanding", "ewm"}
+# The shared table of every room's readings; its timestamps are already parsed
+SHARED_FRAME = "readings"
+
+
+class CodeRejected(Exception):
+    """Raised when generated code is unsafe or uses a pattern known to be too slow"""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+
+def _module_allowed(name):
+    return name in ALLOWED_IMPORTS or name in ALLOWED_SUBMODULES
+
+
+def _name_allowed(name):
+    """Whether a name may be imported from an allowed module or called directly"""
+    return not (
+        name == "*" or name.startswith("__") or name.startswith("read_")
+        or name in FORBIDDEN_ATTRIBUTES or name in FILE_FUNCTIONS
+    )
+
+
+def _import_allowed(name, globals=None, locals=None, fromlist=(), level=0):
+    """__import__ for generated code: only ALLOWED_IMPORTS and ALLOWED_SUBMODULES can be imported"""
+    if level or not _module_allowed(name):
+        raise ImportError(f"importing '{name}' is not allowed")
+    module = __import__(name, globals, locals, fromlist, level)
+    for item in fromlist or ():
+        value = getattr(module, item, None)
+        if not _name_allowed(item) or (
+            isinstance(value, types.ModuleType) and not _module_allowed(f"{name}.{item}")
+        ):
+            raise ImportError(f"importing '{item}' from '{name}' is not allowed")
+    return module
+
+
+# Builtins generated code runs with: none of FORBIDDEN_CALLS, and imports
+# limited to ALLOWED_IMPORTS
+SAFE_BUILTINS = {name: value for name, value in vars(builtins).items() if name not in FORBIDDEN_CALLS}
+SAFE_BUILTINS["__import__"] = _import_allowed
+
+
+def _root_name(node):
+    """The variable an attribute/subscript/call chain starts from, e.g. readings in readings.loc[a:b].index"""
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _chain_methods(node):
+    """Names of the methods called along an attribute/subscript/call chain"""
+    methods = set()
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            methods.add(node.func.attr)
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return methods
+
+
+def _metric_column(node):
+    """The metric a column selection like df['co2'] or df.co2 refers to, if any"""
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Constant) and node.slice.value in METRIC_COLUMNS:
+        return node.slice.value
+    if isinstance(node, ast.Attribute) and node.attr in METRIC_COLUMNS:
+        return node.attr
+    return None
+
+
+def _is_utc(node):
+    if isinstance(node, ast.Constant):
+        return isinstance(node.value, str) and node.value.upper() == "UTC"
+    if isinstance(node, ast.Name):
+        return node.id == "utc"
+    return isinstance(node, ast.Attribute) and node.attr == "UTC"
+
+
+class _Checker(ast.NodeVisitor):
+    def __init__(self):
+        self.problems = []
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self._check_module(alias.name)
+
+    def visit_ImportFrom(self, node):
+        if node.level:
+            self.problems.append("relative imports are not allowed")
+            return
+        self._check_module(node.module or "")
+        for alias in node.names:
+            if not _name_allowed(alias.name):
+                self.problems.append(f"importing '{alias.name}' from '{node.module}' is not allowed")
+
+    def _check_module(self, name):
+        if not _module_allowed(name):
+            self.problems.append(f"importing '{name}' is not allowed; only pandas, numpy and the standard date/math helpers are available")
+
+    def visit_Attribute(self, node):
+        if node.attr.startswith("__") or node.attr in FORBIDDEN_ATTRIBUTES:
+            self.problems.append(f"accessing '{node.attr}' is not allowed")
+        self.generic_visit(node)
+
+    def visit_Name(self, node):
+        if node.id.startswith("__"):
+            self.problems.append(f"using '{node.id}' is not allowed")
+
+    def visit_Constant(self, node):
+        # Catches __builtins__['__import__'] and similar lookups by name
+        if isinstance(node.value, str) and node.value.startswith("__"):
+            self.problems.append(f"the string '{node.value}' is not allowed")
+
+    def visit_Call(self, node):
+        func = node.func
+        if isinstance(func, ast.Name) and func.id in FORBIDDEN_CALLS:
+            self.problems.append(f"calling {func.id}() is not allowed")
+        elif isinstance(func, ast.Name) and (func.id.startswith("read_") or func.id in FILE_FUNCTIONS):
+            self.problems.append(f"{func.id}() reads or writes files, which is not allowed; the readings are already loaded")
+        elif isinstance(func, ast.Attribute):
+            if func.attr in ("iterrows", "itertuples"):
+                self.problems.append(
+                    f".{func.attr}() iterates row by row, which is far too slow on the readings; "
+                    "use vectorized column operations, boolean masks or groupby instead"
+                )
+            elif func.attr in ("apply", "applymap", "map"):
+                self._check_apply(node, func)
+            elif func.attr.startswith("read_") or func.attr in FILE_FUNCTIONS or (
+                func.attr in TEXT_WRITERS
+                and (node.args or any(keyword.arg in ("path_or_buf", "buf") for keyword in node.keywords))
+            ):
+                self.problems.append(f".{func.attr}() reads or writes files, which is not allowed; the readings are already loaded")
+        self.generic_visit(node)
+
+    def _check_apply(self, node, func):
+        for keyword in node.keywords:
+            if keyword.arg == "axis" and isinstance(keyword.value, ast.Constant) and keyword.value.value in (1, "columns"):
+                self.problems.append(
+                    f".{func.attr}(axis=1) calls Python once per row; compute the new column with vectorized "
+                    "arithmetic, np.where or np.select instead"
+                )
+                return
+        metric = _metric_column(func.value)
+        if metric and not _chain_methods(func.value) & GROUPED_METHODS and node.args and isinstance(node.args[0], (ast.Lambda, ast.Name, ast.Attribute)):
+            self.problems.append(
+                f".{func.attr}() on the '{metric}' column calls Python once per reading; use vectorized "
+                "arithmetic, comparisons, np.where or pd.cut instead"
+            )
+
+    def visit_While(self, node):
+        if isinstance(node.test, ast.Constant) and node.test.value and not any(
+            isinstance(child, ast.Break) for child in ast.walk(node)
+        ):
+            self.problems.append("'while True' loop without a break never finishes")
+        self.generic_visit(node)
+
+
+class _Rewriter(ast.NodeTransformer):
+    """Rewrite redundant work on the shared readings table into cheaper equivalents"""
+
+    def __init__(self):
+        self.rewrites = []
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+
+        # pd.to_datetime(readings.index) / pd.to_datetime(readings['timestamp']):
+        # the timestamps are already parsed
+        if (
+            isinstance(func, ast.Attribute) and func.attr == "to_datetime" and len(node.args) == 1
+            and _root_name(node.args[0]) == SHARED_FRAME
+            and (
+                (isinstance(node.args[0], ast.Attribute) and node.args[0].attr == "index")
+                or (isinstance(node.args[0], ast.Subscript) and isinstance(node.args[0].slice, ast.Constant)
+                    and node.args[0].slice.value == "timestamp")
+            )
+        ):
+            self.rewrites.append("dropped pd.to_datetime on already parsed timestamps")
+            return node.args[0]
+
+        # readings.copy(): the sandbox runs with copy-on-write, so a whole-table copy only costs time
+        if (
+            isinstance(func, ast.Attribute) and func.attr == "copy"
+            and isinstance(func.value, ast.Name) and func.value.id == SHARED_FRAME
+        ):
+            self.rewrites.append("dropped a copy of the whole readings table")
+            return func.value
+
+        # readings.index.tz_localize('UTC') raises on a tz-aware index; converting is what was meant
+        if (
+            isinstance(func, ast.Attribute) and func.attr == "tz_localize"
+            and _root_name(func.value) == SHARED_FRAME
+            and len(node.args) == 1 and _is_utc(node.args[0])
+        ):
+            self.rewrites.append("replaced tz_localize('UTC') on tz-aware timestamps with tz_convert")
+            func.attr = "tz_convert"
+        return node
+
+
+def review_code(code):
+    """Check generated code and rewrite known-slow patterns.
+
+    Returns the (possibly rewritten) code and a list of problems; the code
+    must not be run when there are problems.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return code, [f"syntax error on line {e.lineno}: {e.msg}"]
+
+    checker = _Checker()
+    checker.visit(tree)
+    if checker.problems:
+        return code, list(dict.fromkeys(checker.problems))
+
+    rewriter = _Rewriter()
+    tree = rewriter.visit(tree)
+    if rewriter.rewrites:
+        logger.info(f"Rewrote generated code: {', '.join(dict.fromkeys(rewriter.rewrites))}")
+        code = ast.unparse(ast.fix_missing_locations(tree))
+    return code, []
+
+
+# Per process: sandbox workers compile each distinct script once
+compiled_code = LRUCache("compiled code", COMPILED_CODE_CACHE_SIZE, float("inf"))
+
+
+def compile_code(code):
+    """Compiled code object for a script, cached by its hash; raises CodeRejected"""
+    key = code_hash(code)
+    compiled = compiled_code.get(key)
+    if compiled is not None:
+        return compiled
+
+    checked, problems = review_code(code)
+    if problems:
+        raise CodeRejected(problems)
+    compiled = compile(checked, "<generated>", "exec")
+    compiled_code.set(key, compiled)
+    return compiled
@@ -0,0 +1,45 @@
+import os
+import asyncio
+from contextlib import asynccontextmanager
+
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", "8"))
+MAX_QUEUED_QUERIES = int(os.getenv("MAX_QUEUED_QUERIES", "32"))
+RETRY_AFTER_SECONDS = int(os.getenv("RETRY_AFTER_SECONDS", "2"))
+
+
+class Overloaded(Exception):
+    """Raised when a request would have to queue behind too many others"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Too many queries in flight, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """Run at most `limit` queries at once and queue at most `max_queued` more"""
+
+    def __init__(self, limit=MAX_CONCURRENT_QUERIES, max_queued=MAX_QUEUED_QUERIES, retry_after=RETRY_AFTER_SECONDS):
+        self.limit = limit
+        self.max_queued = max_queued
+        self.retry_after = retry_after
+        self.admitted = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    @property
+    def queued(self):
+        return max(0, self.admitted - self.limit)
+
+    @property
+    def full(self):
+        return self.admitted >= self.limit + self.max_queued
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.full:
+            raise Overloaded(self.retry_after)
+        self.admitted += 1
+        try:
+            async with self._semaphore:
+                yield
+        finally:
+            self.admitted -= 1
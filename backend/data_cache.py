@@ -0,0 +1,184 @@
+import os
+import json
+import hashlib
+import shutil
+import numpy as np
+import pandas as pd
+from logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_DIR = os.getenv("DATA_CACHE_DIR", "./data/.cache/")
+
+# Bump when the normalized layout changes so stale caches are rebuilt
+CACHE_VERSION = 2
+
+
+def _cache_path(file_path):
+    room_name = os.path.basename(file_path).split('.')[0]
+    return os.path.join(CACHE_DIR, room_name)
+
+
+def _source_signature(file_path):
+    stat = os.stat(file_path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def tail_fingerprint(file_path, end_offset):
+    """Hash of the bytes just before end_offset, used to recognise appended files"""
+    with open(file_path, 'rb') as f:
+        f.seek(max(0, end_offset - 4096))
+        return hashlib.sha1(f.read(min(end_offset, 4096))).hexdigest()
+
+
+def _is_current(meta, file_path):
+    if meta.get("version") != CACHE_VERSION:
+        return False
+    if meta.get("source") == _source_signature(file_path):
+        return True
+
+    # A file that only had lines appended keeps the cached prefix; the caller
+    # reads the rest from stats["end_offset"].
+    end_offset = meta.get("stats", {}).get("end_offset")
+    if end_offset is None or os.path.getsize(file_path) < end_offset:
+        return False
+    return meta.get("tail_sha1") == tail_fingerprint(file_path, end_offset)
+
+
+def _read_arrays(path, mmap_mode):
+    """The meta and column arrays written by write_frame, or (None, None) if the directory is missing"""
+    meta_path = os.path.join(path, "meta.json")
+    if not os.path.exists(meta_path):
+        return None, None
+
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    return meta, [np.load(os.path.join(path, f"{i}.npy"), mmap_mode=mmap_mode) for i in range(len(meta["columns"]))]
+
+
+def read_frame(path, mmap_mode='r'):
+    """Rebuild a DataFrame written by write_frame; columns stay memory-mapped.
+
+    Returns (None, None) if the directory is missing.
+    """
+    meta, arrays = _read_arrays(path, mmap_mode)
+    if meta is None:
+        return None, None
+    return _build_frame(meta, arrays), meta
+
+
+def read_frames(paths):
+    """One DataFrame of several written by write_frame, in order; None if none exist.
+
+    Frames with the same columns are joined array by array, which is much
+    cheaper than building a DataFrame for each of them.
+    """
+    parts = [part for part in (_read_arrays(path, None) for path in paths) if part[0] is not None]
+    if not parts:
+        return None
+    layouts = {json.dumps(meta["columns"], sort_keys=True) for meta, _ in parts}
+    if len(layouts) > 1 or any(column["kind"] == "category" for column in parts[0][0]["columns"]):
+        return pd.concat([_build_frame(meta, arrays) for meta, arrays in parts], ignore_index=True)
+    meta = parts[0][0]
+    return _build_frame(meta, [np.concatenate(column) for column in zip(*(arrays for _, arrays in parts))])
+
+
+def _build_frame(meta, arrays):
+    columns = {}
+    for column, values in zip(meta["columns"], arrays):
+        if column["kind"] == "datetime":
+            values = pd.DatetimeIndex(values.view('datetime64[ns]'))
+            if column["tz"]:
+                values = values.tz_localize('UTC').tz_convert(column["tz"])
+        elif column["kind"] == "category":
+            values = pd.Categorical.from_codes(values, categories=column["categories"])
+        columns[column["name"]] = values
+
+    index = meta.get("index")
+    df = pd.DataFrame(columns, copy=False)
+    if index is not None:
+        df.index = pd.DatetimeIndex(df.pop(index), name=index)
+    return df
+
+
+def write_frame(path, df, meta=None):
+    """Atomically write a DataFrame as one memory-mappable .npy file per column.
+
+    A DatetimeIndex is stored as an extra column. Returns False without
+    writing if a column has no fixed-width layout.
+    """
+    meta = dict(meta or {})
+    if isinstance(df.index, pd.DatetimeIndex):
+        meta["index"] = df.index.name or "index"
+        df = df.reset_index(names=meta["index"])
+
+    columns = []
+    arrays = []
+    for name in df.columns:
+        series = df[name]
+        if isinstance(series.dtype, pd.DatetimeTZDtype):
+            tz = str(series.dt.tz)
+            values = series.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy('datetime64[ns]').view('int64')
+            columns.append({"name": name, "kind": "datetime", "tz": tz})
+        elif pd.api.types.is_datetime64_dtype(series.dtype):
+            values = series.to_numpy('datetime64[ns]').view('int64')
+            columns.append({"name": name, "kind": "datetime", "tz": None})
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            values = series.cat.codes.to_numpy()
+            columns.append({"name": name, "kind": "category", "categories": [str(c) for c in series.cat.categories]})
+        elif pd.api.types.is_numeric_dtype(series.dtype) or pd.api.types.is_bool_dtype(series.dtype):
+            values = series.to_numpy()
+            columns.append({"name": name, "kind": "numeric"})
+        else:
+            logger.info(f"Not writing {path}: column '{name}' has non-columnar dtype {series.dtype}")
+            return False
+        arrays.append(values)
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for i, values in enumerate(arrays):
+            np.save(os.path.join(tmp_path, f"{i}.npy"), np.ascontiguousarray(values))
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump(dict(meta, columns=columns), f)
+
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        logger.warning(f"Failed to write {path}: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return False
+
+
+def load_cached_frame(file_path):
+    """Rebuild a normalized DataFrame and its ingest stats from the columnar cache.
+
+    Returns (None, None) when there is no cache or the source file changed in a
+    way other than having lines appended.
+    """
+    cache_path = _cache_path(file_path)
+    try:
+        with open(os.path.join(cache_path, "meta.json"), 'r') as f:
+            if not _is_current(json.load(f), file_path):
+                return None, None
+        df, meta = read_frame(cache_path)
+        return df, meta.get("stats", {})
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable cache for {file_path}: {e}")
+        return None, None
+
+
+def save_cached_frame(file_path, df, stats=None):
+    """Write a normalized room DataFrame to the columnar cache"""
+    meta = {
+        "version": CACHE_VERSION,
+        "source": _source_signature(file_path),
+        "stats": stats or {},
+    }
+    if stats and "end_offset" in stats:
+        meta["tail_sha1"] = tail_fingerprint(file_path, stats["end_offset"])
+    return write_frame(_cache_path(file_path), df, meta)
@@ -0,0 +1,369 @@
+import os
+import threading
+from glob import glob
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from logging_config import setup_logger
+from alerts import AlertEngine, empty_events
+from data_cache import load_cached_frame, save_cached_frame
+from ingest import METRIC_COLUMNS, natural_key, read_ndjson, room_label
+from partitions import HOT_WINDOW_DAYS, hot_window_start, partition_store
+from rollups import RoomRollups, select_rooms, to_ns
+
+logger = setup_logger(__name__)
+
+DATA_WATCH_INTERVAL = float(os.getenv("DATA_WATCH_INTERVAL", "5"))
+
+# shared is the manifest of a snapshot mapped from shared_data's published files.
+# hot_start (epoch ns) is where readings begins when older days are kept
+# only in day partitions; None when everything is in memory.
+# alerts is the event table of alerts.AlertEngine, covering the whole history.
+Snapshot = namedtuple(
+    "Snapshot", ["version", "rollups", "readings", "shared", "hot_start", "alerts"], defaults=(None, None, None)
+)
+
+
+def build_readings(datasets, labels=None):
+    """One long-format table of every room's readings.
+
+    The index is a sorted, tz-aware UTC DatetimeIndex named 'timestamp' so
+    time-range filters are binary searches; 'room' is categorical ('Room 1',
+    ...) and the metrics are float32. Readings without a timestamp are left out.
+    """
+    labels = labels or sorted((room_label(room) for room in datasets), key=natural_key)
+    codes = {label: code for code, label in enumerate(labels)}
+
+    timestamps = []
+    rooms = []
+    metrics = {metric: [] for metric in METRIC_COLUMNS}
+    for room, df in datasets.items():
+        timestamps.append(df['timestamp'].to_numpy('datetime64[ns]').view('int64'))
+        rooms.append(np.full(len(df), codes[room_label(room)], dtype=np.int16))
+        for metric in METRIC_COLUMNS:
+            values = df[metric].to_numpy(np.float32) if metric in df.columns else np.full(len(df), np.nan, dtype=np.float32)
+            metrics[metric].append(values)
+
+    timestamps = np.concatenate(timestamps) if timestamps else np.empty(0, dtype=np.int64)
+    order = np.argsort(timestamps, kind='stable')
+    # NaT is the smallest int64, so missing timestamps sort to the front
+    order = order[np.searchsorted(timestamps[order], np.iinfo(np.int64).min, side='right'):]
+
+    index = pd.DatetimeIndex(timestamps[order].view('datetime64[ns]'), name='timestamp').tz_localize('UTC')
+    columns = {
+        'room': pd.Categorical.from_codes(
+            np.concatenate(rooms)[order] if rooms else np.empty(0, dtype=np.int16),
+            categories=labels,
+        )
+    }
+    for metric in METRIC_COLUMNS:
+        columns[metric] = np.concatenate(metrics[metric])[order] if metrics[metric] else np.empty(0, dtype=np.float32)
+    return pd.DataFrame(columns, index=index, copy=False)
+
+
+def load_range(readings, hot_start, start=None, end=None, rooms=None):
+    """Readings with timestamps in [start, end) for the given rooms, in the layout of `readings`.
+
+    Days before hot_start are no longer in memory and are read from the day
+    partitions overlapping the range, so a recent range never opens older days.
+    """
+    start, end = to_ns(start), to_ns(end)
+    labels = list(readings['room'].cat.categories)
+    wanted = select_rooms(labels, rooms)
+
+    index = readings.index
+    lo = 0 if start is None else index.searchsorted(pd.Timestamp(start, tz='UTC'))
+    hi = len(index) if end is None else index.searchsorted(pd.Timestamp(end, tz='UTC'))
+    rows = readings.iloc[lo:hi]
+    if rooms is not None:
+        rows = rows[rows['room'].isin(wanted)]
+    if hot_start is None or (start is not None and start >= hot_start):
+        return rows
+
+    cold_end = hot_start if end is None else min(end, hot_start)
+    cold = {}
+    for room_name in partition_store.room_names():
+        if room_label(room_name) in wanted:
+            frame = partition_store.room(room_name).load(start, cold_end)
+            if frame is not None:
+                cold[room_name] = frame
+    if not cold:
+        return rows
+    return pd.concat([build_readings(cold, labels=labels), rows])
+
+
+def _extend_readings(readings, tails):
+    """Append newly read rows, or None when they would break the time order"""
+    new = build_readings(tails, labels=list(readings['room'].cat.categories))
+    if len(readings) and len(new) and new.index[0] < readings.index[-1]:
+        return None
+    return pd.concat([readings, new])
+
+
+def _rebuild_readings(readings, frames, tails):
+    """readings with the rooms in frames replaced (dropped where the frame is None) and tails appended"""
+    loaded = {room: df for room, df in frames.items() if df is not None}
+    replaced = {room_label(room) for room in frames}
+    # Rooms whose readings all fell out of the hot window keep their category
+    labels = [label for label in readings['room'].cat.categories if label not in replaced]
+    labels = sorted(labels + [room_label(room) for room in loaded], key=natural_key)
+    kept = readings[~readings['room'].isin(replaced)]
+    kept = kept.assign(room=kept['room'].cat.set_categories(labels))
+    new = build_readings(tails | loaded, labels=labels)
+    combined = pd.concat([kept, new])
+    return combined.iloc[np.argsort(combined.index.asi8, kind='stable')]
+
+
+def _trim_to_hot_window(readings, hot_start):
+    """readings without the days before the hot window, and the window's start"""
+    if not len(readings):
+        return readings, hot_start
+    # The window only moves forward, so late readings don't bring old days back into memory
+    start = hot_window_start(readings.index[-1].value)
+    start = start if hot_start is None else max(start, hot_start)
+    first = readings.index.searchsorted(pd.Timestamp(start, tz='UTC'))
+    if first == 0:
+        return readings, start
+    logger.info(f"Keeping readings from {pd.Timestamp(start, tz='UTC'):%Y-%m-%d} in memory")
+    # A copy, so the older rows' memory is released
+    return readings.iloc[first:].copy(), start
+
+
+class DataStore:
+    """Room data that follows its NDJSON files as new lines are appended.
+
+    Readers call snapshot() once per request and keep using that object; a
+    refresh builds new frames and swaps the whole snapshot in one assignment,
+    so a request never sees a half-updated room. Each room's rollups are
+    rebuilt on reload and merged with the rollups of appended rows otherwise.
+    `readings` is the only copy of the rows kept in memory: it is extended in
+    place of a rebuild when appended rows are newer than everything already
+    loaded, and a reloaded room's file frame is dropped once its rows, rollups
+    and alerts are built.
+
+    With HOT_WINDOW_DAYS set, every reading is written to per-day partitions
+    in place of the whole-file columnar cache, and only the last
+    HOT_WINDOW_DAYS days are read into readings; load_range() reads older
+    days back. A restart parses only the lines appended since the partitions
+    were written and replays them a batch of days at a time to rebuild the
+    rollups and alert state, which always cover the whole history.
+
+    Alert rules run over every room's rows as they are read, and each
+    snapshot carries the events fired so far.
+    """
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.partitions = partition_store if HOT_WINDOW_DAYS > 0 else None
+        self.alerts = AlertEngine()
+        self._snapshot = Snapshot(0, {}, build_readings({}), alerts=empty_events())
+        self._files = {}
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def rollups(self):
+        return self._snapshot.rollups
+
+    @property
+    def readings(self):
+        return self._snapshot.readings
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    def _load_file(self, file_path, room_name):
+        """Load a whole room file, preferring the columnar cache"""
+        df, stats = load_cached_frame(file_path)
+        if df is not None:
+            logger.info(f"Loaded {room_name} from columnar cache")
+            tail, tail_stats = read_ndjson(file_path, start=stats.get("end_offset", 0))
+            if tail is not None:
+                df = pd.concat([df, tail], ignore_index=True)
+                stats = {
+                    "rows": stats.get("rows", 0) + tail_stats["rows"],
+                    "dropped": stats.get("dropped", 0) + tail_stats["dropped"],
+                    "end_offset": tail_stats["end_offset"],
+                }
+                save_cached_frame(file_path, df, stats)
+        else:
+            df, stats = read_ndjson(file_path)
+            if df is not None:
+                save_cached_frame(file_path, df, stats)
+
+        if stats.get("dropped"):
+            logger.warning(f"{room_name}: dropped {stats['dropped']} malformed line(s)")
+        logger.info(f"{room_name}: {stats.get('rows', 0)} readings loaded")
+        return df, stats
+
+    def _load_partitioned(self, file_path, room_name):
+        """Bring a room's day partitions up to date with its file, rebuilding its rollups and alert state.
+
+        Returns the rollups (None if the room has no readings) and the file
+        offset read up to. At most one batch of readings is in memory at once.
+        """
+        room = self.partitions.room(room_name)
+        self.alerts.evaluate(room_name, None, reset=True)
+        if room.is_current(file_path):
+            room_rollups = None
+            for batch in room.batches():
+                batch_rollups = RoomRollups.from_frame(batch)
+                room_rollups = batch_rollups if room_rollups is None else room_rollups.merge(batch_rollups)
+                self.alerts.evaluate(room_name, batch)
+            logger.info(f"Loaded {room_name} from day partitions")
+            df, stats = read_ndjson(file_path, start=room.end_offset())
+            if df is not None:
+                room.append(df, file_path, stats["end_offset"])
+                self.alerts.evaluate(room_name, df)
+                df_rollups = RoomRollups.from_frame(df)
+                room_rollups = df_rollups if room_rollups is None else room_rollups.merge(df_rollups)
+        else:
+            df, stats = read_ndjson(file_path)
+            room_rollups = None
+            if df is not None:
+                room.rewrite(df, file_path, stats["end_offset"])
+                self.alerts.evaluate(room_name, df)
+                room_rollups = RoomRollups.from_frame(df)
+
+        if stats["dropped"]:
+            logger.warning(f"{room_name}: dropped {stats['dropped']} malformed line(s)")
+        logger.info(f"{room_name}: {room.catalog()['rows'] if room_rollups is not None else 0} readings loaded")
+        return room_rollups, stats["end_offset"]
+
+    def _hot_rows(self, room_name):
+        """A partitioned room's readings from the start of its hot window"""
+        room = self.partitions.room(room_name)
+        latest = room.latest()
+        start = None if latest is None else hot_window_start(latest)
+        if start is not None and self._snapshot.hot_start is not None:
+            start = max(start, self._snapshot.hot_start)
+        df = room.load(start) if latest is not None else None
+        if df is None:
+            # Keeps the room in readings while all of its readings are older
+            return pd.DataFrame({'timestamp': pd.to_datetime([], utc=True)})
+        return df
+
+    def _refresh_file(self, file_path, room_name, frames, rollups, tails):
+        """Bring one room up to date; returns True if its readings changed.
+
+        A reloaded room's whole frame goes into frames (None once its file has
+        no readings), and rows read from the end of an already loaded file
+        into tails.
+        """
+        stat = os.stat(file_path)
+        state = self._files.get(file_path)
+
+        if state is None or stat.st_ino != state["inode"] or stat.st_size < state["offset"]:
+            if state is not None:
+                logger.info(f"{room_name}: file was replaced or truncated, reloading")
+            if self.partitions is not None:
+                room_rollups, end_offset = self._load_partitioned(file_path, room_name)
+                df = None if room_rollups is None else self._hot_rows(room_name)
+            else:
+                df, stats = self._load_file(file_path, room_name)
+                end_offset = stats.get("end_offset", 0)
+                room_rollups = None if df is None else RoomRollups.from_frame(df)
+                self.alerts.evaluate(room_name, df, reset=True)
+            self._files[file_path] = {"inode": stat.st_ino, "offset": end_offset}
+            if room_rollups is None:
+                if self.partitions is not None:
+                    self.partitions.remove(room_name)
+                self.alerts.remove(room_name)
+                if rollups.pop(room_name, None) is None:
+                    return False
+                frames[room_name] = None
+                return True
+            frames[room_name] = df
+            rollups[room_name] = room_rollups
+            return True
+
+        if stat.st_size == state["offset"]:
+            return False
+
+        tail, stats = read_ndjson(file_path, start=state["offset"])
+        state["offset"] = stats["end_offset"]
+        if stats["dropped"]:
+            logger.warning(f"{room_name}: dropped {stats['dropped']} malformed appended line(s)")
+        if tail is None:
+            return False
+        if self.partitions is not None:
+            self.partitions.room(room_name).append(tail, file_path, stats["end_offset"])
+        self.alerts.evaluate(room_name, tail)
+
+        tail_rollups = RoomRollups.from_frame(tail)
+        if room_name in rollups:
+            tails[room_name] = tail
+            rollups[room_name] = rollups[room_name].merge(tail_rollups)
+        else:
+            # The file had no readings before, so the tail is the whole room
+            frames[room_name] = tail
+            rollups[room_name] = tail_rollups
+        logger.debug(f"{room_name}: appended {stats['rows']} readings")
+        return True
+
+    def refresh(self):
+        """Pick up appended lines and new or removed room files"""
+        with self._refresh_lock:
+            rollups = dict(self._snapshot.rollups)
+            frames = {}
+            tails = {}
+            changed = False
+
+            files = glob(os.path.join(self.data_dir, "*.ndjson"))
+            for file_path in files:
+                room_name = os.path.basename(file_path).split('.')[0]
+                try:
+                    changed |= self._refresh_file(file_path, room_name, frames, rollups, tails)
+                except Exception as e:
+                    logger.error(f"Error loading data file: {e}")
+
+            for file_path in set(self._files) - set(files):
+                room_name = os.path.basename(file_path).split('.')[0]
+                logger.info(f"{room_name}: data file removed")
+                del self._files[file_path]
+                if self.partitions is not None:
+                    self.partitions.remove(room_name)
+                self.alerts.remove(room_name)
+                if rollups.pop(room_name, None) is not None:
+                    frames[room_name] = None
+                    changed = True
+
+            if changed:
+                readings = None if frames else _extend_readings(self._snapshot.readings, tails)
+                if readings is None:
+                    readings = _rebuild_readings(self._snapshot.readings, frames, tails)
+                hot_start = self._snapshot.hot_start
+                if self.partitions is not None:
+                    readings, hot_start = _trim_to_hot_window(readings, hot_start)
+                alerts = self.alerts.events(list(readings['room'].cat.categories))
+                self._snapshot = Snapshot(
+                    self._snapshot.version + 1, rollups, readings, hot_start=hot_start, alerts=alerts
+                )
+            return changed
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Data watcher refresh failed: {e}")
+
+    def start_watcher(self, interval=DATA_WATCH_INTERVAL):
+        """Poll the data directory in a background thread"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="data-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.data_dir} for new readings every {interval}s")
+
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
@@ -0,0 +1,75 @@
+import numpy as np
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype
+
+
+def time_series_columns(df):
+    """(time column, value columns, group columns) of a long time-series frame, or None"""
+    time_columns = [column for column in df.columns if is_datetime64_any_dtype(df[column])]
+    if not time_columns:
+        return None
+    values = [
+        column for column in df.columns
+        if column not in time_columns and is_numeric_dtype(df[column]) and not is_bool_dtype(df[column])
+    ]
+    if not values:
+        return None
+    groups = [column for column in df.columns if column not in time_columns and column not in values]
+    return time_columns[0], values, groups
+
+
+def _first_in_run(keys):
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+
+def _extreme_rows(values, keys):
+    """Row positions of the first minimum and first maximum of values for each key (NaN ignored)"""
+    order = np.argsort(keys, kind="stable")
+    starts = _first_in_run(keys[order])
+    run = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(order)]))
+    ordered = values[order]
+    rows = []
+    for reduce in (np.fmin, np.fmax):
+        extreme = reduce.reduceat(ordered, starts)
+        hits = np.flatnonzero(ordered == extreme[run])
+        rows.append(order[hits[_first_in_run(run[hits])]])
+    return rows
+
+
+def minmax_downsample(df, points):
+    """Rows of a time-series frame reduced to about points rows, or None if it isn't one.
+
+    Each series (one per combination of the non-numeric columns, e.g. per
+    room) is cut into equal time buckets. Every bucket keeps the rows holding
+    the minimum and maximum of each value column, plus the series' first and
+    last rows, so spikes and dips survive. Kept rows stay in their original
+    order.
+    """
+    layout = time_series_columns(df)
+    if layout is None or len(df) <= points or df[layout[0]].isna().any():
+        return None
+    time_column, values, groups = layout
+
+    if groups:
+        series = df.groupby(groups, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        series = np.zeros(len(df), dtype=np.int64)
+    n_series = int(series.max()) + 1
+    # Each bucket keeps up to two rows per value column
+    buckets = points // (n_series * 2 * len(values))
+    if buckets < 1:
+        return None
+
+    times = df[time_column].to_numpy(dtype="datetime64[ns]").view(np.int64).astype(np.float64)
+    # Series ids run 0..n_series-1, so the per-series rows line up with them
+    first, last = _extreme_rows(times, series)
+    start, stop = times[first], times[last]
+    span = np.maximum(stop - start, 1.0)[series]
+    bucket = np.minimum(((times - start[series]) / span * buckets).astype(np.int64), buckets - 1)
+    keys = series * buckets + bucket
+
+    keep = [first, last]
+    for column in values:
+        keep.extend(_extreme_rows(df[column].to_numpy(dtype=np.float64, na_value=np.nan), keys))
+
+    rows = np.unique(np.concatenate(keep))
+    return df.iloc[rows]
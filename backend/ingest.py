@@ -0,0 +1,212 @@
+import os
+import re
+import json
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CHUNK_BYTES = int(os.getenv("INGEST_CHUNK_BYTES", str(8 * 1024 * 1024)))
+
+COLUMN_VARIANTS = {
+    'co2': ['co2', 'CO2', 'CO2 (ppm)', 'CO2 (PPM)', 'co2_ppm', 'carbon_dioxide'],
+    'humidity': ['rh', 'RH', 'Relative Humidity (%)', 'humidity', 'Humidity', 'relative_humidity'],
+    'temperature': ['temp', 'Temp', 'Temperature (°C)', 'Temperature (\u00b0C)', 'temperature', 'Temperature'],
+    'timestamp': ['timestamp', 'time', 'datetime', 'date_time']
+}
+
+METRIC_COLUMNS = ['co2', 'humidity', 'temperature']
+
+
+def natural_key(label):
+    """Sort key that orders 'Room 2' before 'Room 10'"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", label)]
+
+
+def room_label(room_name):
+    """Display name of a room dataset, e.g. 'sensor_data_Room 1' -> 'Room 1'"""
+    if room_name.startswith("sensor_data_"):
+        room_name = room_name[len("sensor_data_"):]
+    return room_name.replace("_", " ")
+
+
+_VARIANT_LOOKUP = {
+    variant.lower(): standard_name
+    for standard_name, variants in COLUMN_VARIANTS.items()
+    for variant in variants
+}
+
+
+class _ColumnBuffer:
+    """Typed append-only array that grows geometrically"""
+
+    def __init__(self, dtype, fill, capacity):
+        self.dtype = dtype
+        self.fill = fill
+        self.size = 0
+        self.values = np.full(max(capacity, 1), fill, dtype=dtype)
+
+    def extend(self, values):
+        needed = self.size + len(values)
+        if needed > len(self.values):
+            grown = np.full(max(needed, int(len(self.values) * 1.5)), self.fill, dtype=self.dtype)
+            grown[:self.size] = self.values[:self.size]
+            self.values = grown
+        self.values[self.size:needed] = values
+        self.size = needed
+
+    def finish(self):
+        return self.values[:self.size]
+
+
+def _resolve_keys(record):
+    """Map a record's raw keys to standard column names"""
+    keys = {}
+    for key in record:
+        standard_name = _VARIANT_LOOKUP.get(key.lower())
+        if standard_name and standard_name not in keys:
+            keys[standard_name] = key
+    return keys
+
+
+def _decode_batch(lines):
+    """Decode a batch of NDJSON lines in one json.loads call, falling back per line"""
+    try:
+        records = json.loads(b"[" + b",".join(lines) + b"]")
+        if len(records) == len(lines) and all(isinstance(record, dict) for record in records):
+            return records, 0
+    except ValueError:
+        pass
+
+    records = []
+    dropped = 0
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            dropped += 1
+            continue
+        if isinstance(record, dict):
+            records.append(record)
+        else:
+            dropped += 1
+    return records, dropped
+
+
+def _column_values(records, standard_name, keys):
+    key = keys.get(standard_name)
+    if key is not None:
+        try:
+            return list(map(itemgetter(key), records))
+        except KeyError:
+            pass
+
+    # Rare: some records name their fields differently from the batch's first one
+    values = []
+    for record in records:
+        if key in record:
+            values.append(record[key])
+        else:
+            fallback = _resolve_keys(record).get(standard_name)
+            values.append(record[fallback] if fallback is not None else None)
+    return values
+
+
+def _to_float32(values):
+    try:
+        return np.array(values, dtype=np.float64).astype(np.float32)
+    except (TypeError, ValueError):
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(np.float32)
+
+
+def _to_epoch_ns(values):
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), errors='coerce', utc=True, format='ISO8601')
+    retry = parsed.isna() & pd.Series(values, dtype=object).notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(pd.Series(values, dtype=object)[retry], errors='coerce', utc=True, format='mixed')
+    return parsed.to_numpy('datetime64[ns]').view('int64')
+
+
+def _iter_line_batches(f, start):
+    """Yield (complete lines, offset after them) from fixed-size byte chunks"""
+    offset = start
+    remainder = b""
+    while True:
+        chunk = f.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        chunk = remainder + chunk
+        cut = chunk.rfind(b"\n")
+        if cut == -1:
+            remainder = chunk
+            continue
+        remainder = chunk[cut + 1:]
+        offset += cut + 1
+        yield chunk[:cut].split(b"\n"), offset
+
+    # An unterminated last line is only consumed once it parses; otherwise
+    # it is probably still being written and is left for the next read.
+    if remainder.strip():
+        try:
+            if isinstance(json.loads(remainder), dict):
+                yield [remainder], offset + len(remainder)
+        except ValueError:
+            pass
+
+
+def read_ndjson(file_path, start=0):
+    """Stream an NDJSON room file into a normalized DataFrame with bounded memory.
+
+    Returns the frame (None if no readings) and a stats dict with the number of
+    rows read, malformed lines dropped and the byte offset consumed up to.
+    """
+    file_size = os.path.getsize(file_path)
+    buffers = None
+    seen = set()
+    dropped = 0
+    end_offset = start
+
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        for lines, offset in _iter_line_batches(f, start):
+            lines = [line for line in lines if line.strip()]
+            end_offset = offset
+            if not lines:
+                continue
+
+            records, batch_dropped = _decode_batch(lines)
+            dropped += batch_dropped
+            if not records:
+                continue
+
+            if buffers is None:
+                # Size the buffers from the observed line length so most
+                # files never need to grow them.
+                line_bytes = sum(len(line) + 1 for line in lines) / len(lines)
+                capacity = int((file_size - start) / line_bytes * 1.05) + 1
+                buffers = {'timestamp': _ColumnBuffer(np.int64, np.iinfo(np.int64).min, capacity)}
+                for name in METRIC_COLUMNS:
+                    buffers[name] = _ColumnBuffer(np.float32, np.nan, capacity)
+
+            keys = _resolve_keys(records[0])
+            for name, buffer in buffers.items():
+                values = _column_values(records, name, keys)
+                if name not in seen and any(value is not None for value in values):
+                    seen.add(name)
+                buffer.extend(_to_epoch_ns(values) if name == 'timestamp' else _to_float32(values))
+
+    stats = {"rows": buffers['timestamp'].size if buffers else 0, "dropped": dropped, "end_offset": end_offset}
+    if not buffers or not stats["rows"]:
+        return None, stats
+
+    columns = {}
+    for name, buffer in buffers.items():
+        if name not in seen:
+            continue
+        values = buffer.finish()
+        if name == 'timestamp':
+            values = pd.DatetimeIndex(values.view('datetime64[ns]')).tz_localize('UTC')
+        columns[name] = values
+    return pd.DataFrame(columns, copy=False), stats
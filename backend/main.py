@@ -2,15 +2,32 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
-from fastapi import FastAPI
+import json
+import asyncio
+import traceback
+from fastapi import FastAPI, HTTPException, Query as QueryParam
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from agent_utils import load_data_files, run_openai_code_agent, execute_user_code
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+from agent_utils import DATA_DIR, code_agent_events, forget_generated_code
+from concurrency import ConcurrencyLimiter, Overloaded
+from data_store import DataStore
+from sandbox import SandboxPool
+from shared_data import SharedDataStore, lease
+from query_cache import MULTI_WORKER, result_cache, cache_stats
+from router import QUERY_ROUTER, match_query, run_intent
+from results import RESULT_PAGE_ROWS, store_frame, is_available, get_frame, iter_ndjson
+from tracing import trace_query, span, set_attrs, render_metrics
 from logging_config import setup_logger
 
 logger = setup_logger(__name__)
 app = FastAPI()
 
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "100"))
+# Questions of one batch answered at once; each also takes a query slot
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,29 +39,193 @@ app.add_middleware(
 class Query(BaseModel):
     query: str
 
+class BatchQuery(BaseModel):
+    queries: list[str] = Field(min_length=1, max_length=BATCH_MAX_QUERIES)
+
+store = SharedDataStore(DATA_DIR) if MULTI_WORKER else DataStore(DATA_DIR)
+limiter = ConcurrencyLimiter()
+sandbox = SandboxPool()
+
 @app.on_event("startup")
 def load_data():
-    global datasets
-    datasets = load_data_files()
+    store.refresh()
     logger.info("Datasets loaded on startup")
+    store.start_watcher()
+    sandbox.start()
+    sandbox.publish(store.snapshot())
+
+@app.on_event("shutdown")
+def stop_data_watcher():
+    store.stop_watcher()
+    sandbox.shutdown()
+
+SERVER_BUSY = {
+    "success": False,
+    "type": "text",
+    "data": "The server is busy right now. Please try again in a moment."
+}
+UNEXPECTED_ERROR = {
+    "success": False,
+    "type": "text",
+    "data": "An unexpected error occurred. Our team has been notified."
+}
+
+def busy_response(retry_after):
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(retry_after)},
+        content={"output": SERVER_BUSY},
+    )
 
 @app.post("/query")
-def process_query(request: Query) -> dict:
+async def process_query(request: Query):
+    with trace_query(request.query):
+        try:
+            async with limiter.slot():
+                result = await answer_query(request.query)
+        except Overloaded as e:
+            logger.warning(f"Rejecting query, server busy: {request.query}")
+            set_attrs(route="rejected", success=False)
+            return busy_response(e.retry_after)
+        # Encoded here rather than by FastAPI so the cost shows up in the trace
+        with span("serialize"):
+            return JSONResponse(jsonable_encoder(result))
+
+@app.post("/query/stream")
+async def stream_query(request: Query):
+    """Same answer as /query, sent as server-sent events while it is worked out"""
+    if limiter.full:
+        logger.warning(f"Rejecting query, server busy: {request.query}")
+        return busy_response(limiter.retry_after)
+    return StreamingResponse(
+        query_event_stream(request.query),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def query_event_stream(query: str):
+    # A comment line first so the client gets its first byte right away
+    yield ": accepted\n\n"
+    with trace_query(query):
+        try:
+            async with limiter.slot():
+                async for event, data in query_events(query, stream_tokens=True):
+                    if event == "result":
+                        with span("serialize"):
+                            data = json.dumps(data, default=str)
+                    else:
+                        data = json.dumps(data, default=str)
+                    yield f"event: {event}\ndata: {data}\n\n"
+        except Overloaded:
+            set_attrs(route="rejected", success=False)
+            yield f"event: result\ndata: {json.dumps({'output': SERVER_BUSY})}\n\n"
+
+@app.post("/query/batch")
+async def process_batch(request: BatchQuery):
+    """Answer many questions against one snapshot; results come back in request order"""
+    if limiter.full:
+        logger.warning(f"Rejecting batch of {len(request.queries)} queries, server busy")
+        return busy_response(limiter.retry_after)
+    snapshot = store.snapshot()
+    # Never more questions at once than the limiter runs, so a batch doesn't fill the queue itself
+    batch_slots = asyncio.Semaphore(min(BATCH_LLM_CONCURRENCY, limiter.limit))
+    # Repeated questions are answered once
+    unique = list(dict.fromkeys(request.queries))
+    logger.info(f"Received batch of {len(request.queries)} queries ({len(unique)} distinct)")
+    # Every question runs against this snapshot, so its files must outlive any refresh during the batch
+    manifest = await asyncio.to_thread(sandbox.publish, snapshot)
+    with lease(manifest):
+        answers = await asyncio.gather(*(answer_batch_item(query, snapshot, batch_slots) for query in unique))
+    outputs = dict(zip(unique, answers))
+    return JSONResponse(jsonable_encoder({
+        "results": [{"query": query, "output": outputs[query]} for query in request.queries]
+    }))
+
+async def answer_batch_item(query: str, snapshot, batch_slots: asyncio.Semaphore) -> dict:
+    """One question of a batch; it takes a query slot like a single /query does"""
+    async with batch_slots:
+        with trace_query(query):
+            set_attrs(batch=True)
+            try:
+                async with limiter.slot():
+                    return (await answer_query(query, snapshot))["output"]
+            except Overloaded:
+                logger.warning(f"Skipping batch query, server busy: {query}")
+                set_attrs(route="rejected", success=False)
+                return SERVER_BUSY
+
+async def answer_query(query: str, snapshot=None) -> dict:
+    async for event, data in query_events(query, snapshot=snapshot):
+        if event == "result":
+            return data
+
+async def query_events(query: str, stream_tokens: bool = False, snapshot=None):
+    """Work through one query, yielding (event, data) pairs.
+
+    "validation", "token" and "rejected" come from code generation, "execution" is sent
+    before generated code runs, and the last event is always "result" with
+    the /query response body. The query is answered from snapshot, or from
+    the current data when it is not given.
+    """
     try:
-        logger.info(f"Received query: {request.query}")
-        code = run_openai_code_agent(datasets, request.query)
+        logger.info(f"Received query: {query}")
+        snapshot = snapshot or store.snapshot()
+        intent = match_query(query) if QUERY_ROUTER else None
+        if intent is not None:
+            # Templated question: answer it from the rollups without the LLM
+            logger.info(f"Query router matched {intent}")
+            set_attrs(route="router")
+            with span("router"):
+                output = await asyncio.to_thread(run_intent, intent, snapshot)
+            yield "result", {"output": store_frame(output)}
+            return
+
+        code = None
+        async for event, data in code_agent_events(snapshot, query, stream_tokens):
+            if event == "code":
+                code = data
+            else:
+                yield event, data
         if isinstance(code, dict) and not code.get("success"):
-            return {"output": code}
-            
-        output = execute_user_code(code, datasets)
-        logger.info(f"Returned output: {output}")
-        return {"output": output}
+            set_attrs(success=False)
+            yield "result", {"output": code}
+            return
+
+        set_attrs(code=code)
+        output = result_cache.get_result(code, snapshot.version)
+        if output is None or not is_available(output):
+            yield "execution", {"cached": False}
+            output = store_frame(await sandbox.run_async(code, snapshot))
+            if output.get("success"):
+                result_cache.set_result(code, snapshot.version, output)
+            else:
+                forget_generated_code(query)
+        else:
+            yield "execution", {"cached": True}
+        set_attrs(success=output.get("success", False))
+        yield "result", {"output": output}
     except Exception as e:
         logger.error(f"Unexpected error processing query: {str(e)}\n{traceback.format_exc()}")
-        return {
-            "output": {
-                "success": False,
-                "type": "text",
-                "data": "An unexpected error occurred. Our team has been notified."
-            }
-        }
\ No newline at end of file
+        set_attrs(success=False)
+        yield "result", {"output": UNEXPECTED_ERROR}
+
+@app.get("/results/{result_id}")
+def get_result_page(result_id: str, offset: int = QueryParam(0, ge=0), limit: int = QueryParam(RESULT_PAGE_ROWS, ge=1)):
+    """Rows of a stored result as NDJSON, one JSON object per line"""
+    frame = get_frame(result_id)
+    if frame is None:
+        raise HTTPException(status_code=404, detail="Result expired or not found")
+    return StreamingResponse(
+        iter_ndjson(frame, offset, limit),
+        media_type="application/x-ndjson",
+        headers={"X-Total-Rows": str(len(frame))},
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Latency histograms and token counters in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+def get_cache_stats() -> dict:
+    return cache_stats()
@@ -0,0 +1,188 @@
+import os
+import json
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+from logging_config import setup_logger
+from data_cache import CACHE_DIR, read_frame, read_frames, write_frame, tail_fingerprint
+
+logger = setup_logger(__name__)
+
+PARTITION_DIR = os.getenv("PARTITION_DIR", os.path.join(CACHE_DIR, "partitions"))
+# Days of readings kept in memory; older days are read from PARTITION_DIR on demand (0 keeps everything resident)
+HOT_WINDOW_DAYS = int(os.getenv("HOT_WINDOW_DAYS", "30"))
+# Rows read at a time when a room's whole history is replayed from its partitions
+PARTITION_BATCH_ROWS = int(os.getenv("PARTITION_BATCH_ROWS", "1000000"))
+
+DAY_NS = 86400 * 10**9
+_NAT = np.iinfo(np.int64).min
+
+
+def hot_window_start(latest_ns):
+    """Epoch ns of the first day kept in memory when the newest reading is at latest_ns"""
+    return (latest_ns // DAY_NS - (HOT_WINDOW_DAYS - 1)) * DAY_NS
+
+
+def _timestamps(df):
+    return df['timestamp'].to_numpy('datetime64[ns]').view('int64')
+
+
+class RoomPartitions:
+    """One room's readings as one columnar file per UTC day.
+
+    catalog.json records each day's row count and first/last timestamp, so a
+    time-range read only opens the days that overlap it, plus the offset the
+    room file has been read up to and a fingerprint of the bytes before it,
+    so a restart only parses lines appended since.
+    """
+
+    def __init__(self, root, room_name):
+        self.room_name = room_name
+        self.path = os.path.join(root, room_name)
+        self._catalog = None
+        self._catalog_mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def _catalog_path(self):
+        return os.path.join(self.path, "catalog.json")
+
+    def catalog(self):
+        """The catalog, re-read when another process has rewritten it"""
+        with self._lock:
+            try:
+                mtime = os.stat(self._catalog_path).st_mtime_ns
+            except FileNotFoundError:
+                return {"rows": 0, "source": None, "partitions": {}}
+            if mtime != self._catalog_mtime:
+                with open(self._catalog_path) as f:
+                    self._catalog = json.load(f)
+                self._catalog_mtime = mtime
+            return self._catalog
+
+    def _save_catalog(self, catalog):
+        tmp_path = f"{self._catalog_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(catalog, f)
+        os.replace(tmp_path, self._catalog_path)
+        with self._lock:
+            self._catalog = catalog
+            self._catalog_mtime = os.stat(self._catalog_path).st_mtime_ns
+
+    def is_current(self, file_path):
+        """Whether the partitions hold the room file up to end_offset(), with at most lines appended since"""
+        source = self.catalog().get("source")
+        if not source:
+            return False
+        end_offset = source["end_offset"]
+        try:
+            return os.path.getsize(file_path) >= end_offset and source["tail_sha1"] == tail_fingerprint(file_path, end_offset)
+        except OSError:
+            return False
+
+    def end_offset(self):
+        return self.catalog()["source"]["end_offset"]
+
+    def latest(self):
+        """Epoch ns of the newest reading, or None if there are none"""
+        partitions = self.catalog()["partitions"]
+        return max((entry["end"] for entry in partitions.values()), default=None)
+
+    def rewrite(self, df, file_path, end_offset):
+        """Replace the partitions with a whole room file's rows, read up to end_offset"""
+        logger.info(f"{self.room_name}: writing {len(df)} readings to day partitions")
+        shutil.rmtree(self.path, ignore_errors=True)
+        self._write(df, {"rows": 0, "source": None, "partitions": {}}, file_path, end_offset)
+
+    def append(self, tail, file_path, end_offset):
+        """Add rows read from the end of the room file, up to end_offset, to their day partitions"""
+        catalog = self.catalog()
+        self._write(tail, {**catalog, "partitions": dict(catalog["partitions"])}, file_path, end_offset)
+
+    def _write(self, df, catalog, file_path, end_offset):
+        os.makedirs(self.path, exist_ok=True)
+        timestamps = _timestamps(df)
+        valid = np.flatnonzero(timestamps != _NAT)
+        days = timestamps[valid] // DAY_NS
+        by_day = np.argsort(days, kind="stable")
+        order, days = valid[by_day], days[by_day]
+        bounds = np.flatnonzero(np.diff(days)) + 1
+
+        for rows in np.split(order, bounds) if len(order) else []:
+            day = pd.Timestamp(int(timestamps[rows[0]] // DAY_NS * DAY_NS), tz="UTC").strftime("%Y-%m-%d")
+            part = df.iloc[rows]
+            if day in catalog["partitions"]:
+                existing, _ = read_frame(os.path.join(self.path, day))
+                if existing is not None:
+                    part = pd.concat([existing, part], ignore_index=True)
+            part = part.sort_values("timestamp", kind="stable", ignore_index=True)
+            write_frame(os.path.join(self.path, day), part)
+            part_timestamps = _timestamps(part)
+            catalog["partitions"][day] = {
+                "rows": len(part),
+                "start": int(part_timestamps[0]),
+                "end": int(part_timestamps[-1]),
+            }
+
+        catalog["rows"] += len(df)
+        catalog["source"] = {"end_offset": end_offset, "tail_sha1": tail_fingerprint(file_path, end_offset)}
+        self._save_catalog(catalog)
+
+    def load(self, start=None, end=None):
+        """Readings with timestamps in [start, end) (epoch ns), or None if there are none"""
+        days = [
+            day for day, entry in sorted(self.catalog()["partitions"].items())
+            if not ((start is not None and entry["end"] < start) or (end is not None and entry["start"] >= end))
+        ]
+        frame = read_frames([os.path.join(self.path, day) for day in days])
+        if frame is None:
+            return None
+        # Days are sorted and follow each other, so the range is one slice
+        timestamps = _timestamps(frame)
+        lo = 0 if start is None else np.searchsorted(timestamps, start)
+        hi = len(frame) if end is None else np.searchsorted(timestamps, end)
+        if lo >= hi:
+            return None
+        return frame.iloc[lo:hi].reset_index(drop=True)
+
+    def batches(self, max_rows=PARTITION_BATCH_ROWS):
+        """Every reading in time order, as frames of whole days holding about max_rows rows each"""
+        days = sorted(self.catalog()["partitions"].items())
+        batch, rows = [], 0
+        for index, (day, entry) in enumerate(days):
+            batch.append(day)
+            rows += entry["rows"]
+            if rows >= max_rows or index == len(days) - 1:
+                frame = read_frames([os.path.join(self.path, day) for day in batch])
+                if frame is not None:
+                    yield frame
+                batch, rows = [], 0
+
+
+class PartitionStore:
+    """Day partitions of every room, under root/<room name>/"""
+
+    def __init__(self, root=PARTITION_DIR):
+        self.root = root
+        self._rooms = {}
+
+    def room(self, room_name):
+        if room_name not in self._rooms:
+            self._rooms[room_name] = RoomPartitions(self.root, room_name)
+        return self._rooms[room_name]
+
+    def room_names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, "catalog.json"))
+        )
+
+    def remove(self, room_name):
+        self._rooms.pop(room_name, None)
+        shutil.rmtree(os.path.join(self.root, room_name), ignore_errors=True)
+
+
+partition_store = PartitionStore()
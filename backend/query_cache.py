@@ -0,0 +1,278 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+CODE_CACHE_FILE = os.getenv("CODE_CACHE_FILE", "./data/.cache/generated_code.json")
+CODE_CACHE_SIZE = int(os.getenv("CODE_CACHE_SIZE", "1000"))
+CODE_CACHE_TTL = float(os.getenv("CODE_CACHE_TTL", str(7 * 24 * 3600)))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "500"))
+# Short by default: generated code often filters relative to "now"
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))
+
+# Several server processes share room data (shared_data.py) and keep their caches in SHARED_CACHE_DB
+MULTI_WORKER = os.getenv("MULTI_WORKER", "false").lower() == "true"
+SHARED_CACHE_DB = os.getenv("SHARED_CACHE_DB", "./data/.cache/shared_cache.sqlite")
+
+
+class LRUCache:
+    """Thread-safe LRU cache with a TTL and size cap, optionally persisted as JSON"""
+
+    def __init__(self, name, maxsize, ttl, path=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+            now = time.time()
+            for key, (expires, value) in entries.items():
+                if expires > now:
+                    self._entries[key] = (expires, value)
+            logger.info(f"Loaded {len(self._entries)} {self.name} cache entries from {self.path}")
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable {self.name} cache file: {e}")
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp-{os.getpid()}"
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning(f"Failed to persist {self.name} cache: {e}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] > time.time()
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            if self.path:
+                self._save()
+
+    def pop(self, key):
+        with self._lock:
+            removed = self._entries.pop(key, None) is not None
+            if removed and self.path:
+                self._save()
+            return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self.path:
+                self._save()
+
+    def retain(self, suffix):
+        """Drop every entry whose key doesn't end with suffix"""
+        with self._lock:
+            for key in [key for key in self._entries if not key.endswith(suffix)]:
+                del self._entries[key]
+            if self.path:
+                self._save()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.maxsize,
+            }
+
+
+class SQLiteCache:
+    """LRUCache kept in a SQLite file, so every server process shares it.
+
+    Entries are serialized with dumps/loads (JSON by default). Hit and miss
+    counts are per process.
+    """
+
+    def __init__(self, name, path, maxsize, ttl, dumps=None, loads=json.loads):
+        self.name = name
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._dumps = dumps or (lambda value: json.dumps(value, default=str))
+        self._loads = loads
+        self._table = re.sub(r"\W", "_", name)
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        # Opened on first use so processes that never touch the cache don't hold the file
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._table} "
+                "(key TEXT PRIMARY KEY, expires REAL, used REAL, value BLOB)"
+            )
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {self._table}_used ON {self._table} (used)")
+        return self._db
+
+    def get(self, key):
+        with self._lock:
+            db = self._connection()
+            now = time.time()
+            row = db.execute(f"SELECT expires, value FROM {self._table} WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[0] > now:
+                db.execute(f"UPDATE {self._table} SET used = ? WHERE key = ?", (now, key))
+                self.hits += 1
+                return self._loads(row[1])
+            if row is not None:
+                db.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+            self.misses += 1
+            return None
+
+    def __contains__(self, key):
+        with self._lock:
+            row = self._connection().execute(
+                f"SELECT 1 FROM {self._table} WHERE key = ? AND expires > ?", (key, time.time())
+            ).fetchone()
+            return row is not None
+
+    def set(self, key, value):
+        value = self._dumps(value)
+        with self._lock:
+            db = self._connection()
+            now = time.time()
+            db.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, expires, used, value) VALUES (?, ?, ?, ?)",
+                (key, now + self.ttl, now, value),
+            )
+            db.execute(f"DELETE FROM {self._table} WHERE expires <= ?", (now,))
+            db.execute(
+                f"DELETE FROM {self._table} WHERE key IN "
+                f"(SELECT key FROM {self._table} ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                (self.maxsize,),
+            )
+
+    def pop(self, key):
+        with self._lock:
+            return self._connection().execute(f"DELETE FROM {self._table} WHERE key = ?", (key,)).rowcount > 0
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute(f"DELETE FROM {self._table}")
+
+    def retain(self, suffix):
+        """Drop every entry whose key doesn't end with suffix"""
+        with self._lock:
+            self._connection().execute(
+                f"DELETE FROM {self._table} WHERE substr(key, -?) != ?", (len(suffix), suffix)
+            )
+
+    def stats(self):
+        with self._lock:
+            size = self._connection().execute(
+                f"SELECT COUNT(*) FROM {self._table} WHERE expires > ?", (time.time(),)
+            ).fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": size,
+                "max_size": self.maxsize,
+            }
+
+
+def make_cache(name, maxsize, ttl, path=None, dumps=None, loads=json.loads):
+    """A SQLiteCache in SHARED_CACHE_DB in multi-worker mode, otherwise an in-process LRUCache.
+
+    dumps/loads only matter for the shared cache; path persists the in-process one.
+    """
+    if MULTI_WORKER:
+        return SQLiteCache(name, SHARED_CACHE_DB, maxsize, ttl, dumps=dumps, loads=loads)
+    return LRUCache(name, maxsize, ttl, path=path)
+
+
+class ResultCache:
+    """Execution outputs keyed by code hash, dropped whenever the room data changes"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.data_version = None
+
+    def _check_version(self, data_version):
+        if data_version != self.data_version:
+            if self.data_version is not None:
+                # Entries of other versions only; another process may already be on this one
+                self.cache.retain(f":{data_version}")
+            self.data_version = data_version
+
+    def get_result(self, code, data_version):
+        self._check_version(data_version)
+        return self.cache.get(f"{code_hash(code)}:{data_version}")
+
+    def set_result(self, code, data_version, output):
+        self._check_version(data_version)
+        self.cache.set(f"{code_hash(code)}:{data_version}", output)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form of a question used as the generated-code cache key"""
+    normalized = re.sub(r"\s+", " ", query.strip().lower())
+    return normalized.rstrip("?!. ")
+
+
+def code_hash(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+code_cache = make_cache("generated code", CODE_CACHE_SIZE, CODE_CACHE_TTL, path=CODE_CACHE_FILE)
+result_cache = ResultCache(make_cache("result", RESULT_CACHE_SIZE, RESULT_CACHE_TTL))
+
+
+def cache_stats():
+    return {"code": code_cache.stats(), "result": result_cache.stats()}
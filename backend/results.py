@@ -0,0 +1,82 @@
+import os
+import json
+import uuid
+import pickle
+from logging_config import setup_logger
+from query_cache import make_cache
+from downsample import minmax_downsample
+
+logger = setup_logger(__name__)
+
+# Rows sent with the answer itself and per page of GET /results/{id}
+RESULT_PAGE_ROWS = int(os.getenv("RESULT_PAGE_ROWS", "500"))
+RESULT_STORE_SIZE = int(os.getenv("RESULT_STORE_SIZE", "50"))
+RESULT_STORE_TTL = float(os.getenv("RESULT_STORE_TTL", "900"))
+# Time-series answers longer than this are sent as a min/max-per-bucket view (0 disables)
+DOWNSAMPLE_POINTS = int(os.getenv("DOWNSAMPLE_POINTS", "1000"))
+
+# Rows serialized per chunk while streaming a page
+_STREAM_CHUNK_ROWS = 5000
+
+stored_results = make_cache("stored result", RESULT_STORE_SIZE, RESULT_STORE_TTL, dumps=pickle.dumps, loads=pickle.loads)
+
+
+def records(df):
+    """JSON-ready rows of a display frame: NaN becomes null and timestamps ISO 8601"""
+    return json.loads(df.to_json(orient="records", date_format="iso", date_unit="s"))
+
+
+def dataframe_output(df, page_rows=None):
+    """The answer for a display-ready frame.
+
+    Time series longer than DOWNSAMPLE_POINTS carry a downsampled view in
+    "data", and other frames longer than one page only their first page. In
+    both cases the whole frame rides along under "frame" until store_frame()
+    keeps it for GET /results/{id}.
+    """
+    page_rows = page_rows or RESULT_PAGE_ROWS
+    view = minmax_downsample(df, DOWNSAMPLE_POINTS) if DOWNSAMPLE_POINTS else None
+    output = {
+        "success": True,
+        "type": "dataframe",
+        "data": records(df.iloc[:page_rows] if view is None else view),
+        "columns": [str(column) for column in df.columns],
+    }
+    if view is not None:
+        logger.info(f"Downsampled a {len(df)} row time series to {len(view)} rows")
+        output["downsampled"] = {"method": "minmax", "rows": len(view)}
+    if view is not None or len(df) > page_rows:
+        output["frame"] = df
+    return output
+
+
+def store_frame(output):
+    """Move a paginated answer's frame into the result store, leaving its id and size behind"""
+    frame = output.pop("frame", None)
+    if frame is None:
+        return output
+    result_id = uuid.uuid4().hex
+    stored_results.set(result_id, frame)
+    output.update(result_id=result_id, total_rows=len(frame), has_more=True)
+    if "downsampled" in output:
+        output["downsampled"]["full_result"] = f"/results/{result_id}?limit={len(frame)}"
+    logger.info(f"Stored {len(frame)} result rows as {result_id}")
+    return output
+
+
+def is_available(output):
+    """False if a cached answer points at a stored result that has since expired"""
+    result_id = output.get("result_id")
+    return result_id is None or result_id in stored_results
+
+
+def get_frame(result_id):
+    return stored_results.get(result_id)
+
+
+def iter_ndjson(frame, offset=0, limit=None):
+    """Rows offset..offset+limit of a stored frame as NDJSON, serialized a chunk at a time"""
+    stop = len(frame) if limit is None else min(len(frame), offset + limit)
+    for start in range(offset, stop, _STREAM_CHUNK_ROWS):
+        chunk = frame.iloc[start:min(start + _STREAM_CHUNK_ROWS, stop)]
+        yield chunk.to_json(orient="records", lines=True, date_format="iso", date_unit="s")
@@ -0,0 +1,325 @@
+import os
+import re
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from ingest import METRIC_COLUMNS, natural_key, room_label
+
+# Bucket widths in nanoseconds, finest first
+FREQUENCIES = {
+    "minute": 60 * 10**9,
+    "hour": 3600 * 10**9,
+    "day": 86400 * 10**9,
+}
+
+# Quantile sketches are fixed-width histograms kept only for the coarser
+# buckets; a minute bucket rarely holds more than one reading.
+SKETCH_FREQUENCIES = ("hour", "day")
+SKETCH_BINS = {
+    "co2": (0.0, 5000.0, 250),
+    "humidity": (0.0, 100.0, 200),
+    "temperature": (-10.0, 50.0, 240),
+}
+
+# Columns of each rollup's stats array
+COUNT, SUM, SUMSQ, MIN, MAX = range(5)
+
+_PERCENTILE = re.compile(r"^p(\d{1,2}(?:\.\d+)?)$")
+
+
+class Rollup:
+    """Mergeable per-bucket statistics of one room's metrics at one frequency.
+
+    keys holds the sorted bucket start times (epoch ns); stats[metric] is an
+    (n, 5) array of count/sum/sum of squares/min/max; hist[metric], when
+    present, is an (n, bins) histogram used as a quantile sketch.
+    """
+
+    def __init__(self, freq, keys, stats, hist):
+        self.freq = freq
+        self.keys = keys
+        self.stats = stats
+        self.hist = hist
+
+    @classmethod
+    def from_frame(cls, df, freq):
+        width = FREQUENCIES[freq]
+        timestamps = df['timestamp'].to_numpy('datetime64[ns]').view('int64')
+        valid = timestamps != np.iinfo(np.int64).min
+        buckets = timestamps[valid] // width * width
+        keys, inverse = np.unique(buckets, return_inverse=True)
+        n = len(keys)
+
+        stats = {}
+        hist = {}
+        for metric in METRIC_COLUMNS:
+            values = df[metric].to_numpy(np.float64)[valid] if metric in df.columns else np.full(len(buckets), np.nan)
+            present = ~np.isnan(values)
+            index = inverse[present]
+            values = values[present]
+
+            metric_stats = np.zeros((n, 5))
+            metric_stats[:, COUNT] = np.bincount(index, minlength=n)
+            metric_stats[:, SUM] = np.bincount(index, weights=values, minlength=n)
+            metric_stats[:, SUMSQ] = np.bincount(index, weights=values * values, minlength=n)
+            metric_stats[:, MIN] = np.inf
+            metric_stats[:, MAX] = -np.inf
+            np.minimum.at(metric_stats[:, MIN], index, values)
+            np.maximum.at(metric_stats[:, MAX], index, values)
+            empty = metric_stats[:, COUNT] == 0
+            metric_stats[empty, MIN] = np.nan
+            metric_stats[empty, MAX] = np.nan
+            stats[metric] = metric_stats
+
+            if freq in SKETCH_FREQUENCIES:
+                lo, hi, bins = SKETCH_BINS[metric]
+                bin_index = np.clip(((values - lo) / (hi - lo) * bins).astype(np.int64), 0, bins - 1)
+                counts = np.bincount(index * bins + bin_index, minlength=n * bins)
+                hist[metric] = counts.reshape(n, bins).astype(np.uint32)
+
+        return cls(freq, keys, stats, hist)
+
+    def merge(self, other):
+        """Combine with another rollup of the same frequency, e.g. for appended rows"""
+        keys = np.union1d(self.keys, other.keys)
+        mine = np.searchsorted(keys, self.keys)
+        theirs = np.searchsorted(keys, other.keys)
+
+        stats = {}
+        hist = {}
+        for metric in METRIC_COLUMNS:
+            merged = np.zeros((len(keys), 5))
+            merged[:, MIN] = np.nan
+            merged[:, MAX] = np.nan
+            merged[mine] = self.stats[metric]
+            ours, new = merged[theirs], other.stats[metric]
+            ours[:, COUNT:MIN] += new[:, COUNT:MIN]
+            ours[:, MIN] = np.fmin(ours[:, MIN], new[:, MIN])
+            ours[:, MAX] = np.fmax(ours[:, MAX], new[:, MAX])
+            merged[theirs] = ours
+            stats[metric] = merged
+
+            if metric in self.hist:
+                counts = np.zeros((len(keys), self.hist[metric].shape[1]), dtype=np.uint32)
+                counts[mine] = self.hist[metric]
+                counts[theirs] += other.hist[metric]
+                hist[metric] = counts
+
+        return Rollup(self.freq, keys, stats, hist)
+
+    def select(self, start=None, end=None):
+        """Row slice of buckets starting in [start, end), found by binary search"""
+        lo = 0 if start is None else np.searchsorted(self.keys, start // FREQUENCIES[self.freq] * FREQUENCIES[self.freq])
+        hi = len(self.keys) if end is None else np.searchsorted(self.keys, end)
+        return slice(lo, hi)
+
+
+class RoomRollups:
+    """All rollup frequencies for one room"""
+
+    def __init__(self, levels):
+        self.levels = levels
+
+    @classmethod
+    def from_frame(cls, df):
+        return cls({freq: Rollup.from_frame(df, freq) for freq in FREQUENCIES})
+
+    def merge(self, other):
+        return RoomRollups({freq: level.merge(other.levels[freq]) for freq, level in self.levels.items()})
+
+    def save(self, path):
+        """Atomically write the arrays as memory-mappable .npy files"""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        meta = {}
+        for freq, level in self.levels.items():
+            np.save(os.path.join(tmp_path, f"{freq}-keys.npy"), level.keys)
+            for metric in METRIC_COLUMNS:
+                np.save(os.path.join(tmp_path, f"{freq}-{metric}-stats.npy"), level.stats[metric])
+                if metric in level.hist:
+                    np.save(os.path.join(tmp_path, f"{freq}-{metric}-hist.npy"), level.hist[metric])
+            meta[freq] = sorted(level.hist)
+        with open(os.path.join(tmp_path, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        with open(os.path.join(path, "meta.json"), 'r') as f:
+            meta = json.load(f)
+        levels = {}
+        for freq, sketched in meta.items():
+            load = lambda name: np.load(os.path.join(path, f"{freq}-{name}.npy"), mmap_mode=mmap_mode)
+            levels[freq] = Rollup(
+                freq,
+                load("keys"),
+                {metric: load(f"{metric}-stats") for metric in METRIC_COLUMNS},
+                {metric: load(f"{metric}-hist") for metric in sketched},
+            )
+        return cls(levels)
+
+
+def to_ns(value):
+    """Epoch nanoseconds of a timestamp, taking naive values as UTC; None stays None"""
+    if value is None:
+        return None
+    timestamp = pd.Timestamp(value)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize('UTC')
+    return timestamp.value
+
+
+def _room_key(room):
+    return re.sub(r"[\s_]+", " ", str(room)).strip().lower()
+
+
+def select_rooms(names, rooms):
+    """The names (room files or labels) matching rooms: a label such as 'Room 1', a room number, or a list of either"""
+    if rooms is None:
+        return list(names)
+    if isinstance(rooms, (str, int)):
+        rooms = [rooms]
+    wanted = {_room_key(room) for room in rooms}
+    wanted |= {f"room {room}" for room in wanted if room.isdigit()}
+    return [name for name in names if _room_key(room_label(name)) in wanted or _room_key(name) in wanted]
+
+
+def _pick_frequency(start, end, stats):
+    """Coarsest frequency whose buckets line up with both ends of the range"""
+    needs_sketch = any(_PERCENTILE.match(stat) or stat == "median" for stat in stats)
+    for freq in ("day", "hour", "minute"):
+        width = FREQUENCIES[freq]
+        if all(bound is None or bound % width == 0 for bound in (start, end)):
+            if needs_sketch and freq not in SKETCH_FREQUENCIES:
+                return "hour"
+            return freq
+    return "hour" if needs_sketch else "minute"
+
+
+def _quantile(counts, q, lo, hi, low_bound, high_bound):
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    bins = len(counts)
+    cumulative = np.cumsum(counts)
+    target = q * total
+    index = int(np.searchsorted(cumulative, target))
+    before = cumulative[index - 1] if index > 0 else 0
+    fraction = (target - before) / counts[index] if counts[index] else 0.0
+    value = lo + (index + fraction) * (hi - lo) / bins
+    return float(min(max(value, low_bound), high_bound))
+
+
+def _aggregate(level, metric, rows, stats):
+    """Reduce a block of bucket rows to the requested statistics"""
+    block = level.stats[metric][rows]
+    count = block[:, COUNT].sum()
+    values = {}
+    for stat in stats:
+        if count == 0:
+            values[stat] = np.nan
+        elif stat == "count":
+            values[stat] = int(count)
+        elif stat == "sum":
+            values[stat] = block[:, SUM].sum()
+        elif stat == "mean":
+            values[stat] = block[:, SUM].sum() / count
+        elif stat == "std":
+            mean = block[:, SUM].sum() / count
+            values[stat] = float(np.sqrt(max(block[:, SUMSQ].sum() / count - mean * mean, 0.0)))
+        elif stat == "min":
+            values[stat] = np.nanmin(block[:, MIN])
+        elif stat == "max":
+            values[stat] = np.nanmax(block[:, MAX])
+        else:
+            match = _PERCENTILE.match(stat)
+            q = 0.5 if stat == "median" else float(match.group(1)) / 100 if match else None
+            if q is None:
+                raise ValueError(f"Unknown statistic '{stat}'")
+            if metric not in level.hist:
+                raise ValueError(f"Percentiles need hour or day buckets, not {level.freq}")
+            lo, hi, _ = SKETCH_BINS[metric]
+            counts = level.hist[metric][rows].sum(axis=0)
+            values[stat] = _quantile(counts, q, lo, hi, np.nanmin(block[:, MIN]), np.nanmax(block[:, MAX]))
+    return values
+
+
+def _stat_label(stat):
+    if stat == "median" or _PERCENTILE.match(stat):
+        return "Median" if stat == "median" else f"P{stat[1:]}"
+    return {"count": "Count", "sum": "Sum", "mean": "Mean", "std": "Std", "min": "Min", "max": "Max"}[stat]
+
+
+class RollupIndex:
+    """Helper API over pre-aggregated room statistics, exposed to generated code as `rollups`.
+
+    rollups.summary(metric, start=None, end=None, rooms=None, stats=("mean", "min", "max"))
+        One row per room. stats may include count, sum, mean, std, min, max,
+        median and percentiles such as "p95". start/end accept anything
+        pd.Timestamp does (naive values are UTC); the range is [start, end).
+    rollups.series(metric, freq="hour", start=None, end=None, rooms=None, stats=("mean",))
+        One row per room and bucket ("minute", "hour" or "day").
+
+    Both work on bucket boundaries: summary uses the coarsest buckets that line
+    up with start and end, falling back to minute buckets, and percentiles are
+    approximate (fixed-width histograms over hour or day buckets).
+    """
+
+    def __init__(self, rooms):
+        # Rooms come out in natural label order ('Room 2' before 'Room 10'), like readings
+        self.rooms = {room: rooms[room] for room in sorted(rooms, key=lambda room: natural_key(room_label(room)))}
+
+    def summary(self, metric, start=None, end=None, rooms=None, stats=("mean", "min", "max")):
+        if metric not in METRIC_COLUMNS:
+            raise ValueError(f"metric must be one of {METRIC_COLUMNS}")
+        if isinstance(stats, str):
+            stats = [stats]
+        start, end = to_ns(start), to_ns(end)
+        freq = _pick_frequency(start, end, stats)
+
+        records = []
+        for room in select_rooms(self.rooms, rooms):
+            level = self.rooms[room].levels[freq]
+            values = _aggregate(level, metric, level.select(start, end), stats)
+            records.append({"Room": room_label(room), **{_stat_label(stat): values[stat] for stat in stats}})
+        return pd.DataFrame(records, columns=["Room"] + [_stat_label(stat) for stat in stats])
+
+    def series(self, metric, freq="hour", start=None, end=None, rooms=None, stats=("mean",)):
+        if metric not in METRIC_COLUMNS:
+            raise ValueError(f"metric must be one of {METRIC_COLUMNS}")
+        if isinstance(stats, str):
+            stats = [stats]
+        start, end = to_ns(start), to_ns(end)
+
+        frames = []
+        for room in select_rooms(self.rooms, rooms):
+            level = self.rooms[room].levels[freq]
+            rows = level.select(start, end)
+            block = level.stats[metric][rows]
+            count = block[:, COUNT]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = block[:, SUM] / count
+                columns = {
+                    "count": count.astype(np.int64),
+                    "sum": block[:, SUM],
+                    "mean": mean,
+                    "std": np.sqrt(np.maximum(block[:, SUMSQ] / count - mean * mean, 0.0)),
+                    "min": block[:, MIN],
+                    "max": block[:, MAX],
+                }
+            frame = pd.DataFrame({"Room": room_label(room), "Time": pd.to_datetime(level.keys[rows], utc=True)})
+            for stat in stats:
+                if stat in columns:
+                    frame[_stat_label(stat)] = columns[stat]
+                else:
+                    frame[_stat_label(stat)] = [
+                        _aggregate(level, metric, slice(i, i + 1), [stat])[stat]
+                        for i in range(rows.start, rows.stop)
+                    ]
+            frames.append(frame[count > 0].reset_index(drop=True))
+        if not frames:
+            return pd.DataFrame(columns=["Room", "Time"] + [_stat_label(stat) for stat in stats])
+        return pd.concat(frames, ignore_index=True)
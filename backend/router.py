@@ -0,0 +1,478 @@
+import os
+import re
+from functools import lru_cache
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from logging_config import setup_logger
+from alerts import ALERT_RULES, empty_events
+from data_store import load_range
+from query_cache import normalize_query
+from rollups import RollupIndex
+from results import dataframe_output
+
+logger = setup_logger(__name__)
+
+# Answer templated questions locally instead of asking the LLM
+QUERY_ROUTER = os.getenv("QUERY_ROUTER", "true").lower() == "true"
+
+# A parsed question. rooms is None for every room, window is a key of
+# WINDOWS plus its arguments, group is None, "hour" or "day", and rank is
+# None, "highest" or "lowest" for "which room ..." questions.
+Intent = namedtuple("Intent", ["metric", "stats", "rooms", "window", "group", "rank"])
+
+# An alerting question. With op ("above" or "below") and limit it asks
+# whether metric crossed limit; otherwise it asks which alerts fired, kind
+# narrowing them to one kind of rule when set. metric may be None then.
+# count is set for "how many times" questions.
+AlertIntent = namedtuple("AlertIntent", ["metric", "op", "limit", "kind", "rooms", "window", "count"])
+
+METRICS = (
+    (r"co2|co₂|carbon dioxide", "co2"),
+    (r"temperatures?|temp", "temperature"),
+    (r"relative humidity|humidity|humid|rh", "humidity"),
+)
+METRIC_NAMES = {"co2": "CO2", "temperature": "temperature", "humidity": "humidity"}
+UNITS = {"co2": " ppm", "temperature": " °C", "humidity": "%"}
+
+STATS = (
+    (r"average|avg|mean", "mean"),
+    (r"maximum|max|highest|peak", "max"),
+    (r"minimum|min|lowest", "min"),
+    (r"median", "median"),
+    (r"standard deviation|std|stdev", "std"),
+    (r"(?:how many|number of|count of) (?:readings|records|measurements)", "count"),
+)
+STAT_NAMES = {"mean": "Average", "max": "Maximum", "min": "Minimum", "median": "Median",
+              "std": "Standard Deviation", "count": "Readings"}
+# Exact quantiles need the raw readings; everything else comes from rollups
+QUANTILE_STATS = re.compile(r"^(?:median|p\d{1,2})$")
+
+WINDOWS = (
+    (r"today", "today"),
+    (r"yesterday", "yesterday"),
+    (r"this week", "this_week"),
+    (r"this month", "this_month"),
+    (r"(?:last|previous) month", "last_month"),
+    (r"(?:in |over |during )?(?:the )?(?:last|past|previous) (\d+) (minute|hour|day|week)s?", "rolling"),
+    (r"(?:in |over |during )?(?:the )?(?:last|past|previous) (minute|hour|day|week)", "rolling"),
+    (r"all time|overall|ever", "all"),
+)
+
+GROUPS = (
+    (r"hourly|(?:per|by|each|every) hour", "hour"),
+    (r"daily|(?:per|by|each|every) day", "day"),
+)
+
+ALL_ROOMS = r"(?:in |for |across )?(?:all(?: the)?|each|every|per|by) rooms?"
+# Punctuation is gone by the time this runs, so "rooms 1, 2 and 3" reads "rooms 1 2 and 3"
+ROOM_LIST = r"(?:in |for )?rooms? (\d+(?:(?: and| &| or)? (?:room )?\d+)*)"
+
+CROSSINGS = (
+    (r"(?:exceed|exceeds|exceeded|(?:go|goes|went|gone|get|got|rise|rose|climb|climbed|be|been)? ?"
+     r"(?:above|over|higher than|more than|greater than))", "above"),
+    (r"(?:(?:drop|drops|dropped|fall|falls|fell|go|goes|went|gone|get|got|be|been)? ?"
+     r"(?:below|under|lower than|less than))", "below"),
+)
+LIMIT = r"(\d+(?:\.\d+)?) ?(?:ppm|percent|degrees?(?: c| celsius)?|c)?"
+
+ALERT_KINDS = (
+    (r"alerts?|alarms?|warnings?", None),
+    (r"anomal(?:y|ies|ous)|unusual|abnormal|outliers?", "zscore"),
+    (r"(?:rapid|sudden|fast)(?:ly)?(?: rises?| rising| changes?| increases?| jumps?)?", "rate"),
+    (r"threshold breach(?:es)?|breach(?:es|ed)?", "threshold"),
+)
+
+# Words that may be left over once every slot has been taken out. Anything
+# else means the question says something the router does not understand.
+FILLER = {
+    "a", "all", "an", "and", "are", "at", "by", "can", "data", "during", "for", "from", "get", "give",
+    "had", "has", "have", "in", "is", "level", "levels", "list", "me", "of", "on", "please", "reading",
+    "readings", "recorded", "show", "tell", "the", "there", "value", "values", "was", "were", "what",
+    "whats", "with", "you",
+}
+# "how many readings were above ..." counts readings, which the event table can't answer
+ALERT_FILLER = (FILLER - {"reading", "readings", "recorded"}) | {
+    "any", "anywhere", "at", "been", "did", "do", "does", "ever", "fire", "fired", "happen", "happened",
+    "point", "room", "rooms", "triggered", "when", "where", "which",
+}
+
+
+def _take(patterns, text):
+    """Remove every match of the (pattern, value) table from text, returning the values found"""
+    found = []
+    for pattern, value in patterns:
+        regex = re.compile(rf"\b(?:{pattern})\b")
+        for match in regex.finditer(text):
+            found.append((value, match.groups()))
+        text = regex.sub(" ", text)
+    return found, " ".join(text.split())
+
+
+def _take_rooms(text):
+    """Remove the rooms a question names, returning them (None for every room)"""
+    rooms = None
+    for match in re.finditer(rf"\b{ROOM_LIST}\b", text):
+        rooms = (rooms or ()) + tuple(f"Room {number}" for number in re.findall(r"\d+", match.group(1)))
+    text = re.sub(rf"\b{ROOM_LIST}\b", " ", text)
+    return rooms, re.sub(rf"\b{ALL_ROOMS}\b", " ", text)
+
+
+@lru_cache(maxsize=4096)
+def _parse(text):
+    windows, text = _take(WINDOWS, text)
+    groups, text = _take(GROUPS, text)
+    if len(windows) > 1 or len(groups) > 1:
+        return None
+
+    rank = None
+    text, ranked = re.subn(r"\bwhich rooms? (?:had|has|have|was|is|were|saw)?\b", " ", text)
+    if ranked:
+        direction = re.search(r"\b(highest|lowest|most|least|max|min|maximum|minimum)\b", text)
+        if direction is None:
+            return None
+        rank = "highest" if direction.group(1) in ("highest", "most", "max", "maximum") else "lowest"
+        text = text[:direction.start()] + " " + text[direction.end():]
+
+    rooms, text = _take_rooms(text)
+    metrics, text = _take(METRICS, text)
+    metrics = {metric for metric, _ in metrics}
+    percentiles, text = _take([(r"(\d{1,2})(?:st|nd|rd|th)? percentile|p(\d{1,2})", "percentile")], text)
+    stats, text = _take(STATS, text)
+    stats = [stat for stat, _ in stats] + [f"p{a or b}" for _, (a, b) in percentiles]
+    stats = list(dict.fromkeys(stats))
+
+    if set(text.split()) - FILLER or len(metrics) > 1:
+        return None
+    if not metrics and stats != ["count"]:
+        return None
+    if not stats and not (groups or rank):
+        # "show me the co2 readings" asks for rows, not an average
+        return None
+    if rank and (len(stats) > 1 or groups or rooms):
+        return None
+    if groups and any(QUANTILE_STATS.match(stat) for stat in stats):
+        return None
+
+    window = (windows[0][0], *windows[0][1]) if windows else ("all",)
+    return Intent(
+        metric=metrics.pop() if metrics else None,
+        stats=tuple(stats or ["mean"]),
+        rooms=rooms,
+        window=window,
+        group=groups[0][0] if groups else None,
+        rank=rank,
+    )
+
+
+def _threshold_rule(metric, op, limit):
+    """The alert rule that fires when metric goes op limit, if there is one"""
+    for rule in ALERT_RULES:
+        if (rule.kind, rule.metric, rule.op, float(rule.limit)) == ("threshold", metric, op, limit):
+            return rule
+    return None
+
+
+@lru_cache(maxsize=4096)
+def _parse_alert(text):
+    text, count = re.subn(r"\bhow (?:many times|many|often)\b", " ", text)
+    windows, text = _take(WINDOWS, text)
+    if len(windows) > 1:
+        return None
+    rooms, text = _take_rooms(text)
+    metrics, text = _take(METRICS, text)
+    metrics = {metric for metric, _ in metrics}
+    crossings, text = _take([(rf"{pattern} {LIMIT}", op) for pattern, op in CROSSINGS], text)
+    kinds, text = _take(ALERT_KINDS, text)
+    kinds = {kind for kind, _ in kinds}
+
+    if set(text.split()) - ALERT_FILLER or len(metrics) > 1 or len(crossings) > 1 or len(kinds) > 1:
+        return None
+    if not crossings and not kinds:
+        return None
+    if crossings and (not metrics or kinds - {None}):
+        return None
+    metric = metrics.pop() if metrics else None
+
+    op, (limit,) = crossings[0] if crossings else (None, (None,))
+    limit = float(limit) if limit is not None else None
+    if count and op and _threshold_rule(metric, op, limit) is None:
+        # Counting crossings of an arbitrary limit needs the readings
+        return None
+    return AlertIntent(
+        metric=metric,
+        op=op,
+        limit=limit,
+        kind=kinds.pop() if kinds else None,
+        rooms=rooms,
+        window=(windows[0][0], *windows[0][1]) if windows else ("all",),
+        count=bool(count),
+    )
+
+
+def match_query(query):
+    """Parse a templated question into an Intent or AlertIntent, or None to leave it to the LLM"""
+    text = normalize_query(query).replace("'s", "").replace("’s", "")
+    # Decimal points survive so "above 27.5" keeps its limit
+    text = re.sub(r"(?!(?<=\d)\.\d)[^\w\s&₂]", " ", text)
+    return _parse(text) or _parse_alert(text)
+
+
+def _resolve_window(window, now):
+    """[start, end) of a window, either bound None when open, plus how to say it"""
+    today = now.floor("D")
+    kind = window[0]
+    if kind == "today":
+        return today, None, "today"
+    if kind == "yesterday":
+        return today - pd.Timedelta(days=1), today, "yesterday"
+    if kind == "this_week":
+        return today - pd.Timedelta(days=today.weekday()), None, "this week"
+    if kind == "this_month":
+        return today.replace(day=1), None, "this month"
+    if kind == "last_month":
+        end = today.replace(day=1)
+        return (end - pd.Timedelta(days=1)).replace(day=1), end, "last month"
+    if kind == "rolling":
+        if len(window) == 3:
+            count, unit = int(window[1]), window[2]
+        else:
+            count, unit = 1, window[1]
+        label = f"in the last {unit}" if count == 1 else f"in the last {count} {unit}s"
+        return now - pd.Timedelta(**{f"{unit}s": count}), None, label
+    return None, None, ""
+
+
+def _stat_name(stat):
+    return STAT_NAMES.get(stat) or f"{stat[1:]}th Percentile"
+
+
+def _stat_column(stat, metric):
+    metric_title = METRIC_NAMES[metric].upper() if metric == "co2" else (metric or "").capitalize()
+    if stat == "count":
+        return f"{metric_title} Readings".strip()
+    return f"{_stat_name(stat)} {metric_title}"
+
+
+def _readings_stats(snapshot, metric, stats, start, end, rooms):
+    """Per-room quantiles and counts computed from the raw readings in [start, end)"""
+    rows = load_range(snapshot.readings, snapshot.hot_start, start, end, rooms)
+    grouped = rows.groupby('room', observed=True)
+
+    columns = {}
+    for stat in stats:
+        if stat == "count":
+            columns[stat] = grouped[metric].count() if metric else grouped.size()
+        else:
+            q = 0.5 if stat == "median" else int(stat[1:]) / 100
+            columns[stat] = grouped[metric].quantile(q)
+    return pd.DataFrame(columns).rename_axis("Room").reset_index()
+
+
+def _summary(intent, snapshot, start, end):
+    rooms = list(intent.rooms) if intent.rooms else None
+    metric = intent.metric
+    exact = [stat for stat in intent.stats if QUANTILE_STATS.match(stat) or (stat == "count" and not metric)]
+    rolled = [stat for stat in intent.stats if stat not in exact]
+
+    labels = list(snapshot.readings['room'].cat.categories)
+    table = pd.DataFrame({"Room": labels if rooms is None else [room for room in rooms if room in labels]})
+    if rolled:
+        rolled_table = RollupIndex(snapshot.rollups).summary(metric, start, end, rooms, stats=rolled)
+        table = table.merge(rolled_table.rename(columns=dict(zip(rolled_table.columns[1:], rolled))), on="Room", how="left")
+    if exact:
+        exact_table = _readings_stats(snapshot, metric, exact, start, end, rooms)
+        exact_table["Room"] = exact_table["Room"].astype(str)
+        table = table.merge(exact_table, on="Room", how="left")
+    if "count" in table.columns:
+        table["count"] = table["count"].fillna(0).astype(np.int64)
+    return table[["Room", *intent.stats]]
+
+
+def _format_value(value, stat, metric):
+    if stat == "count":
+        return f"{int(value)}"
+    return f"{value:.2f}{UNITS[metric]}"
+
+
+def _dataframe_output(df):
+    return dataframe_output(df.astype({column: np.float64 for column in df.columns[df.dtypes == np.float32]}).round(2))
+
+
+def _text_output(text):
+    return {"success": True, "type": "text", "data": re.sub(r"\s+([:.])", r"\1", " ".join(text.split()))}
+
+
+def _alert_events(snapshot, start, end, rooms):
+    """Events of the snapshot's alert table that overlap [start, end) in the given rooms"""
+    events = snapshot.alerts if snapshot.alerts is not None else empty_events()
+    # Sorted by start, so the end of the window is a binary search
+    if end is not None:
+        events = events.iloc[:events.index.searchsorted(end)]
+    if start is not None:
+        events = events[events['end'] >= start]
+    if rooms:
+        events = events[events['room'].isin(rooms)]
+    return events
+
+
+def _event_table(events, peak_column="Peak", with_rule=True):
+    def times(values):
+        return values.dt.strftime("%Y-%m-%d %H:%M").to_numpy()
+
+    table = pd.DataFrame({
+        "Room": events['room'].astype(str).to_numpy(),
+        "Alert": events['rule'].astype(str).to_numpy(),
+        "Start": times(events.index.to_series()),
+        "End": np.where(events['active'], "ongoing", times(events['end'])),
+        peak_column: events['peak'].to_numpy(),
+        "Readings": events['readings'].to_numpy(),
+    })
+    return _dataframe_output(table if with_rule else table.drop(columns="Alert"))
+
+
+def _event_counts(events, snapshot, rooms, column):
+    """Events per room, rooms without any included"""
+    labels = list(rooms or snapshot.readings['room'].cat.categories)
+    counts = events['room'].astype(str).value_counts()
+    table = pd.DataFrame({"Room": labels, column: [int(counts.get(label, 0)) for label in labels]})
+    return _dataframe_output(table)
+
+
+def _hourly_extremes(snapshot, metric, stat, start, end, rooms):
+    """Per-room hourly max or min of a metric in [start, end), as Room, Time and value columns.
+
+    Whole hours come from the hourly rollups. Rollup buckets would reach back
+    to the start of the hour, so the partial hours at either end of the range
+    are computed from the readings themselves.
+    """
+    rooms = list(rooms) if rooms else None
+    first = start if start is None else start.ceil("h")
+    last = end if end is None else end.floor("h")
+    parts = []
+    if first is None or last is None or first < last:
+        series = RollupIndex(snapshot.rollups).series(metric, "hour", first, last, rooms, stats=(stat,))
+        parts.append(series.set_axis(["Room", "Time", "Value"], axis=1))
+    else:
+        # The whole range lies within one hour
+        first = last = end
+    for edge_start, edge_end in ((start, first), (last, end)):
+        if edge_start is None or edge_end is None or edge_start >= edge_end:
+            continue
+        rows = load_range(snapshot.readings, snapshot.hot_start, edge_start, edge_end, rooms)
+        values = rows.groupby(['room', rows.index.floor("h")], observed=True)[metric].agg(stat).dropna()
+        parts.append(pd.DataFrame({
+            "Room": values.index.get_level_values(0).astype(str),
+            "Time": values.index.get_level_values(1),
+            "Value": values.to_numpy(np.float64),
+        }))
+    extremes = pd.concat(parts, ignore_index=True)
+    order = {label: code for code, label in enumerate(snapshot.readings['room'].cat.categories)}
+    return extremes.sort_values(["Room", "Time"], key=lambda column: column.map(order) if column.name == "Room" else column)
+
+
+def _crossing_answer(intent, snapshot, start, end, when):
+    """Whether a metric went above or below a limit: a lookup in the alert events when a
+    threshold rule matches the question, otherwise in the hourly rollups"""
+    stat = "max" if intent.op == "above" else "min"
+    peak_column = _stat_column(stat, intent.metric)
+    limit = f"{intent.limit:g}{UNITS[intent.metric]}"
+    rule = _threshold_rule(intent.metric, intent.op, intent.limit)
+
+    if rule is not None:
+        events = _alert_events(snapshot, start, end, intent.rooms)
+        events = events[events['rule'] == rule.name]
+        if intent.count:
+            if intent.rooms and len(intent.rooms) == 1:
+                times = "once" if len(events) == 1 else f"{len(events)} times"
+                return _text_output(f"{METRIC_NAMES[intent.metric]} went {intent.op} {limit} {times} in {intent.rooms[0]} {when}.")
+            return _event_counts(events, snapshot, intent.rooms, f"Times {intent.op.capitalize()} {limit}")
+        if len(events):
+            return _event_table(events, peak_column, with_rule=False)
+    else:
+        series = _hourly_extremes(snapshot, intent.metric, stat, start, end, intent.rooms)
+        values = series["Value"]
+        crossed = series[values > intent.limit if intent.op == "above" else values < intent.limit]
+        if len(crossed):
+            crossed = crossed.reset_index(drop=True)
+            crossed["Time"] = crossed["Time"].dt.strftime("%Y-%m-%d %H:00")
+            crossed.columns = ["Room", "Hour", peak_column]
+            return _dataframe_output(crossed)
+
+    where = f"in {', '.join(intent.rooms)}" if intent.rooms else "in every room"
+    stayed = "at or below" if intent.op == "above" else "at or above"
+    return _text_output(
+        f"No, {METRIC_NAMES[intent.metric]} stayed {stayed} {limit} {where} {when}."
+    )
+
+
+def _alert_answer(intent, snapshot, start, end, when):
+    if intent.op is not None:
+        return _crossing_answer(intent, snapshot, start, end, when)
+    events = _alert_events(snapshot, start, end, intent.rooms)
+    if intent.metric:
+        events = events[events['metric'] == intent.metric]
+    if intent.kind:
+        events = events[events['kind'] == intent.kind]
+    if intent.count:
+        return _event_counts(events, snapshot, intent.rooms, "Alerts")
+    if not len(events):
+        where = f"in {', '.join(intent.rooms)}" if intent.rooms else ""
+        return _text_output(f"No alerts fired {where} {when}.")
+    return _event_table(events)
+
+
+def run_intent(intent, snapshot, now=None):
+    """Answer a parsed question from the snapshot's rollups, readings and alert events"""
+    now = (now or pd.Timestamp.now(tz="UTC")).floor("min")
+    start, end, when = _resolve_window(intent.window, now)
+    metric_name = METRIC_NAMES.get(intent.metric, "")
+
+    labels = set(snapshot.readings['room'].cat.categories)
+    missing = [room for room in intent.rooms or () if room not in labels]
+    if missing:
+        return _text_output(f"There is no data for {', '.join(missing)}.")
+    if isinstance(intent, AlertIntent):
+        return _alert_answer(intent, snapshot, start, end, when)
+
+    if intent.group:
+        series = RollupIndex(snapshot.rollups).series(
+            intent.metric, intent.group, start, end, list(intent.rooms) if intent.rooms else None, stats=intent.stats
+        )
+        if series.empty:
+            return _text_output(f"No {metric_name} readings {when}.")
+        order = pd.Categorical(series["Room"], categories=snapshot.readings['room'].cat.categories)
+        series = series.iloc[np.lexsort((series["Time"].to_numpy(), order.codes))].reset_index(drop=True)
+        series["Time"] = series["Time"].dt.strftime("%Y-%m-%d %H:%M" if intent.group == "hour" else "%Y-%m-%d")
+        series.columns = ["Room", "Time", *(_stat_column(stat, intent.metric) for stat in intent.stats)]
+        return _dataframe_output(series)
+
+    table = _summary(intent, snapshot, start, end)
+    values = table[list(intent.stats)]
+    has_data = values.notna().all(axis=1) & (values.get("count", 1) != 0)
+    if not has_data.any():
+        where = f"in {', '.join(intent.rooms)}" if intent.rooms else ""
+        return _text_output(f"No {metric_name} readings {where} {when}.")
+
+    if intent.rank:
+        stat = intent.stats[0]
+        ranked = table[has_data].sort_values(stat, ascending=intent.rank == "lowest", kind="stable")
+        best = ranked.iloc[0]
+        described = f"{_stat_name(stat).lower()} {metric_name}"
+        return _text_output(
+            f"{best['Room']} had the {intent.rank} {described} {when}: {_format_value(best[stat], stat, intent.metric)}."
+        )
+
+    if len(table) == 1 and len(intent.stats) == 1:
+        stat = intent.stats[0]
+        row = table.iloc[0]
+        if stat == "count":
+            return _text_output(f"{row['Room']} recorded {int(row[stat])} {metric_name} readings {when}.")
+        return _text_output(
+            f"The {_stat_name(stat).lower()} {metric_name} in {row['Room']} {when} was "
+            f"{_format_value(row[stat], stat, intent.metric)}."
+        )
+
+    table.columns = ["Room", *(_stat_column(stat, intent.metric) for stat in intent.stats)]
+    return _dataframe_output(table)
+
@@ -0,0 +1,229 @@
+import os
+import queue
+import shutil
+import asyncio
+import resource
+import tempfile
+import contextvars
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from logging_config import setup_logger
+from data_cache import read_frame
+from agent_utils import execute_user_code
+from data_store import load_range
+from rollups import RollupIndex, RoomRollups
+from tracing import capture, record_span, span
+from shared_data import SHARED_DATA_DIR, DataPublisher, read_alerts
+
+logger = setup_logger(__name__)
+
+# uvicorn --workers reads WEB_CONCURRENCY too; each server process gets its share of the CPUs
+EXEC_WORKERS = int(os.getenv("EXEC_WORKERS", str(max(1, (os.cpu_count() or 2) // int(os.getenv("WEB_CONCURRENCY", "1"))))))
+EXEC_TIMEOUT = float(os.getenv("EXEC_TIMEOUT", "30"))
+EXEC_CPU_SECONDS = int(os.getenv("EXEC_CPU_SECONDS", "20"))
+EXEC_MEMORY_MB = int(os.getenv("EXEC_MEMORY_MB", "2048"))
+EXEC_MAX_TASKS = int(os.getenv("EXEC_MAX_TASKS", "100"))
+EXECUTION_FAILED = {
+    "success": False,
+    "data": "Sorry I have encountered an error while processing your request. Please try again"
+}
+EXECUTION_TIMED_OUT = {
+    "success": False,
+    "type": "text",
+    "data": "Sorry, answering that question took too long. Please try a narrower question."
+}
+
+
+def _set_memory_limit(memory_mb):
+    # RLIMIT_DATA covers heap and private mappings but not the shared,
+    # read-only room data mapped from SHARED_DATA_DIR.
+    if memory_mb > 0:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+def _set_cpu_budget(cpu_seconds):
+    """Allow this process cpu_seconds more CPU time before SIGXCPU kills it"""
+    if cpu_seconds <= 0:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + cpu_seconds + 1
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _attach(manifest, attached):
+    """Map the published readings, rollups and alerts read-only, reusing ones already mapped"""
+    if manifest["readings"] not in attached:
+        readings = read_frame(manifest["readings"])[0]
+        if readings is None:
+            raise FileNotFoundError(f"Published readings missing: {manifest['readings']}")
+        attached[manifest["readings"]] = readings
+    rollups = {}
+    for room, path in manifest["rollups"].items():
+        if path not in attached:
+            attached[path] = RoomRollups.load(path)
+        rollups[room] = attached[path]
+    # Keyed None when no alerts were published, which holds an empty table
+    alerts_path = manifest.get("alerts")
+    if alerts_path not in attached:
+        attached[alerts_path] = read_alerts(manifest)
+
+    live = {manifest["readings"], alerts_path} | set(manifest["rollups"].values())
+    for path in set(attached) - live:
+        del attached[path]
+    readings = attached[manifest["readings"]]
+    helpers = {
+        "rollups": RollupIndex(rollups),
+        "load_range": partial(load_range, readings, manifest.get("hot_start")),
+    }
+    return {"readings": readings, "alerts": attached[alerts_path]}, helpers
+
+
+def _worker_main(conn, max_tasks, cpu_seconds, memory_mb):
+    # With copy-on-write a shallow copy of a mapped frame is enough to keep
+    # one task's modifications away from the next.
+    pd.set_option("mode.copy_on_write", True)
+    _set_memory_limit(memory_mb)
+
+    attached = {}
+    for _ in range(max_tasks):
+        try:
+            code, manifest = conn.recv()
+        except EOFError:
+            return
+        _set_cpu_budget(cpu_seconds)
+        # Spans are sent back with the output and recorded in the server process
+        with capture() as task:
+            try:
+                with span("attach"):
+                    datasets, helpers = _attach(manifest, attached)
+                output = execute_user_code(code, datasets, helpers)
+            except MemoryError:
+                output = EXECUTION_FAILED
+            except Exception as e:
+                # e.g. the files of a data version that is no longer published
+                logger.error(f"Could not attach data version {manifest.get('version')}: {e}")
+                output = EXECUTION_FAILED
+        conn.send((output, task.spans))
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, ctx, max_tasks, cpu_seconds, memory_mb):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(child_conn, max_tasks, cpu_seconds, memory_mb),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+
+    def kill(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.join()
+
+    def retire(self):
+        self.conn.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class SandboxPool:
+    """Pre-started worker processes that run generated code against shared room data.
+
+    The combined readings table and room rollups are published once per data
+    version as memory-mappable files under SHARED_DATA_DIR (or come already
+    published, see shared_data.SharedDataStore); workers map them read-only,
+    so nothing is copied per task. Each task gets a CPU-time budget
+    and a wall-clock timeout, workers have a memory cap, and a worker is
+    replaced after max_tasks tasks or as soon as it is killed for exceeding a
+    limit.
+    """
+
+    def __init__(self, size=EXEC_WORKERS, max_tasks=EXEC_MAX_TASKS, timeout=EXEC_TIMEOUT,
+                 cpu_seconds=EXEC_CPU_SECONDS, memory_mb=EXEC_MEMORY_MB, shared_dir=SHARED_DATA_DIR):
+        self.size = size
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.shared_dir = shared_dir
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._waiters = None
+        self._root = None
+        self._publisher = None
+
+    def _spawn(self):
+        return _Worker(self._ctx, self.max_tasks, self.cpu_seconds, self.memory_mb)
+
+    def start(self):
+        self._root = tempfile.mkdtemp(prefix="aq-sandbox-", dir=self.shared_dir)
+        self._publisher = DataPublisher(self._root)
+        self._waiters = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="sandbox")
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+        logger.info(f"Started {self.size} sandbox workers, data published under {self._root}")
+
+    def shutdown(self):
+        if self._waiters is not None:
+            self._waiters.shutdown(wait=False, cancel_futures=True)
+            self._waiters = None
+        while not self._idle.empty():
+            self._idle.get_nowait().kill()
+        if self._root:
+            shutil.rmtree(self._root, ignore_errors=True)
+            self._root = None
+
+    def publish(self, snapshot):
+        """Files of the snapshot's readings and rollups for the workers to map"""
+        if snapshot.shared is not None:
+            return snapshot.shared
+        return self._publisher.publish(snapshot)
+
+    def run(self, code, snapshot):
+        """Execute code in an idle worker, blocking until it answers or is killed"""
+        with span("publish"):
+            manifest = self.publish(snapshot)
+        with span("queue"):
+            worker = self._idle.get()
+        try:
+            worker.conn.send((code, manifest))
+            if not worker.conn.poll(self.timeout):
+                logger.error(f"Generated code exceeded the {self.timeout}s timeout, killing its worker")
+                worker.kill()
+                worker = self._spawn()
+                return EXECUTION_TIMED_OUT
+            output, spans = worker.conn.recv()
+            for name, seconds, attrs in spans:
+                record_span(name, seconds, **attrs)
+
+            worker.tasks += 1
+            if worker.tasks >= self.max_tasks:
+                # The worker exits by itself after max_tasks tasks
+                worker.retire()
+                worker = self._spawn()
+            return output
+        except (EOFError, OSError):
+            worker.kill()
+            logger.error(f"Sandbox worker exited with code {worker.process.exitcode} (CPU or memory limit?)")
+            worker = self._spawn()
+            return EXECUTION_FAILED
+        finally:
+            self._idle.put(worker)
+
+    async def run_async(self, code, snapshot):
+        loop = asyncio.get_running_loop()
+        # Run in a copy of this context so spans land in the caller's trace
+        context = contextvars.copy_context()
+        with span("sandbox"):
+            return await loop.run_in_executor(self._waiters, context.run, self.run, code, snapshot)
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from logging_config import setup_logger
+from alerts import empty_events
+from data_cache import read_frame, write_frame
+from data_store import DATA_WATCH_INTERVAL, DataStore, Snapshot, build_readings
+from rollups import RoomRollups
+
+logger = setup_logger(__name__)
+
+# /dev/shm is RAM-backed, so mapping from it never touches disk
+SHARED_DATA_DIR = os.getenv("SHARED_DATA_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# Where the loader publishes room data for every worker process in multi-worker mode
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", os.path.join(SHARED_DATA_DIR, "aq-shared"))
+# How long a worker waits at startup for the loader's first snapshot
+SHARED_LOAD_TIMEOUT = float(os.getenv("SHARED_LOAD_TIMEOUT", "120"))
+
+# Published data versions kept on disk so in-flight tasks can still map them
+SHARED_GENERATIONS = 2
+
+_DATA_PREFIXES = ("readings-", "rollups-", "alerts-")
+# Subdirectory of a publisher's root holding one file per lease()
+_LEASE_DIR = "leases"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+@contextmanager
+def lease(manifest):
+    """Keep a published manifest's files on disk until the block exits, even once newer versions replace it.
+
+    The lease is a file next to the data, so it holds across processes; ones
+    left behind by a process that died are ignored.
+    """
+    lease_dir = os.path.join(os.path.dirname(manifest["readings"]), _LEASE_DIR)
+    os.makedirs(lease_dir, exist_ok=True)
+    path = os.path.join(lease_dir, f"{os.getpid()}-{uuid.uuid4().hex}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+    try:
+        yield manifest
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _leased_manifests(root):
+    """Manifests under lease in root, removing leases of processes that have exited"""
+    lease_dir = os.path.join(root, _LEASE_DIR)
+    try:
+        names = os.listdir(lease_dir)
+    except FileNotFoundError:
+        return []
+    manifests = []
+    for name in names:
+        path = os.path.join(lease_dir, name)
+        if not name.endswith(".json"):
+            continue
+        if not _pid_alive(int(name.split("-")[0])):
+            logger.info(f"Dropping lease {name} of an exited process")
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                manifests.append(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Released while we were reading it
+            continue
+    return manifests
+
+
+class DataPublisher:
+    """Writes snapshots' readings, rollups and alert events under root as memory-mappable files.
+
+    Files are reused while the frame or rollups object behind them is
+    unchanged. Only the last SHARED_GENERATIONS snapshots' files are kept,
+    plus those of any snapshot still under lease().
+    """
+
+    def __init__(self, root, generations=SHARED_GENERATIONS):
+        self.root = root
+        self._sequence = 0
+        self._published = {}
+        self._manifests = deque(maxlen=generations)
+        self._lock = threading.Lock()
+
+    def _publish_one(self, key, value, write):
+        previous = self._published.get(key)
+        if previous is not None and previous[0] is value:
+            return previous[1]
+        self._sequence += 1
+        # The pid keeps names unique when another process took over the directory
+        path = os.path.join(self.root, f"{key[0]}-{os.getpid()}-{self._sequence}")
+        if write(path, value) is False:
+            return None
+        self._published[key] = (value, path)
+        return path
+
+    def keep(self, manifest):
+        """Treat an already published manifest as one of the kept generations"""
+        with self._lock:
+            self._manifests.append((manifest["version"], manifest))
+
+    def publish(self, snapshot, version=None):
+        """The manifest {"version", "readings", "rollups": {room: path}, "alerts", "hot_start"} of a snapshot's files"""
+        version = snapshot.version if version is None else version
+        with self._lock:
+            leased = _leased_manifests(self.root)
+            for manifest in [manifest for _, manifest in self._manifests] + leased:
+                if manifest["version"] == version:
+                    return manifest
+
+            manifest = {
+                "version": version,
+                "readings": self._publish_one(("readings",), snapshot.readings, write_frame),
+                "rollups": {},
+                "alerts": None,
+                "hot_start": snapshot.hot_start,
+            }
+            for room, room_rollups in snapshot.rollups.items():
+                path = self._publish_one(("rollups", room), room_rollups, lambda path, value: value.save(path))
+                if path:
+                    manifest["rollups"][room] = path
+            if snapshot.alerts is not None:
+                manifest["alerts"] = self._publish_one(("alerts",), snapshot.alerts, write_frame)
+            self._manifests.append((version, manifest))
+
+            live = set()
+            for kept in [manifest for _, manifest in self._manifests] + leased:
+                live.add(kept["readings"])
+                live.update(kept["rollups"].values())
+                live.add(kept.get("alerts"))
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.startswith(_DATA_PREFIXES) and path not in live:
+                    shutil.rmtree(path, ignore_errors=True)
+            self._published = {key: entry for key, entry in self._published.items() if entry[1] in live}
+            return manifest
+
+
+def read_alerts(manifest):
+    """The published alert events of a manifest, or an empty table if there are none"""
+    alerts = read_frame(manifest["alerts"])[0] if manifest.get("alerts") else None
+    return empty_events() if alerts is None else alerts
+
+
+def attach_snapshot(manifest):
+    """A Snapshot whose readings, rollups and alerts are mapped read-only from a manifest's files"""
+    readings, _ = read_frame(manifest["readings"])
+    if readings is None:
+        raise FileNotFoundError(f"Published readings missing: {manifest['readings']}")
+    rollups = {room: RoomRollups.load(path) for room, path in manifest["rollups"].items()}
+    return Snapshot(manifest["version"], rollups, readings, manifest, manifest.get("hot_start"), read_alerts(manifest))
+
+
+class SharedDataStore:
+    """Room data loaded once and mapped by every worker process of a multi-worker deployment.
+
+    Whichever process holds root/loader.lock runs the DataStore that follows
+    the NDJSON files, and publishes each new snapshot under root with a
+    manifest.json naming its files. Every process, the loader included,
+    answers queries from the files the manifest names, so the readings sit in
+    memory once however many workers there are. When the loader exits,
+    another process takes the lock over on its next poll. Snapshots carry
+    their manifest, so the sandbox workers map the same files.
+    """
+
+    def __init__(self, data_dir, root=SHARED_STATE_DIR):
+        self.data_dir = data_dir
+        self.root = root
+        self._snapshot = Snapshot(0, {}, build_readings({}), alerts=empty_events())
+        self._source = None
+        self._publisher = None
+        self._version = 0
+        self._lock_file = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def rollups(self):
+        return self._snapshot.rollups
+
+    @property
+    def readings(self):
+        return self._snapshot.readings
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def is_loader(self):
+        return self._source is not None
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.root, "manifest.json")
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _try_lead(self):
+        """Become the loader if no other process is; returns whether this process is it"""
+        if self._source is not None:
+            return True
+        os.makedirs(self.root, exist_ok=True)
+        lock_file = open(os.path.join(self.root, "loader.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        self._source = DataStore(self.data_dir)
+        self._publisher = DataPublisher(self.root)
+        current = self._read_manifest()
+        if current is not None:
+            # Keep the previous loader's files until our own snapshots replace them
+            self._version = current["version"]
+            self._publisher.keep(current)
+        logger.info(f"Process {os.getpid()} is the data loader for {self.root}")
+        return True
+
+    def _publish(self):
+        if not self._source.refresh():
+            return
+        self._version += 1
+        manifest = dict(self._publisher.publish(self._source.snapshot(), self._version), loader=os.getpid())
+        tmp_path = f"{self._manifest_path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+        logger.info(f"Published data version {self._version} under {self.root}")
+
+    def _attach(self):
+        manifest = self._read_manifest()
+        if manifest is None or manifest["version"] == self._snapshot.version:
+            return False
+        self._snapshot = attach_snapshot(manifest)
+        logger.info(f"Attached data version {manifest['version']} ({len(self._snapshot.readings)} readings)")
+        return True
+
+    def refresh(self):
+        """Publish new readings if this process is the loader, then map the latest snapshot.
+
+        Until a first snapshot is available this waits for the loader, for up
+        to SHARED_LOAD_TIMEOUT seconds.
+        """
+        deadline = time.monotonic() + SHARED_LOAD_TIMEOUT
+        with self._refresh_lock:
+            while True:
+                if self._try_lead():
+                    self._publish()
+                changed = self._attach()
+                if self._snapshot.version or time.monotonic() >= deadline:
+                    return changed
+                time.sleep(0.2)
+
+    def _watch(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Shared data refresh failed: {e}")
+
+    def start_watcher(self, interval=DATA_WATCH_INTERVAL):
+        """Poll for new readings (as the loader) or new snapshots (as a worker)"""
+        if interval <= 0 or self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="data-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher is not None:
+            self._stop.set()
+            self._watcher.join()
+            self._watcher = None
+        if self._lock_file is not None:
+            # Let another worker take over loading
+            self._lock_file.close()
+            self._lock_file = None
+            self._source = None
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The backend reads its cache locations at import time, so point them at a
+# scratch directory before any test imports it
+_CACHE_DIR = tempfile.mkdtemp(prefix="aq-tests-")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["DATA_CACHE_DIR"] = _CACHE_DIR
+os.environ["PARTITION_DIR"] = os.path.join(_CACHE_DIR, "partitions")
+os.environ["CODE_CACHE_FILE"] = os.path.join(_CACHE_DIR, "generated_code.json")
+os.environ["SHARED_CACHE_DB"] = os.path.join(_CACHE_DIR, "shared_cache.sqlite")
+os.environ["SLOW_QUERY_LOG"] = os.path.join(_CACHE_DIR, "slow_queries.log")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+@pytest.fixture
+def readings_frame():
+    """Two weeks of minute readings with spikes, as read_ndjson returns them"""
+    rng = np.random.default_rng(42)
+    n = 14 * 24 * 60
+    times = pd.date_range("2024-03-01", periods=n, freq="min", tz="UTC")
+    co2 = 600 + 150 * np.sin(np.arange(n) / 240) + rng.normal(0, 20, n)
+    co2[rng.integers(0, n, 40)] += rng.uniform(400, 1500, 40)
+    temperature = 21 + 3 * np.sin(np.arange(n) / 720) + rng.normal(0, 0.5, n)
+    humidity = 45 + 12 * np.sin(np.arange(n) / 1000) + rng.normal(0, 2, n)
+    humidity[rng.integers(0, n, 200)] = np.nan
+    return pd.DataFrame({
+        "timestamp": times,
+        "co2": co2.astype(np.float32),
+        "temperature": temperature.astype(np.float32),
+        "humidity": humidity.astype(np.float32),
+    })
@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from alerts import DEFAULT_RULES, AlertEngine
+
+
+def _split(df, sizes):
+    bounds = np.cumsum([0, *sizes])
+    return [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])] + [df.iloc[bounds[-1]:]]
+
+
+@pytest.mark.parametrize("sizes", [(1,), (7, 1, 300), (5000, 5000), (60,) * 50])
+def test_incremental_evaluation_matches_one_shot(readings_frame, sizes):
+    one_shot = AlertEngine(DEFAULT_RULES)
+    one_shot.evaluate("sensor_data_Room 1", readings_frame)
+
+    incremental = AlertEngine(DEFAULT_RULES)
+    for chunk in _split(readings_frame, sizes):
+        incremental.evaluate("sensor_data_Room 1", chunk)
+
+    expected = one_shot.events()
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(incremental.events(), expected)
+
+
+def test_reset_starts_over(readings_frame):
+    engine = AlertEngine(DEFAULT_RULES)
+    engine.evaluate("sensor_data_Room 1", readings_frame.iloc[:1000])
+    engine.evaluate("sensor_data_Room 1", readings_frame, reset=True)
+
+    one_shot = AlertEngine(DEFAULT_RULES)
+    one_shot.evaluate("sensor_data_Room 1", readings_frame)
+    pd.testing.assert_frame_equal(engine.events(), one_shot.events())
+
+
+def test_rooms_are_independent(readings_frame):
+    engine = AlertEngine(DEFAULT_RULES)
+    engine.evaluate("sensor_data_Room 1", readings_frame)
+    engine.evaluate("sensor_data_Room 2", readings_frame.iloc[:100])
+
+    alone = AlertEngine(DEFAULT_RULES)
+    alone.evaluate("sensor_data_Room 1", readings_frame)
+    events = engine.events()
+    expected = alone.events()
+    pd.testing.assert_frame_equal(events[events["room"] == "Room 1"], expected[expected["room"] == "Room 1"], check_categorical=False)
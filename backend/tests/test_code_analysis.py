@@ -0,0 +1,72 @@
+import pandas as pd
+import pytest
+
+from code_analysis import SAFE_BUILTINS, CodeRejected, compile_code, review_code
+
+
+def run(code, **env):
+    exec(compile_code(code), {"__builtins__": SAFE_BUILTINS}, env)
+    return env
+
+
+@pytest.mark.parametrize("code", [
+    "__builtins__['__import__']('os').getcwd()",
+    "result = pd.io.common.os.getcwd()",
+    "result = pd.read_csv('/etc/passwd')",
+    "readings.to_csv('/tmp/out.csv')",
+    "g = (x for x in [1])\nresult = g.gi_frame.f_globals",
+    # Renaming on import must not get around the attribute checks
+    "from pandas.io.common import os as o\nresult = o.getcwd()",
+    "from numpy.lib._datasource import os as q\nresult = q.listdir('/')",
+    "from pandas import read_csv as r\nresult = r('/etc/hostname')",
+    "import pandas.io.common as c",
+    "from pandas import *",
+    "from numpy import load",
+])
+def test_escapes_are_rejected(code):
+    _, problems = review_code(code)
+    assert problems
+    with pytest.raises(CodeRejected):
+        compile_code(code)
+
+
+def test_bare_file_function_call_is_rejected():
+    _, problems = review_code("result = read_csv('/etc/hostname')")
+    assert problems
+
+
+def test_runtime_hook_refuses_modules_reached_through_from_imports():
+    with pytest.raises(ImportError):
+        run("from pandas import io")
+    assert run("import pandas\nresult = pandas")["result"] is pd
+
+
+@pytest.mark.parametrize("name", ["open", "eval", "exec", "compile", "getattr"])
+def test_safe_builtins_leave_out_forbidden_calls(name):
+    assert name not in SAFE_BUILTINS
+
+
+def test_runtime_hook_refuses_submodules():
+    with pytest.raises(ImportError):
+        SAFE_BUILTINS["__import__"]("pandas.io.common", fromlist=("os",))
+    with pytest.raises(ImportError):
+        SAFE_BUILTINS["__import__"]("pandas", fromlist=("read_csv",))
+
+
+def test_allowed_code_runs():
+    code = (
+        "import numpy as np\n"
+        "from datetime import datetime, timedelta\n"
+        "from collections import Counter\n"
+        "from pandas.api.types import is_numeric_dtype\n"
+        "result = (readings.groupby('room')['co2'].apply(lambda s: s.mean()), is_numeric_dtype(readings['co2']))"
+    )
+    readings = pd.DataFrame({"room": ["Room 1", "Room 1", "Room 2"], "co2": [400.0, 600.0, 700.0]})
+    means, numeric = run(code, readings=readings)["result"]
+    assert means.to_dict() == {"Room 1": 500.0, "Room 2": 700.0}
+    assert numeric
+
+
+def test_per_reading_apply_is_rejected():
+    _, problems = review_code("result = readings['co2'].apply(lambda v: v * 2)")
+    assert problems
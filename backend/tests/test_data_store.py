@@ -0,0 +1,131 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from data_store import DataStore
+from partitions import PartitionStore
+from rollups import RoomRollups
+
+ROOM = "sensor_data_Room 1"
+
+
+def _line(minute, co2):
+    timestamp = pd.Timestamp("2024-03-01T00:00:00Z") + pd.Timedelta(minutes=minute)
+    return json.dumps({"timestamp": timestamp.isoformat(), "co2": co2, "temperature": 21.0, "humidity": 45.0}) + "\n"
+
+
+def _store(data_dir, root, partitioned):
+    store = DataStore(str(data_dir))
+    store.partitions = PartitionStore(str(root)) if partitioned else None
+    return store
+
+
+@pytest.fixture(params=[True, False], ids=["partitioned", "in-memory"])
+def partitioned(request):
+    return request.param
+
+
+@pytest.fixture
+def room_file(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    path = data_dir / f"{ROOM}.ndjson"
+    path.write_text("".join(_line(i, 500 + i) for i in range(100)))
+    return path
+
+
+def _assert_matches_fresh_load(store, path, root, partitioned):
+    fresh = _store(path.parent, root, partitioned)
+    fresh.refresh()
+    pd.testing.assert_frame_equal(store.readings, fresh.readings)
+    pd.testing.assert_frame_equal(store.snapshot().alerts, fresh.snapshot().alerts)
+    expected = RoomRollups.from_frame(fresh.readings.reset_index()).levels["hour"]
+    actual = store.rollups[ROOM].levels["hour"]
+    assert (actual.keys == expected.keys).all()
+    assert (actual.stats["co2"] == expected.stats["co2"]).all()
+
+
+def test_appended_partial_line_waits_for_its_newline(tmp_path, room_file, partitioned):
+    store = _store(room_file.parent, tmp_path / "partitions", partitioned)
+    assert store.refresh()
+    assert len(store.readings) == 100
+
+    line = _line(100, 1800)
+    with open(room_file, "a") as f:
+        f.write(_line(99.5, 700) + line[:25])
+    assert store.refresh()
+    assert len(store.readings) == 101
+
+    # Nothing new is complete yet
+    assert not store.refresh()
+
+    with open(room_file, "a") as f:
+        f.write(line[25:])
+    assert store.refresh()
+    assert len(store.readings) == 102
+    assert store.readings["co2"].iloc[-1] == 1800
+    assert store.readings.index.is_monotonic_increasing
+    _assert_matches_fresh_load(store, room_file, tmp_path / "fresh", partitioned)
+
+
+def test_truncated_file_is_reloaded(tmp_path, room_file, partitioned):
+    store = _store(room_file.parent, tmp_path / "partitions", partitioned)
+    store.refresh()
+    version = store.version
+
+    room_file.write_text("".join(_line(i, 900) for i in range(10)))
+    assert store.refresh()
+    assert store.version == version + 1
+    assert len(store.readings) == 10
+    assert (store.readings["co2"] == 900).all()
+    _assert_matches_fresh_load(store, room_file, tmp_path / "fresh", partitioned)
+
+
+def test_replaced_file_is_reloaded(tmp_path, room_file, partitioned):
+    store = _store(room_file.parent, tmp_path / "partitions", partitioned)
+    store.refresh()
+
+    # Same size, new inode: a log rotation rather than an append
+    replacement = room_file.with_suffix(".tmp")
+    replacement.write_text("".join(_line(i, 400 + i) for i in range(100)))
+    os.replace(replacement, room_file)
+    assert store.refresh()
+    assert store.readings["co2"].iloc[0] == 400
+    _assert_matches_fresh_load(store, room_file, tmp_path / "fresh", partitioned)
+
+
+def test_emptied_and_removed_files_drop_the_room(tmp_path, room_file, partitioned):
+    store = _store(room_file.parent, tmp_path / "partitions", partitioned)
+    store.refresh()
+
+    room_file.write_text("")
+    assert store.refresh()
+    assert ROOM not in store.rollups
+    assert store.readings.empty
+
+    room_file.write_text(_line(0, 500))
+    assert store.refresh()
+    assert len(store.readings) == 1
+
+    room_file.unlink()
+    assert store.refresh()
+    assert ROOM not in store.rollups
+    assert store.readings.empty
+
+
+def test_restart_from_partitions_matches_cold_load(tmp_path, room_file):
+    store = _store(room_file.parent, tmp_path / "partitions", True)
+    store.refresh()
+    with open(room_file, "a") as f:
+        f.write("".join(_line(i, 2500) for i in range(100, 110)))
+    store.refresh()
+
+    # A restart reads the partitions written above plus lines appended while it was down
+    with open(room_file, "a") as f:
+        f.write("".join(_line(i, 600) for i in range(110, 130)))
+    restarted = _store(room_file.parent, tmp_path / "partitions", True)
+    restarted.refresh()
+    assert len(restarted.readings) == 130
+    _assert_matches_fresh_load(restarted, room_file, tmp_path / "fresh", True)
@@ -0,0 +1,117 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ingest
+from agent_utils import normalize_columns
+from ingest import METRIC_COLUMNS, read_ndjson
+
+
+def _write_lines(path, lines):
+    with open(path, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def _legacy_parse(path):
+    """The parser ingest replaced: one json.loads per line, then normalize_columns"""
+    rows = []
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict):
+                rows.append(record)
+    return normalize_columns(pd.DataFrame(rows))
+
+
+@pytest.fixture
+def room_file(tmp_path):
+    rng = np.random.default_rng(0)
+    start = pd.Timestamp("2024-01-01T00:00:00Z")
+    lines = []
+    for i in range(500):
+        record = {
+            "timestamp": (start + pd.Timedelta(minutes=i)).isoformat(),
+            "co2": round(float(rng.normal(600, 80)), 2),
+            "temperature": round(float(rng.normal(21, 2)), 2),
+            "humidity": round(float(rng.normal(45, 5)), 2),
+        }
+        if i % 97 == 0:
+            del record["humidity"]
+        lines.append(json.dumps(record))
+        if i % 131 == 0:
+            lines.append("{not json")
+    path = tmp_path / "sensor_data_Room 1.ndjson"
+    _write_lines(path, lines)
+    return path
+
+
+def test_chunked_read_matches_legacy_parser(room_file, monkeypatch):
+    # Small chunks put chunk boundaries in the middle of many lines
+    monkeypatch.setattr(ingest, "CHUNK_BYTES", 257)
+    df, stats = read_ndjson(room_file)
+    legacy = _legacy_parse(room_file)
+
+    assert stats["rows"] == len(df) == len(legacy)
+    assert stats["dropped"] == 4
+    assert stats["end_offset"] == room_file.stat().st_size
+    expected = pd.to_datetime(legacy["timestamp"], utc=True)
+    assert (df["timestamp"].to_numpy() == expected.to_numpy()).all()
+    for metric in METRIC_COLUMNS:
+        np.testing.assert_allclose(
+            df[metric].to_numpy(np.float64),
+            legacy[metric].to_numpy(np.float64),
+            rtol=1e-6,
+        )
+
+
+def test_chunk_size_does_not_change_result(room_file, monkeypatch):
+    whole, _ = read_ndjson(room_file)
+    monkeypatch.setattr(ingest, "CHUNK_BYTES", 61)
+    chunked, _ = read_ndjson(room_file)
+    pd.testing.assert_frame_equal(whole, chunked)
+
+
+def test_column_variants_are_normalized(tmp_path):
+    path = tmp_path / "sensor_data_Room 2.ndjson"
+    _write_lines(path, [
+        json.dumps({"time": "2024-01-01T00:00:00Z", "CO2": 500, "temp": 20.5, "rh": 40}),
+        json.dumps({"time": "2024-01-01T00:01:00Z", "CO2": "510", "temp": 20.7, "rh": 41}),
+    ])
+    df, stats = read_ndjson(path)
+    legacy = _legacy_parse(path)
+    assert stats["rows"] == 2
+    assert set(df.columns) == {"timestamp", *METRIC_COLUMNS}
+    assert set(legacy.columns) == set(df.columns)
+    assert df["co2"].tolist() == [500.0, 510.0]
+
+
+def test_unterminated_line_is_left_for_next_read(tmp_path):
+    path = tmp_path / "sensor_data_Room 3.ndjson"
+    first = json.dumps({"timestamp": "2024-01-01T00:00:00Z", "co2": 500})
+    second = json.dumps({"timestamp": "2024-01-01T00:01:00Z", "co2": 510})
+    path.write_text(first + "\n" + second[:20])
+
+    df, stats = read_ndjson(path)
+    assert len(df) == 1
+    assert stats["dropped"] == 0
+    assert stats["end_offset"] == len(first) + 1
+
+    with open(path, "a") as f:
+        f.write(second[20:] + "\n")
+    tail, stats = read_ndjson(path, start=stats["end_offset"])
+    assert tail["co2"].tolist() == [510.0]
+    assert stats["end_offset"] == path.stat().st_size
+
+
+def test_empty_file_has_no_frame(tmp_path):
+    path = tmp_path / "sensor_data_Room 4.ndjson"
+    path.write_text("")
+    df, stats = read_ndjson(path)
+    assert df is None
+    assert stats["rows"] == 0
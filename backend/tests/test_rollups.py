@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from rollups import FREQUENCIES, RoomRollups, select_rooms
+
+
+def _assert_rollups_equal(actual, expected):
+    assert actual.levels.keys() == expected.levels.keys()
+    for freq, level in expected.levels.items():
+        merged = actual.levels[freq]
+        np.testing.assert_array_equal(merged.keys, level.keys)
+        assert merged.stats.keys() == level.stats.keys()
+        for metric, stats in level.stats.items():
+            np.testing.assert_allclose(merged.stats[metric], stats, rtol=1e-9, equal_nan=True)
+        assert merged.hist.keys() == level.hist.keys()
+        for metric, hist in level.hist.items():
+            np.testing.assert_array_equal(merged.hist[metric], hist)
+
+
+@pytest.mark.parametrize("split", [1, 90, 60 * 24, 5000, 20000])
+def test_merged_rollups_match_rebuild(readings_frame, split):
+    # Splits inside a minute, an hour and a day leave buckets that both halves share
+    head, tail = readings_frame.iloc[:split], readings_frame.iloc[split:]
+    merged = RoomRollups.from_frame(head).merge(RoomRollups.from_frame(tail))
+    _assert_rollups_equal(merged, RoomRollups.from_frame(readings_frame))
+
+
+def test_merge_of_interleaved_days(readings_frame):
+    day = readings_frame["timestamp"].dt.floor("D")
+    even = readings_frame[day.dt.day % 2 == 0]
+    odd = readings_frame[day.dt.day % 2 == 1]
+    merged = RoomRollups.from_frame(odd).merge(RoomRollups.from_frame(even))
+    _assert_rollups_equal(merged, RoomRollups.from_frame(readings_frame))
+
+
+def test_merge_chain_matches_rebuild(readings_frame):
+    chunks = np.array_split(np.arange(len(readings_frame)), 9)
+    rollups = None
+    for rows in chunks:
+        chunk = RoomRollups.from_frame(readings_frame.iloc[rows])
+        rollups = chunk if rollups is None else rollups.merge(chunk)
+    _assert_rollups_equal(rollups, RoomRollups.from_frame(readings_frame))
+
+
+def test_every_frequency_is_built(readings_frame):
+    rollups = RoomRollups.from_frame(readings_frame)
+    assert set(rollups.levels) == set(FREQUENCIES)
+    day = rollups.levels["day"]
+    assert len(day.keys) == 14
+    assert day.stats["co2"][:, 0].sum() == len(readings_frame)
+    assert day.stats["humidity"][:, 0].sum() == readings_frame["humidity"].notna().sum()
+
+
+@pytest.mark.parametrize("names", [
+    ["sensor_data_Room 1", "sensor_data_Room 2", "sensor_data_Room 10"],
+    ["Room 1", "Room 2", "Room 10"],
+])
+def test_select_rooms_accepts_labels_and_numbers(names):
+    assert select_rooms(names, None) == names
+    assert select_rooms(names, "room_1") == names[:1]
+    assert select_rooms(names, 10) == names[2:]
+    assert select_rooms(names, ["Room  2", "10"]) == names[1:]
+    assert select_rooms(names, "Room 3") == []
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging_config import setup_logger
+
+logger = setup_logger(__name__)
+
+# Queries slower than this many seconds are written to SLOW_QUERY_LOG (0 disables)
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "./data/.cache/slow_queries.log")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by label values"""
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            series = self._series.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.labels + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["buckets"]):
+                    lines.append(f"{self.name}_bucket{_label_text(bucket_labels, key + (f'{bound:g}',))} {count}")
+                lines.append(f"{self.name}_bucket{_label_text(bucket_labels, key + ('+Inf',))} {series['count']}")
+                lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_label_text(self.labels, key)} {series['count']}")
+        return lines
+
+
+class Counter:
+    """Prometheus-style monotonically increasing counter keyed by label values"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(self.labels, key)} {value}")
+        return lines
+
+
+QUERY_SECONDS = Histogram("aq_query_duration_seconds", "Time to answer a query", ("route", "outcome"))
+SPAN_SECONDS = Histogram("aq_span_duration_seconds", "Time spent in each stage of answering a query", ("span",))
+LLM_TOKENS = Counter("aq_llm_tokens_total", "Tokens reported by the LLM API", ("call", "kind"))
+METRICS = [QUERY_SECONDS, SPAN_SECONDS, LLM_TOKENS]
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Spans, token counts and attributes collected while answering one query"""
+
+    def __init__(self, query=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.query = query
+        self.started = time.perf_counter()
+        self.spans = []
+        self.tokens = {}
+        self.attrs = {}
+
+    def summary(self):
+        spans = " ".join(f"{name}={seconds:.3f}s" for name, seconds, _ in self.spans)
+        tokens = " ".join(
+            f"{call}_tokens={counts.get('prompt', 0)}+{counts.get('completion', 0)}"
+            for call, counts in self.tokens.items()
+        )
+        return " ".join(part for part in (spans, tokens) if part)
+
+    def finish(self):
+        duration = time.perf_counter() - self.started
+        route = self.attrs.get("route", "llm")
+        outcome = "ok" if self.attrs.get("success", True) else "error"
+        QUERY_SECONDS.observe(duration, route=route, outcome=outcome)
+        logger.info(f"Query {self.id} answered in {duration:.3f}s via {route} ({outcome}): {self.summary()}")
+        if SLOW_QUERY_SECONDS > 0 and duration >= SLOW_QUERY_SECONDS:
+            self._log_slow(duration)
+
+    def _log_slow(self, duration):
+        entry = {
+            "trace": self.id,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "query": self.query,
+            "seconds": round(duration, 4),
+            "spans": [{"name": name, "seconds": round(seconds, 4), **attrs} for name, seconds, attrs in self.spans],
+            "tokens": self.tokens,
+            **self.attrs,
+        }
+        logger.warning(f"Slow query {self.id} took {duration:.3f}s: {self.query}")
+        try:
+            os.makedirs(os.path.dirname(SLOW_QUERY_LOG) or ".", exist_ok=True)
+            with open(SLOW_QUERY_LOG, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+        except OSError as e:
+            logger.warning(f"Failed to write slow query log: {e}")
+
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def capture(query=None):
+    """Collect spans into a fresh Trace for the duration of the block"""
+    trace = Trace(query)
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # A streaming response closed from another task after a disconnect
+            pass
+
+
+@contextmanager
+def trace_query(query):
+    """Trace one query; its duration and spans are recorded when the block exits"""
+    with capture(query) as trace:
+        try:
+            yield trace
+        finally:
+            trace.finish()
+
+
+def record_span(name, seconds, **attrs):
+    SPAN_SECONDS.observe(seconds, span=name)
+    trace = _current.get()
+    if trace is not None:
+        trace.spans.append((name, seconds, attrs))
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as a stage of the current query"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - started, **attrs)
+
+
+def record_tokens(call, tokens):
+    for kind, count in tokens.items():
+        LLM_TOKENS.inc(count, call=call, kind=kind)
+    trace = _current.get()
+    if trace is not None:
+        trace.tokens[call] = tokens
+
+
+def set_attrs(**attrs):
+    """Attach attributes (route, generated code, ...) to the current query's trace"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
@@ -1,9 +1,30 @@
 import logging
 import re
-from openai import OpenAI
+from openai import AsyncOpenAI
+from tracing import record_tokens, span
 
 logger = logging.getLogger(__name__)
-client = OpenAI()
+
+# One async client per process so every LLM call reuses its connection pool
+client = AsyncOpenAI()
+
+def log_token_usage(call: str, response) -> dict:
+    """Log and return the token counts the API reported for one completion"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    tokens = {
+        "prompt": usage.prompt_tokens,
+        "cached_prompt": getattr(details, "cached_tokens", 0) or 0,
+        "completion": usage.completion_tokens,
+    }
+    logger.debug(
+        f"{call} tokens: prompt={tokens['prompt']} (cached {tokens['cached_prompt']}), "
+        f"completion={tokens['completion']}"
+    )
+    record_tokens(call, tokens)
+    return tokens
 
 def verify_query(text: str) -> bool:
     """Basic rule-based gibberish detector"""
@@ -13,27 +34,29 @@ def verify_query(text: str) -> bool:
         return True
     return False
 
-def is_query_valid(query: str) -> bool:
+async def is_query_valid(query: str) -> bool:
     """Use GPT to classify if the query is meaningful for air quality"""
     if verify_query(query):
         return False
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {
-                    "role": "system",
-                    "content": (
-                        "You are a validator. Only respond with 'Yes' or 'No'. "
-                        "Is the user query meaningful and related to air quality analysis? "
-                        "Examples: temperature trends, humidity, CO2 levels, air quality per room."
-                    ),
-                },
-                {"role": "user", "content": f"Query: {query}"},
-            ],
-            temperature=0
-        )
+        with span("validation"):
+            response = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {
+                        "role": "system",
+                        "content": (
+                            "You are a validator. Only respond with 'Yes' or 'No'. "
+                            "Is the user query meaningful and related to air quality analysis? "
+                            "Examples: temperature trends, humidity, CO2 levels, air quality per room."
+                        ),
+                    },
+                    {"role": "user", "content": f"Query: {query}"},
+                ],
+                temperature=0
+            )
+        log_token_usage("validation", response)
         answer = response.choices[0].message.content.strip().lower()
         return answer.startswith("yes")
     except Exception as e:
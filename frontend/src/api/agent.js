@@ -18,4 +18,78 @@ export const askQuestion = async (query) => {
     console.error('API Error:', message);
     throw new Error(message);
   }
-};
\ No newline at end of file
+};
+
+const parseEvent = (block) => {
+  let event = 'message';
+  const data = [];
+  block.split('\n').forEach((line) => {
+    if (line.startsWith('event:')) event = line.slice(6).trim();
+    else if (line.startsWith('data:')) data.push(line.slice(5).trim());
+  });
+  return data.length ? { event, data: JSON.parse(data.join('\n')) } : null;
+};
+
+// Same answer as askQuestion, but onEvent is called with each progress event
+// ('validation', 'token', 'execution') while the server works on it.
+export const streamQuestion = async (query, onEvent = () => {}) => {
+  if (!query?.trim()) {
+    throw new Error('Query is required');
+  }
+
+  const response = await fetch(`${process.env.REACT_APP_API_BASE_URL}/query/stream`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({ query }),
+  });
+  if (response.status === 429) {
+    return response.json();
+  }
+  if (!response.ok || !response.body) {
+    throw new Error('Failed to process question');
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+
+    let end = buffer.indexOf('\n\n');
+    while (end !== -1) {
+      const parsed = parseEvent(buffer.slice(0, end));
+      buffer = buffer.slice(end + 2);
+      if (parsed?.event === 'result') {
+        reader.cancel();
+        return parsed.data;
+      }
+      if (parsed) onEvent(parsed.event, parsed.data);
+      end = buffer.indexOf('\n\n');
+    }
+    if (done) {
+      throw new Error('The answer stream ended early');
+    }
+  }
+};
+
+export const fullResultUrl = (path) => `${process.env.REACT_APP_API_BASE_URL || ''}${path}`;
+
+export const fetchResultPage = async (resultId, offset, limit) => {
+  try {
+    const response = await apiClient.get(`/results/${resultId}`, {
+      params: { offset, limit },
+      responseType: 'text',
+    });
+    return response.data
+      .split('\n')
+      .filter((line) => line.trim())
+      .map((line) => JSON.parse(line));
+  } catch (error) {
+    const message = error.response?.status === 404
+      ? 'This result has expired. Please ask the question again.'
+      : 'Failed to load more rows';
+    console.error('API Error:', message);
+    throw new Error(message);
+  }
+};
@@ -3,7 +3,7 @@ import Message from './Message';
 import WelcomeScreen from './WelcomeScreen';
 import Loading from './Loading';
 
-const ChatArea = ({ messages = [], loading = false }) => {
+const ChatArea = ({ messages = [], loading = false, loadingMessage, onLoadMore }) => {
   const messagesEndRef = useRef(null);
   
   const scrollToBottom = () => {
@@ -30,9 +30,9 @@ const ChatArea = ({ messages = [], loading = false }) => {
     <div className="flex-1 overflow-y-auto px-6 py-4">
       <div className="max-w-4xl mx-auto">
         {messages.map((message) => (
-          <Message key={message.id} message={message} />
+          <Message key={message.id} message={message} onLoadMore={onLoadMore} />
         ))}
-        {loading && <Loading />}
+        {loading && <Loading message={loadingMessage} />}
         <div ref={messagesEndRef} />
       </div>
     </div>
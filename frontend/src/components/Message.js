@@ -1,4 +1,6 @@
-const Message = ({ message }) => {
+import { fullResultUrl } from '../api/agent';
+
+const Message = ({ message, onLoadMore }) => {
   if (message.type === 'user') {
     return (
       <div className="flex justify-end mb-6">
@@ -50,6 +52,37 @@ const Message = ({ message }) => {
                   </tbody>
                 </table>
               </div>
+              {message.tableData.downsampled ? (
+                <p className="mt-3 text-sm text-gray-600 dark:text-gray-300">
+                  Showing {message.tableData.data.length} of {message.tableData.totalRows} rows, keeping each
+                  period's highs and lows.{' '}
+                  <a
+                    href={fullResultUrl(message.tableData.downsampled.full_result)}
+                    target="_blank"
+                    rel="noopener noreferrer"
+                    className="text-blue-600 dark:text-blue-400 underline"
+                  >
+                    Full-resolution data
+                  </a>
+                </p>
+              ) : message.tableData.totalRows > message.tableData.data.length && (
+                <div className="flex items-center mt-3 space-x-3">
+                  <button
+                    type="button"
+                    onClick={() => onLoadMore?.(message)}
+                    disabled={message.tableData.loadingMore}
+                    className="px-3 py-1 text-sm rounded-md bg-blue-600 dark:bg-blue-500 text-white disabled:opacity-50"
+                  >
+                    {message.tableData.loadingMore ? 'Loading...' : 'Load more'}
+                  </button>
+                  <span className="text-sm text-gray-600 dark:text-gray-300">
+                    Showing {message.tableData.data.length} of {message.tableData.totalRows} rows
+                  </span>
+                  {message.tableData.loadError && (
+                    <span className="text-sm text-red-600 dark:text-red-400">{message.tableData.loadError}</span>
+                  )}
+                </div>
+              )}
             </div>
           ) : (
             <pre className="whitespace-pre-wrap text-sm bg-gray-200 dark:bg-gray-600 text-gray-800 dark:text-gray-200 p-3 rounded overflow-x-auto">
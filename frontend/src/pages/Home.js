@@ -1,5 +1,5 @@
 import React, { useState } from 'react';
-import { askQuestion } from '../api/agent';
+import { streamQuestion, fetchResultPage } from '../api/agent';
 import ChatHeader from '../components/ChatHeader';
 import ChatInput from '../components/ChatInput';
 import ChatArea from '../components/ChatArea';
@@ -29,7 +29,9 @@ const createAiMessage = (data) => {
     };
   }
 
-  const { type, data: outputData, columns } = data.output;
+  const {
+    type, data: outputData, columns, result_id: resultId, total_rows: totalRows, downsampled,
+  } = data.output;
 
   switch (type) {
     case 'text':
@@ -45,6 +47,9 @@ const createAiMessage = (data) => {
         tableData: {
           data: outputData,
           columns,
+          resultId,
+          totalRows: totalRows ?? outputData.length,
+          downsampled,
         },
       };
     default:
@@ -56,10 +61,26 @@ const createAiMessage = (data) => {
   }
 };
 
+const progressMessage = (event, data, tokens) => {
+  switch (event) {
+    case 'validation':
+      return data.valid ? 'Writing analysis code...' : 'Checking your question...';
+    case 'token':
+      return `Writing analysis code (${tokens} tokens)...`;
+    case 'rejected':
+      return 'Rewriting the analysis code...';
+    case 'execution':
+      return 'Running the analysis...';
+    default:
+      return undefined;
+  }
+};
+
 const Home = () => {
   const [query, setQuery] = useState('');
   const [messages, setMessages] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [loadingMessage, setLoadingMessage] = useState();
 
   const handleSearch = async () => {
     if (!query.trim() || loading) return;
@@ -70,9 +91,14 @@ const Home = () => {
     const currentQuery = query;
     setQuery('');
     setLoading(true);
+    setLoadingMessage('Checking your question...');
 
     try {
-      const data = await askQuestion(currentQuery);
+      let tokens = 0;
+      const data = await streamQuestion(currentQuery, (event, eventData) => {
+        if (event === 'token') tokens += 1;
+        setLoadingMessage(progressMessage(event, eventData, tokens));
+      });
       const aiMessage = createAiMessage(data);
       setMessages(prev => [...prev, aiMessage]);
     } catch (error) {
@@ -89,6 +115,25 @@ const Home = () => {
     }
   };
 
+  const updateTable = (messageId, update) => {
+    setMessages(prev => prev.map(message => (
+      message.id === messageId
+        ? { ...message, tableData: { ...message.tableData, ...update(message.tableData) } }
+        : message
+    )));
+  };
+
+  const loadMoreRows = async (message) => {
+    const { resultId, data: rows } = message.tableData;
+    updateTable(message.id, () => ({ loadingMore: true, loadError: null }));
+    try {
+      const page = await fetchResultPage(resultId, rows.length);
+      updateTable(message.id, (table) => ({ data: [...table.data, ...page], loadingMore: false }));
+    } catch (error) {
+      updateTable(message.id, () => ({ loadingMore: false, loadError: error.message }));
+    }
+  };
+
   const clearChat = () => {
     setMessages([]);
   };
@@ -102,6 +147,8 @@ const Home = () => {
       <ChatArea
         messages={messages}
         loading={loading}
+        loadingMessage={loadingMessage}
+        onLoadMore={loadMoreRows}
       />
       <ChatInput
         query={query}